@@ -0,0 +1,358 @@
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import psycopg2
+
+from config import DB_CONFIG
+from service_requetes import ServiceRequetes
+
+REPERTOIRE = os.path.dirname(os.path.abspath(__file__))
+
+# Taille de la France (échelle 1)
+NB_REGIONS = 18
+NB_DEPARTEMENTS = 101
+NB_COMMUNES = 35000
+
+ALPHABET = np.array(list('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+
+# Colonnes du fichier historique (millésime 2021) : population, superficie, logements,
+# naissances et décès
+ANNEES_RECENSEMENT = ['P21', 'P15', 'P10', 'D99', 'D90', 'D82', 'D75', 'D68']
+PERIODES = ['1520', '1014', '9909', '9099', '8290', '7582', '6875']
+
+
+def charger_module_import():
+    """Charge create&import_data.py (nom de fichier non importable tel quel)"""
+    spec = importlib.util.spec_from_file_location(
+        'create_import_data', os.path.join(REPERTOIRE, 'create&import_data.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _codes_base36(indices, largeur):
+    """Codes alphanumériques de largeur fixe pour un tableau d'entiers (vectorisé)"""
+    codes = np.full(len(indices), '', dtype=f'<U{largeur}')
+    for rang in range(largeur - 1, -1, -1):
+        codes = np.char.add(codes, ALPHABET[(indices // 36 ** rang) % 36])
+    return codes
+
+
+def generer_donnees(repertoire, echelle=1.0, graine=0, taille_bloc=200000):
+    """Génère des CSV synthétiques au format INSEE (régions, départements, communes, série historique)
+
+    echelle=1 correspond à la France ; les codes restent dans les largeurs du schéma
+    (2 caractères pour régions et départements, 5 pour les communes).
+    """
+    rng = np.random.default_rng(graine)
+    os.makedirs(repertoire, exist_ok=True)
+
+    nb_regions = min(max(1, round(NB_REGIONS * echelle)), 1200)
+    nb_departements = min(max(nb_regions, round(NB_DEPARTEMENTS * echelle)), 1200)
+    nb_communes = max(nb_departements, round(NB_COMMUNES * echelle))
+
+    # 1. Régions (codes à partir de '10' : pas de zéro initial)
+    codes_regions = _codes_base36(np.arange(36, 36 + nb_regions), 2)
+    chef_lieu_region = {}
+
+    # 2. Départements (pas de code commençant par '97' : réservé à l'outre-mer)
+    candidats = _codes_base36(np.arange(36, 72 + nb_departements), 2)
+    codes_departements = candidats[~np.char.startswith(candidats, '97')][:nb_departements]
+    region_dep = codes_regions[np.arange(nb_departements) % nb_regions]
+
+    # 3. Communes : code = département + 3 caractères
+    dep_commune = np.sort(rng.integers(0, nb_departements, nb_communes))
+    dep_commune[:nb_departements] = np.arange(nb_departements)  # au moins une commune par département
+    dep_commune = np.sort(dep_commune)
+    rang = np.arange(nb_communes) - np.searchsorted(dep_commune, dep_commune)
+    codes_communes = np.char.add(codes_departements[dep_commune], _codes_base36(rang, 3))
+    premieres = np.searchsorted(dep_commune, np.arange(nb_departements))
+
+    for i, reg in enumerate(region_dep):
+        chef_lieu_region.setdefault(reg, codes_communes[premieres[i]])
+
+    pd.DataFrame({
+        'REG': codes_regions,
+        'CHEFLIEU': [chef_lieu_region[r] for r in codes_regions],
+        'TNCC': '0',
+        'NCC': np.char.add('REGION ', codes_regions),
+        'NCCENR': np.char.add('Région ', codes_regions),
+        'LIBELLE': np.char.add('Région ', codes_regions),
+    }).to_csv(os.path.join(repertoire, 'v_region_2024.csv'), index=False)
+
+    pd.DataFrame({
+        'DEP': codes_departements,
+        'REG': region_dep,
+        'CHEFLIEU': codes_communes[premieres],
+        'TNCC': '0',
+        'NCC': np.char.add('DEPARTEMENT ', codes_departements),
+        'NCCENR': np.char.add('Département ', codes_departements),
+        'LIBELLE': np.char.add('Département ', codes_departements),
+    }).to_csv(os.path.join(repertoire, 'v_departement_2024.csv'), index=False)
+
+    pd.DataFrame({
+        'TYPECOM': 'COM',
+        'COM': codes_communes,
+        'REG': region_dep[dep_commune],
+        'DEP': codes_departements[dep_commune],
+        'CTCD': np.char.add(codes_departements[dep_commune], 'D'),
+        'ARR': np.char.add(codes_departements[dep_commune], (rang % 3 + 1).astype(str)),
+        'TNCC': '0',
+        'NCC': np.char.add('COMMUNE ', codes_communes),
+        'NCCENR': np.char.add('Commune ', codes_communes),
+        'LIBELLE': np.char.add('Commune ', codes_communes),
+        'CAN': np.char.add(codes_departements[dep_commune], np.char.zfill((rang % 40).astype(str), 2)),
+        'COMPARENT': '',
+    }).to_csv(os.path.join(repertoire, 'v_commune_2024.csv'), index=False)
+
+    # 4. Série historique, écrite par blocs (mémoire bornée même à l'échelle 100)
+    chemin_serie = os.path.join(repertoire, 'base-cc-serie-historique-2021.csv')
+    with open(chemin_serie, 'w', encoding='utf-8') as f:
+        for debut in range(0, nb_communes, taille_bloc):
+            codes = codes_communes[debut:debut + taille_bloc]
+            n = len(codes)
+            colonnes = {'CODGEO': codes}
+
+            population = np.round(rng.lognormal(6.0, 1.3, n))
+            for annee in ANNEES_RECENSEMENT:
+                colonnes[f'{annee}_POP'] = population
+                population = np.round(population / rng.normal(1.04, 0.05, n).clip(0.5, 2.0))
+            colonnes['SUPERF'] = np.round(rng.lognormal(2.5, 0.8, n), 2)
+            for annee in ANNEES_RECENSEMENT:
+                colonnes[f'{annee}_LOG'] = np.round(colonnes[f'{annee}_POP'] * rng.uniform(0.4, 0.7, n))
+            for periode in PERIODES:
+                colonnes[f'NAIS{periode}'] = np.round(colonnes['P21_POP'] * rng.uniform(0.03, 0.08, n))
+                colonnes[f'DECE{periode}'] = np.round(colonnes['P21_POP'] * rng.uniform(0.02, 0.06, n))
+
+            pd.DataFrame(colonnes).to_csv(f, sep=';', index=False, header=(debut == 0))
+
+    print(f"Données synthétiques (échelle {echelle}): {nb_regions} régions, "
+          f"{nb_departements} départements, {nb_communes} communes -> {repertoire}")
+    return {
+        'regions': nb_regions,
+        'departements': nb_departements,
+        'communes': nb_communes,
+        'region_exemple': f"Région {codes_regions[0]}",
+        'departement_exemple': str(codes_departements[0]),
+    }
+
+
+def _port_libre():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def postgres_jetable(repertoire_bin=None):
+    """Instance PostgreSQL temporaire (initdb + pg_ctl), détruite en sortie"""
+    initdb = shutil.which('initdb', path=repertoire_bin)
+    pg_ctl = shutil.which('pg_ctl', path=repertoire_bin)
+    if not initdb or not pg_ctl:
+        raise RuntimeError("initdb / pg_ctl introuvables : préciser --pg-bin ou utiliser --serveur")
+
+    donnees = tempfile.mkdtemp(prefix='insee_pg_')
+    port = _port_libre()
+    try:
+        subprocess.run([initdb, '-D', donnees, '-U', 'postgres', '--auth=trust', '-E', 'UTF8'],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([pg_ctl, '-D', donnees, '-w', '-l', os.path.join(donnees, 'journal.log'),
+                        '-o', f'-p {port} -k {donnees} -c fsync=off', 'start'],
+                       check=True, stdout=subprocess.DEVNULL)
+        yield {'host': 'localhost', 'port': port, 'user': 'postgres', 'database': 'postgres'}
+    finally:
+        subprocess.run([pg_ctl, '-D', donnees, '-m', 'fast', 'stop'],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        shutil.rmtree(donnees, ignore_errors=True)
+
+
+@contextmanager
+def base_jetable(serveur):
+    """Base de données temporaire sur un serveur existant, supprimée en sortie"""
+    nom = f"insee_bench_{os.getpid()}"
+    admin = psycopg2.connect(**serveur)
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cur:
+            cur.execute(f"CREATE DATABASE {nom}")
+        yield dict(serveur, database=nom)
+    finally:
+        with admin.cursor() as cur:
+            cur.execute(f"DROP DATABASE IF EXISTS {nom}")
+        admin.close()
+
+
+def rss_max_ko():
+    """Pic de mémoire résidente du processus (Ko)"""
+    pic = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pic // 1024 if sys.platform == 'darwin' else pic
+
+
+def _centiles(durees):
+    return {
+        'n': len(durees),
+        'p50_ms': round(float(np.percentile(durees, 50)) * 1000, 3),
+        'p95_ms': round(float(np.percentile(durees, 95)) * 1000, 3),
+        'max_ms': round(max(durees) * 1000, 3),
+    }
+
+
+def mesurer_chargement(db_config, repertoire, massif=False, format_copy='texte'):
+    """Chronomètre chaque étape du chargeur de create&import_data.py (massif : mode --massif)"""
+    loader = charger_module_import()
+    etapes = [
+        ('create_tables', loader.create_tables, None),
+        *([('preparer_chargement_massif', loader.preparer_chargement_massif, None)] if massif else []),
+        ('import_regions', lambda conn: loader.import_regions(conn, format_copy=format_copy), 'region'),
+        ('import_departements', lambda conn: loader.import_departements(conn, format_copy=format_copy),
+         'departement'),
+        ('import_niveaux', loader.import_niveaux, 'canton'),
+        ('import_communes', lambda conn: loader.import_communes(conn, format_copy=format_copy), 'commune'),
+        ('import_chefs_lieux', lambda conn: loader.import_chefs_lieux(conn, format_copy=format_copy),
+         'chef_lieu_departement'),
+        ('importer_types_statistiques', loader.importer_types_statistiques, 'type_statistique'),
+        ('importer_statistiques_communes',
+         lambda conn: loader.importer_statistiques_communes(conn, 'base-cc-serie-historique-2021.csv',
+                                                            format_copy=format_copy),
+         'statistique'),
+        ('rafraichir_populations', loader.rafraichir_populations, 'population_departement'),
+        ('finaliser_chargement_massif', lambda conn: loader.finaliser_chargement_massif(conn, db_config), None)
+        if massif else ('analyser_tables', loader.analyser_tables, None),
+        ('rafraichir_hierarchie', loader.rafraichir_hierarchie, 'agregat_niveau'),
+        ('rafraichir_classements', loader.rafraichir_classements, 'classement'),
+        ('verify_import', loader.verify_import, None),
+    ]
+
+    resultats = []
+    dossier_initial = os.getcwd()
+    conn = psycopg2.connect(**db_config)
+    try:
+        os.chdir(repertoire)  # les importeurs lisent les fichiers par leur nom
+        for nom, etape, table in etapes:
+            debut = time.perf_counter()
+            etape(conn)
+            duree = time.perf_counter() - debut
+            lignes = None
+            if table:
+                with conn.cursor() as cur:
+                    cur.execute(f"SELECT COUNT(*) FROM {table}")
+                    lignes = cur.fetchone()[0]
+                conn.commit()
+            resultats.append({
+                'etape': nom,
+                'duree_s': round(duree, 4),
+                'lignes': lignes,
+                'lignes_par_s': round(lignes / duree, 1) if lignes and duree > 0 else None,
+                'rss_max_ko': rss_max_ko(),
+            })
+    finally:
+        os.chdir(dossier_initial)
+        conn.close()
+    return resultats
+
+
+def mesurer_requetes(db_config, exemples, repetitions=50):
+    """Latences p50 / p95 de chaque requête du catalogue de question1"""
+    appels = {
+        'departements_region': lambda s: s.departements_region(exemples['region_exemple']),
+        'communes_au_dessus': lambda s: s.communes_au_dessus(exemples['departement_exemple'], 1000),
+        'taux_croissance': lambda s: s.taux_croissance(15, 21),
+        'explorer_donnees': lambda s: s.explorer(),
+        # Première et dernière page d'un classement : même coût attendu
+        'classement_premiere_page': lambda s: s.classement('population', 'commune', taille=50),
+        'classement_derniere_page': lambda s: s.classement('population', 'commune', taille=50, croissant=True),
+    }
+    resultats = []
+    with ServiceRequetes(db_config, taille_pool=1) as service:
+        for nom, appel in appels.items():
+            appel(service)  # chauffe + PREPARE
+            durees = []
+            for _ in range(repetitions):
+                debut = time.perf_counter()
+                appel(service)
+                durees.append(time.perf_counter() - debut)
+            resultats.append(dict(requete=nom, **_centiles(durees)))
+    return resultats
+
+
+def executer_benchmark(echelle, exemples, db_config, repertoire, repetitions, massif=False,
+                       format_copy='texte'):
+    """Chargement + requêtes pour une échelle (données déjà générées) ; résultat sérialisable en JSON"""
+    chargement = mesurer_chargement(db_config, repertoire, massif, format_copy)
+    requetes = mesurer_requetes(db_config, exemples, repetitions)
+    return {
+        'echelle': echelle,
+        'massif': massif,
+        'format_copy': format_copy,
+        'volumes': {cle: exemples[cle] for cle in ('regions', 'departements', 'communes')},
+        'chargement': chargement,
+        'requetes': requetes,
+        'rss_max_ko': rss_max_ko(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark du chargeur et des requêtes sur données synthétiques")
+    parser.add_argument('--echelle', type=float, nargs='+', default=[1.0],
+                        help="Échelles à mesurer (1 = France, 10, 100...)")
+    parser.add_argument('--repetitions', type=int, default=50, help="Exécutions par requête")
+    parser.add_argument('--sortie', help="Fichier JSON de résultats (sinon sortie standard)")
+    parser.add_argument('--pg-bin', help="Répertoire des binaires PostgreSQL (initdb, pg_ctl)")
+    parser.add_argument('--serveur', action='store_true',
+                        help="Utiliser le serveur de DB_CONFIG avec une base temporaire plutôt qu'initdb")
+    parser.add_argument('--donnees', help="Répertoire des CSV générés (temporaire par défaut)")
+    parser.add_argument('--format-copy', nargs='+', choices=['binaire', 'texte'], default=['texte'],
+                        help="Formats de COPY à comparer (un chargement complet par format)")
+    parser.add_argument('--massif', action='store_true',
+                        help="Mesure le chargement en mode massif (tables UNLOGGED, index différés)")
+    args = parser.parse_args()
+
+    rapport = {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine': {'systeme': platform.platform(), 'python': platform.python_version(),
+                    'processeurs': os.cpu_count()},
+        'resultats': [],
+    }
+    for echelle in args.echelle:
+        repertoire = args.donnees or tempfile.mkdtemp(prefix='insee_csv_')
+        try:
+            exemples = generer_donnees(repertoire, echelle)
+            # Une base vide par format de COPY : chargements comparables
+            for format_copy in args.format_copy:
+                serveur = base_jetable(DB_CONFIG) if args.serveur else postgres_jetable(args.pg_bin)
+                with serveur as db_config:
+                    if args.serveur:
+                        rapport['resultats'].append(executer_benchmark(
+                            echelle, exemples, db_config, repertoire, args.repetitions, args.massif, format_copy))
+                    else:
+                        with base_jetable(db_config) as base:
+                            rapport['resultats'].append(executer_benchmark(
+                                echelle, exemples, base, repertoire, args.repetitions, args.massif, format_copy))
+        finally:
+            if not args.donnees:
+                shutil.rmtree(repertoire, ignore_errors=True)
+
+    texte = json.dumps(rapport, indent=2, ensure_ascii=False)
+    if args.sortie:
+        with open(args.sortie, 'w', encoding='utf-8') as f:
+            f.write(texte)
+        print(f"Résultats écrits dans {args.sortie}")
+    else:
+        print(texte)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import time
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+import psycopg2
+from tabulate import tabulate
+
+from config import DB_CONFIG
+from service_requetes import CATALOGUE, RAPPORTS_EXPLORATION
+from version_donnees import lire_version
+
+def signature_donnees(conn):
+    """Signature de l'état des données : compteur de version incrémenté par chaque import
+
+    Bases antérieures au compteur : compteurs de lignes modifiées + fichiers physiques
+    (un TRUNCATE change de fichier).
+    """
+    version = lire_version(conn)
+    if version is not None:
+        return version
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT relname, n_tup_ins + n_tup_upd + n_tup_del, pg_relation_filenode(relid)
+            FROM pg_stat_user_tables
+            WHERE relname IN ('region', 'departement', 'commune', 'type_statistique', 'statistique')
+            ORDER BY relname
+        """)
+        signature = tuple(cur.fetchall())
+    conn.commit()
+    return signature
+
+
+class MoteurColonnaire:
+    """Statistiques en mémoire : matrice (commune, indicateur) + hiérarchie commune -> département -> région
+
+    valeurs[i, j] est la valeur de l'indicateur j pour la commune i (NaN si absente) ;
+    dep_commune et reg_departement sont des indices dans les tableaux de départements et de régions.
+    """
+
+    def __init__(self, codes_communes, noms_communes, dep_commune,
+                 codes_departements, noms_departements, reg_departement,
+                 codes_regions, noms_regions, types, valeurs):
+        self.codes_communes = codes_communes
+        self.noms_communes = noms_communes
+        self.dep_commune = dep_commune
+        self.codes_departements = codes_departements
+        self.noms_departements = noms_departements
+        self.reg_departement = reg_departement
+        self.codes_regions = codes_regions
+        self.noms_regions = noms_regions
+        self.types = list(types)
+        self.valeurs = valeurs
+
+        self.index_type = {nom: j for j, nom in enumerate(self.types)}
+        self.reg_commune = self.reg_departement[self.dep_commune]
+
+    @classmethod
+    def depuis_base(cls, conn):
+        """Charge hiérarchie et statistiques depuis PostgreSQL (une passe par table)"""
+        with conn.cursor() as cur:
+            cur.execute("SELECT reg_id, name FROM region ORDER BY reg_id")
+            regions = cur.fetchall()
+            cur.execute("SELECT dep_id, name, reg_id FROM departement ORDER BY dep_id")
+            departements = cur.fetchall()
+            cur.execute("SELECT com_id, code_insee, name, dep_id FROM commune ORDER BY com_id")
+            communes = cur.fetchall()
+            cur.execute("SELECT id, nom FROM type_statistique ORDER BY id")
+            types = cur.fetchall()
+
+            # Statistiques : COPY texte puis analyse vectorisée (pas de tuples Python)
+            tampon = StringIO()
+            cur.copy_expert(
+                "COPY (SELECT com_id, type_id, valeur FROM statistique WHERE valeur IS NOT NULL) TO STDOUT",
+                tampon
+            )
+        conn.commit()
+        tampon.seek(0)
+        stats = pd.read_csv(tampon, sep='\t', header=None, names=['com_id', 'type_id', 'valeur'],
+                            dtype={'com_id': np.int64, 'type_id': np.int64, 'valeur': np.float64})
+
+        index_region = {reg_id: i for i, (reg_id, _) in enumerate(regions)}
+        index_dep = {dep_id: i for i, (dep_id, _, _) in enumerate(departements)}
+
+        com_ids = np.array([c[0] for c in communes], dtype=np.int64)
+        type_ids = np.array([t[0] for t in types], dtype=np.int64)
+
+        # com_id / type_id triés : position par recherche dichotomique
+        lignes = np.searchsorted(com_ids, stats['com_id'].to_numpy())
+        colonnes = np.searchsorted(type_ids, stats['type_id'].to_numpy())
+        valeurs = np.full((len(communes), len(types)), np.nan)
+        valeurs[lignes, colonnes] = stats['valeur'].to_numpy()
+
+        return cls(
+            codes_communes=np.array([c[1] for c in communes]),
+            noms_communes=np.array([c[2] for c in communes], dtype=object),
+            dep_commune=np.array([index_dep[c[3]] for c in communes], dtype=np.int32),
+            codes_departements=np.array([d[0] for d in departements]),
+            noms_departements=np.array([d[1] for d in departements], dtype=object),
+            reg_departement=np.array([index_region[d[2]] for d in departements], dtype=np.int32),
+            codes_regions=np.array([r[0] for r in regions]),
+            noms_regions=np.array([r[1] for r in regions], dtype=object),
+            types=[t[1] for t in types],
+            valeurs=valeurs,
+        )
+
+    def colonne(self, nom_type):
+        """Vecteur des valeurs d'un indicateur pour toutes les communes (NaN si absente)"""
+        if nom_type not in self.index_type:
+            return np.full(len(self.codes_communes), np.nan)
+        return self.valeurs[:, self.index_type[nom_type]]
+
+    def _somme_par(self, groupes, nb_groupes, valeurs):
+        """Somme des valeurs présentes par groupe ; renvoie (sommes, nombre de valeurs)"""
+        presentes = ~np.isnan(valeurs)
+        sommes = np.bincount(groupes[presentes], weights=valeurs[presentes], minlength=nb_groupes)
+        nombres = np.bincount(groupes[presentes], minlength=nb_groupes)
+        return sommes, nombres
+
+    @staticmethod
+    def _top(scores, k):
+        """Indices des k plus grands scores (NaN exclus), par ordre décroissant"""
+        candidats = np.flatnonzero(~np.isnan(scores))
+        if k is not None and k < len(candidats):
+            candidats = candidats[np.argpartition(-scores[candidats], k - 1)[:k]]
+        return candidats[np.argsort(-scores[candidats], kind='stable')]
+
+    # Catalogue
+    def top_communes(self, nom_type='P21_POP', k=5):
+        """Top K des communes pour un indicateur : (commune, département, valeur)"""
+        valeurs = self.colonne(nom_type)
+        return [(self.noms_communes[i], self.noms_departements[self.dep_commune[i]], valeurs[i])
+                for i in self._top(valeurs, k)]
+
+    def communes_au_dessus(self, department_code, min_population, nom_type='P21_POP'):
+        """Communes de plus de X habitants dans un département : (commune, population)"""
+        valeurs = self.colonne(nom_type)
+        dep = np.flatnonzero(self.codes_departements == department_code)
+        if len(dep) == 0:
+            return []
+        scores = np.where((self.dep_commune == dep[0]) & (valeurs > min_population), valeurs, np.nan)
+        return [(self.noms_communes[i], valeurs[i]) for i in self._top(scores, None)]
+
+    def somme_par_region(self, nom_type='P21_POP'):
+        """Somme d'un indicateur par région, par ordre décroissant : (région, total)"""
+        sommes, nombres = self._somme_par(self.reg_commune, len(self.codes_regions), self.colonne(nom_type))
+        scores = np.where(nombres > 0, sommes, np.nan)
+        return [(self.noms_regions[r], sommes[r]) for r in self._top(scores, None)]
+
+    def somme_par_departement(self, nom_type='P21_POP'):
+        """Somme d'un indicateur par département, par ordre décroissant : (département, total)"""
+        sommes, nombres = self._somme_par(self.dep_commune, len(self.codes_departements), self.colonne(nom_type))
+        scores = np.where(nombres > 0, sommes, np.nan)
+        return [(self.noms_departements[d], sommes[d]) for d in self._top(scores, None)]
+
+    def densite_par_departement(self, k=5, nom_population='P21_POP'):
+        """Densité (hab/km²) par département, communes ayant population et superficie"""
+        pop = self.colonne(nom_population)
+        surf = self.colonne('SUPERF')
+        completes = ~np.isnan(pop) & ~np.isnan(surf)
+        nb = len(self.codes_departements)
+        somme_pop = np.bincount(self.dep_commune[completes], weights=pop[completes], minlength=nb)
+        somme_surf = np.bincount(self.dep_commune[completes], weights=surf[completes], minlength=nb)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            densite = np.round(np.where(somme_surf > 0, somme_pop / somme_surf, np.nan), 2)
+        return [(self.noms_departements[d], densite[d]) for d in self._top(densite, k)]
+
+    def croissance_par_region(self, start_year, end_year):
+        """Taux de croissance par région : (région, pop début, pop fin, taux %)"""
+        nb = len(self.codes_regions)
+        debut, n_debut = self._somme_par(self.reg_commune, nb, self.colonne(f'P{start_year}_POP'))
+        fin, n_fin = self._somme_par(self.reg_commune, nb, self.colonne(f'P{end_year}_POP'))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            taux = np.round((fin - debut) * 100.0 / debut, 2)
+        taux = np.where((n_debut > 0) & (n_fin > 0), taux, np.nan)
+        return [(self.noms_regions[r], debut[r], fin[r], taux[r]) for r in self._top(taux, None)]
+
+    def evolution_communes(self, nom_debut='P15_POP', nom_fin='P21_POP', k=5):
+        """Communes à la plus forte évolution : (commune, département, pop début, pop fin, %)"""
+        debut = self.colonne(nom_debut)
+        fin = self.colonne(nom_fin)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            evolution = np.round(np.where(debut > 0, (fin - debut) * 100.0 / debut, np.nan), 2)
+        return [(self.noms_communes[i], self.noms_departements[self.dep_commune[i]],
+                 debut[i], fin[i], evolution[i])
+                for i in self._top(evolution, k)]
+
+    def explorer(self):
+        """Mêmes rapports que explorer_donnees, calculés en mémoire"""
+        resultats = [
+            self.top_communes('P21_POP', 5),
+            self.somme_par_region('P21_POP'),
+            self.evolution_communes('P15_POP', 'P21_POP', 5),
+            self.densite_par_departement(5),
+        ]
+        return {CATALOGUE[nom]["titre"]: lignes for nom, lignes in zip(RAPPORTS_EXPLORATION, resultats)}
+
+
+class CacheColonnaire:
+    """Moteur colonnaire optionnel, rechargé quand la base change"""
+
+    def __init__(self, db_config=None, intervalle_verification=5.0):
+        self._conn = psycopg2.connect(**(db_config or DB_CONFIG))
+        self.intervalle_verification = intervalle_verification
+        self._moteur = None
+        self._signature = None
+        self._derniere_verification = 0.0
+        self.rechargements = 0
+
+    def fermer(self):
+        self._conn.close()
+
+    def moteur(self):
+        """Moteur à jour ; la signature de la base est vérifiée au plus toutes les N secondes"""
+        maintenant = time.monotonic()
+        if self._moteur is None or maintenant - self._derniere_verification >= self.intervalle_verification:
+            self._derniere_verification = maintenant
+            signature = signature_donnees(self._conn)
+            if signature != self._signature:
+                debut = time.perf_counter()
+                self._moteur = MoteurColonnaire.depuis_base(self._conn)
+                self._signature = signature
+                self.rechargements += 1
+                print(f"Cache colonnaire (re)chargé en {time.perf_counter() - debut:.2f}s: "
+                      f"{self._moteur.valeurs.shape[0]} communes x {self._moteur.valeurs.shape[1]} indicateurs")
+        return self._moteur
+
+
+if __name__ == "__main__":
+    cache = CacheColonnaire(DB_CONFIG)
+    try:
+        moteur = cache.moteur()
+        debut = time.perf_counter()
+        resultats = moteur.explorer()
+        duree = time.perf_counter() - debut
+        for nom in RAPPORTS_EXPLORATION:
+            titre = CATALOGUE[nom]["titre"]
+            print(f"\n\033[1m=== {titre} ===\033[0m")
+            print(tabulate(resultats[titre], headers=CATALOGUE[nom]["headers"], tablefmt="pretty"))
+        print(f"\nCatalogue calculé en mémoire en {duree * 1e6:.0f} µs")
+    finally:
+        cache.fermer()
@@ -0,0 +1,134 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from config import DB_CONFIG
+from service_requetes import ServiceRequetes, cle_requete
+from version_donnees import EcouteVersion
+
+
+def taille_resultat(lignes):
+    """Empreinte mémoire approximative d'un résultat (liste de tuples), en octets"""
+    taille = sys.getsizeof(lignes)
+    for ligne in lignes:
+        taille += sys.getsizeof(ligne) + sum(sys.getsizeof(valeur) for valeur in ligne)
+    return taille
+
+
+class CacheLRU:
+    """Cache LRU borné en octets ; chaque entrée porte la version des données qui l'a produite"""
+
+    def __init__(self, taille_max_octets=64 * 1024 * 1024):
+        self.taille_max_octets = taille_max_octets
+        self._entrees = OrderedDict()  # clé -> (version, résultat, taille)
+        self._verrou = threading.Lock()
+        self.taille_octets = 0
+        self.succes = 0
+        self.echecs = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def lire(self, cle, version):
+        with self._verrou:
+            entree = self._entrees.get(cle)
+            if entree is None or entree[0] != version:
+                self.echecs += 1
+                return None
+            self._entrees.move_to_end(cle)
+            self.succes += 1
+            return entree[1]
+
+    def ecrire(self, cle, version, resultat):
+        taille = taille_resultat(resultat)
+        if taille > self.taille_max_octets:
+            return  # un résultat plus gros que tout le cache n'est pas conservé
+        with self._verrou:
+            ancienne = self._entrees.pop(cle, None)
+            if ancienne is not None:
+                self.taille_octets -= ancienne[2]
+            self._entrees[cle] = (version, resultat, taille)
+            self.taille_octets += taille
+            while self.taille_octets > self.taille_max_octets:
+                _, (_, _, taille_evincee) = self._entrees.popitem(last=False)
+                self.taille_octets -= taille_evincee
+                self.evictions += 1
+
+    def vider(self):
+        """Invalide toutes les entrées (nouvelle version des données)"""
+        with self._verrou:
+            self.invalidations += len(self._entrees)
+            self._entrees.clear()
+            self.taille_octets = 0
+
+    def statistiques(self):
+        with self._verrou:
+            total = self.succes + self.echecs
+            return {
+                'entrees': len(self._entrees),
+                'taille_octets': self.taille_octets,
+                'taille_max_octets': self.taille_max_octets,
+                'succes': self.succes,
+                'echecs': self.echecs,
+                'taux_succes': self.succes / total if total else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+class ServiceEnCache(ServiceRequetes):
+    """ServiceRequetes précédé d'un cache de résultats invalidé à chaque nouvelle version des données
+
+    Les importeurs incrémentent version_donnees au COMMIT et envoient un NOTIFY : les entrées
+    des versions précédentes ne sont plus jamais servies.
+    """
+
+    def __init__(self, db_config=None, taille_pool=5, attente_max=None,
+                 taille_cache_octets=64 * 1024 * 1024, intervalle_relecture=30.0):
+        super().__init__(db_config, taille_pool, attente_max)
+        self.cache = CacheLRU(taille_cache_octets)
+        self._ecoute = EcouteVersion(db_config or DB_CONFIG, intervalle_relecture)
+        self._verrou_version = threading.Lock()
+        self._version = None
+        # (version, classements à jour) : relu une fois par version des données
+        self._classements = (None, False)
+
+    def fermer(self):
+        self._ecoute.fermer()
+        super().fermer()
+
+    def version(self):
+        """Version courante des données ; vide le cache quand elle change"""
+        with self._verrou_version:
+            version = self._ecoute.version(time.monotonic())
+            if version != self._version:
+                if self._version is not None:
+                    self.cache.vider()
+                self._version = version
+            return version
+
+    def classements_a_jour(self):
+        version = self.version()
+        if self._classements[0] != version:
+            self._classements = (version, super().classements_a_jour())
+        return self._classements[1]
+
+    def executer(self, nom, params=()):
+        """Résultat en cache pour la version courante, sinon exécution et mise en cache"""
+        version = self.version()
+        cle = cle_requete(nom, params)
+        resultat = self.cache.lire(cle, version)
+        if resultat is None:
+            resultat = super().executer(nom, params)
+            self.cache.ecrire(cle, version, resultat)
+        else:
+            # Durée None : appel servi par le cache, compté par le journal du conseiller d'index
+            for observateur in self.observateurs:
+                observateur(nom, params, None)
+        return resultat
+
+    def compteurs(self):
+        stats = super().compteurs()
+        stats['version_donnees'] = self._version
+        stats['cache'] = self.cache.statistiques()
+        return stats
@@ -0,0 +1,234 @@
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+import psycopg2
+from tabulate import tabulate
+
+from config import DB_CONFIG
+from service_requetes import CATALOGUE
+
+REPERTOIRE = os.path.dirname(os.path.abspath(__file__))
+FICHIER_QUESTION6 = os.path.join(REPERTOIRE, 'question6.sql')
+FICHIER_REFERENCE = os.path.join(REPERTOIRE, 'plans', 'reference.json')
+
+# Paramètres d'exemple des requêtes du catalogue qui en prennent
+PARAMETRES_EXEMPLE = {
+    "departements_region": ('Île-de-France',),
+    "communes_au_dessus": ('69', 1000),
+    "communes_au_dessus_classement": ('69', 1000),
+    "taux_croissance": ('P15_POP', 'P21_POP'),
+    "departements_regions": (['Île-de-France', 'Occitanie', 'Bretagne'],),
+    "communes_au_dessus_lot": (['69', '75', '13'], [1000, 1000, 1000]),
+    "classement_suivant": ('population', 'commune', 30000, 50),
+    "classement_precedent": ('densite', 'commune', 50, 50),
+    "classement_parent_suivant": ('croissance', 'commune', '69', 100, 50),
+    "classement_parent_precedent": ('population', 'departement', '84', 3, 50),
+    "classement_position": ('population', 'commune', '69123'),
+}
+
+NOEUDS_JOINTURE = ('Nested Loop', 'Hash Join', 'Merge Join')
+
+# Erreur d'estimation signalée à partir d'un facteur 10 entre lignes estimées et réelles
+SEUIL_ESTIMATION = 10.0
+
+
+def requetes_question6(fichier=FICHIER_QUESTION6):
+    """Requêtes analysées par question6.sql (EXPLAIN retiré, doublons avant/après index fusionnés)"""
+    with open(fichier, encoding='utf-8') as f:
+        script = f.read()
+    requetes = {}
+    for requete in re.findall(r'^EXPLAIN[^\n]*\n(.*?);', script, flags=re.S | re.M):
+        requete = requete.strip()
+        if requete not in requetes.values():
+            requetes[f"q6_cas{len(requetes) + 1}"] = requete
+    return requetes
+
+
+def requetes_enregistrees():
+    """Toutes les requêtes suivies : catalogue de question1 + cas de question6"""
+    requetes = {nom: (entree["requete"], PARAMETRES_EXEMPLE.get(nom, ()))
+                for nom, entree in CATALOGUE.items()}
+    for nom, requete in requetes_question6().items():
+        requetes[nom] = (requete, ())
+    return requetes
+
+
+def expliquer(cur, nom, requete, params=(), options="EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)"):
+    """EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) d'une requête ; $1, $2... via PREPARE
+
+    options remplace la commande EXPLAIN (ex. coûts seuls, sans exécution : "EXPLAIN (FORMAT JSON)").
+    """
+    if re.search(r'\$\d', requete):
+        cur.execute(f"PREPARE plan_{nom} AS {requete}")
+        try:
+            marqueurs = ', '.join(['%s'] * len(params))
+            cur.execute(f"{options} EXECUTE plan_{nom} ({marqueurs})", tuple(params))
+            resultat = cur.fetchone()[0]
+        finally:
+            cur.execute(f"DEALLOCATE plan_{nom}")
+    else:
+        cur.execute(f"{options} {requete}")
+        resultat = cur.fetchone()[0]
+    # psycopg2 décode le json ; selon la version du serveur il peut arriver en texte
+    if isinstance(resultat, str):
+        resultat = json.loads(resultat)
+    return resultat[0]
+
+
+def parcourir(noeud, chemin=()):
+    """Parcours en profondeur du plan : (identifiant du noeud, noeud)"""
+    libelle = noeud['Node Type']
+    if 'Relation Name' in noeud:
+        libelle += f"({noeud['Relation Name']})"
+    chemin = chemin + (libelle,)
+    yield ' > '.join(chemin), noeud
+    for enfant in noeud.get('Plans', []):
+        yield from parcourir(enfant, chemin)
+
+
+def resumer_plan(explain):
+    """Éléments comparables d'un plan : jointures, scans séquentiels, estimations, temps, buffers"""
+    racine = explain['Plan']
+    jointures = []
+    scans_statistique = []
+    estimations = {}
+    for identifiant, noeud in parcourir(racine):
+        if noeud['Node Type'] in NOEUDS_JOINTURE:
+            jointures.append(noeud['Node Type'])
+        if noeud['Node Type'].endswith('Seq Scan') and noeud.get('Relation Name') == 'statistique':
+            scans_statistique.append(identifiant)
+        # Lignes par boucle dans les deux cas : directement comparables
+        estimees = noeud.get('Plan Rows', 0)
+        reelles = noeud.get('Actual Rows', 0)
+        if noeud.get('Actual Loops', 1):
+            rapport = max(estimees, reelles) / max(min(estimees, reelles), 1)
+            if rapport >= SEUIL_ESTIMATION:
+                estimations[identifiant] = {'estimees': estimees, 'reelles': reelles,
+                                            'facteur': round(rapport, 1)}
+    return {
+        'jointures': jointures,
+        'scans_sequentiels_statistique': scans_statistique,
+        'erreurs_estimation': estimations,
+        'execution_ms': explain.get('Execution Time'),
+        'planification_ms': explain.get('Planning Time'),
+        'buffers_lus_cache': racine.get('Shared Hit Blocks', 0),
+        'buffers_lus_disque': racine.get('Shared Read Blocks', 0),
+    }
+
+
+def capturer_plans(conn, requetes=None):
+    """Capture le plan de chaque requête enregistrée ; renvoie {nom: capture}"""
+    requetes = requetes or requetes_enregistrees()
+    captures = {}
+    try:
+        with conn.cursor() as cur:
+            for nom, (requete, params) in requetes.items():
+                explain = expliquer(cur, nom, requete, params)
+                captures[nom] = dict(
+                    resumer_plan(explain),
+                    requete=' '.join(requete.split()),
+                    parametres=list(params),
+                    plan=explain,
+                )
+    finally:
+        # EXPLAIN ANALYZE exécute les requêtes : rien ne doit être conservé
+        conn.rollback()
+    return {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'serveur': conn.server_version,
+        'plans': captures,
+    }
+
+
+def comparer_plans(reference, capture, facteur_temps=2.0):
+    """Régressions de plan par rapport à la référence : liste de (requête, type, détail)"""
+    regressions = []
+    for nom, actuel in capture['plans'].items():
+        ancien = reference['plans'].get(nom)
+        if ancien is None:
+            regressions.append((nom, 'nouvelle requête', 'pas de plan de référence'))
+            continue
+        if ancien['requete'] != actuel['requete']:
+            regressions.append((nom, 'requête modifiée', 'texte différent de la référence'))
+
+        # 1. Stratégie de jointure
+        if ancien['jointures'] != actuel['jointures']:
+            regressions.append((nom, 'stratégie de jointure',
+                                f"{', '.join(ancien['jointures']) or '-'} -> {', '.join(actuel['jointures']) or '-'}"))
+
+        # 2. Nouveaux scans séquentiels sur statistique
+        for identifiant in actuel['scans_sequentiels_statistique']:
+            if identifiant not in ancien['scans_sequentiels_statistique']:
+                regressions.append((nom, 'seq scan statistique', identifiant))
+
+        # 3. Nouvelles erreurs d'estimation de lignes
+        for identifiant, erreur in actuel['erreurs_estimation'].items():
+            if identifiant not in ancien['erreurs_estimation']:
+                regressions.append((nom, "erreur d'estimation",
+                                    f"{identifiant}: {erreur['estimees']} estimées / "
+                                    f"{erreur['reelles']} réelles (x{erreur['facteur']})"))
+
+        # 4. Temps d'exécution (à titre indicatif, dépend de la charge)
+        if ancien['execution_ms'] and actuel['execution_ms'] > facteur_temps * max(ancien['execution_ms'], 1.0):
+            regressions.append((nom, 'temps', f"{ancien['execution_ms']:.1f} ms -> {actuel['execution_ms']:.1f} ms"))
+    return regressions
+
+
+def enregistrer(capture, fichier):
+    os.makedirs(os.path.dirname(fichier), exist_ok=True)
+    with open(fichier, 'w', encoding='utf-8') as f:
+        json.dump(capture, f, indent=2, ensure_ascii=False)
+
+
+def charger(fichier):
+    with open(fichier, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def afficher_capture(capture):
+    lignes = [(nom, ', '.join(p['jointures']) or '-', len(p['scans_sequentiels_statistique']),
+               len(p['erreurs_estimation']), f"{p['execution_ms']:.1f}",
+               p['buffers_lus_cache'], p['buffers_lus_disque'])
+              for nom, p in capture['plans'].items()]
+    print(tabulate(lignes, headers=['Requête', 'Jointures', 'Seq scans stat.', 'Erreurs estim.',
+                                    'Exécution (ms)', 'Buffers cache', 'Buffers disque'],
+                   tablefmt='pretty'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Capture des plans d'exécution et détection de régressions")
+    parser.add_argument('--reference', action='store_true',
+                        help="Enregistre la capture comme nouvelle référence")
+    parser.add_argument('--fichier-reference', default=FICHIER_REFERENCE)
+    parser.add_argument('--sortie', help="Fichier JSON où enregistrer la capture courante")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        capture = capturer_plans(conn)
+    finally:
+        conn.close()
+    afficher_capture(capture)
+
+    if args.sortie:
+        enregistrer(capture, args.sortie)
+    if args.reference or not os.path.exists(args.fichier_reference):
+        enregistrer(capture, args.fichier_reference)
+        print(f"Référence enregistrée: {args.fichier_reference}")
+        return 0
+
+    regressions = comparer_plans(charger(args.fichier_reference), capture)
+    if not regressions:
+        print("Aucune régression de plan par rapport à la référence")
+        return 0
+    print(f"\n\033[1m=== {len(regressions)} régression(s) de plan ===\033[0m")
+    print(tabulate(regressions, headers=['Requête', 'Type', 'Détail'], tablefmt='pretty'))
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import psycopg2
+
+from config import DB_CONFIG, avec_connexion
+
+# Tables du chargement initial, dans l'ordre des clés étrangères
+TABLES_MASSIVES = [
+    'region', 'departement', 'arrondissement', 'canton', 'collectivite', 'commune',
+    'commune_rattachee', 'chef_lieu_region', 'chef_lieu_departement', 'type_statistique', 'statistique',
+]
+
+# Index uniques conservés pendant le chargement : arbitres des ON CONFLICT des importeurs
+ARBITRES = {'uq_statistique_cle', 'type_statistique_nom_key'}
+
+# Mémoire de tri des constructions d'index (par connexion)
+MAINTENANCE_WORK_MEM = '512MB'
+
+
+def installer_suivi(cur):
+    """Définitions des objets retirés pendant le chargement : survivent à une interruption"""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS objet_differe (
+        nom VARCHAR(63) PRIMARY KEY,
+        table_nom VARCHAR(63) NOT NULL,
+        genre VARCHAR(10) NOT NULL CHECK (genre IN ('index', 'unique', 'fk')),
+        definition TEXT NOT NULL
+    );
+    """)
+
+
+@contextmanager
+def _etape_sans_mesure(nom):
+    yield None
+
+
+def preparer_chargement_massif(conn):
+    """Retire index secondaires et clés étrangères des tables de chargement et les passe en UNLOGGED
+
+    Réservé au chargement initial (table statistique vide). Les définitions retirées sont
+    conservées dans objet_differe pour finaliser_chargement_massif, y compris après un arrêt.
+    """
+    debut = time.perf_counter()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT EXISTS (SELECT 1 FROM statistique)")
+            if cur.fetchone()[0]:
+                raise ValueError("Mode massif réservé au chargement initial : statistique n'est pas vide")
+            installer_suivi(cur)
+
+            # 1. Clés étrangères portées par les tables de chargement ou qui les référencent
+            #    (une table journalisée ne peut pas référencer une table UNLOGGED)
+            cur.execute("""
+                INSERT INTO objet_differe (nom, table_nom, genre, definition)
+                SELECT c.conname, c.conrelid::regclass::text, 'fk', pg_get_constraintdef(c.oid)
+                FROM pg_constraint c
+                WHERE c.contype = 'f'
+                AND (c.conrelid::regclass::text = ANY(%(tables)s) OR c.confrelid::regclass::text = ANY(%(tables)s))
+                ON CONFLICT (nom) DO NOTHING
+            """, {'tables': TABLES_MASSIVES})
+
+            # 2. Contraintes UNIQUE hors arbitres : index reconstruit puis rattaché (USING INDEX)
+            cur.execute("""
+                INSERT INTO objet_differe (nom, table_nom, genre, definition)
+                SELECT c.conname, c.conrelid::regclass::text, 'unique', pg_get_indexdef(c.conindid)
+                FROM pg_constraint c
+                WHERE c.contype = 'u'
+                AND c.conrelid::regclass::text = ANY(%(tables)s)
+                AND c.conname <> ALL(%(arbitres)s)
+                ON CONFLICT (nom) DO NOTHING
+            """, {'tables': TABLES_MASSIVES, 'arbitres': list(ARBITRES)})
+
+            # 3. Index secondaires (ni clé primaire, ni contrainte, ni arbitre)
+            cur.execute("""
+                INSERT INTO objet_differe (nom, table_nom, genre, definition)
+                SELECT ic.relname, t.relname, 'index', pg_get_indexdef(i.indexrelid)
+                FROM pg_index i
+                JOIN pg_class ic ON ic.oid = i.indexrelid
+                JOIN pg_class t ON t.oid = i.indrelid
+                WHERE t.relname = ANY(%(tables)s)
+                AND NOT i.indisprimary
+                AND ic.relname <> ALL(%(arbitres)s)
+                AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid
+                                AND c.contype IN ('p', 'u', 'x'))
+                ON CONFLICT (nom) DO NOTHING
+            """, {'tables': TABLES_MASSIVES, 'arbitres': list(ARBITRES)})
+
+            cur.execute("SELECT nom, table_nom, genre FROM objet_differe ORDER BY genre")
+            differes = cur.fetchall()
+            for nom, table_nom, genre in differes:
+                if genre == 'index':
+                    cur.execute(f'DROP INDEX IF EXISTS "{nom}"')
+                else:
+                    cur.execute(f'ALTER TABLE {table_nom} DROP CONSTRAINT IF EXISTS "{nom}"')
+
+            # 4. Tables non journalisées : pas de WAL pendant les COPY
+            for table in TABLES_MASSIVES:
+                cur.execute(f"ALTER TABLE {table} SET UNLOGGED")
+        conn.commit()
+        nb = {genre: sum(1 for d in differes if d[2] == genre) for genre in ('index', 'unique', 'fk')}
+        print(f"Mode massif: {nb['index']} index, {nb['unique']} contraintes UNIQUE et {nb['fk']} clés "
+              f"étrangères différés, {len(TABLES_MASSIVES)} tables UNLOGGED "
+              f"({time.perf_counter() - debut:.2f}s)")
+        return differes
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Erreur préparation du chargement massif: {str(e)}")
+        raise
+
+
+def _executer_en_parallele(db_config, commandes, nb_workers):
+    """Exécute des commandes SQL indépendantes, une connexion par tâche ; renvoie {nom: durée}"""
+    def executer(nom, requetes):
+        debut = time.perf_counter()
+        conn = psycopg2.connect(**db_config)
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"SET maintenance_work_mem = '{MAINTENANCE_WORK_MEM}'")
+                for requete in requetes:
+                    cur.execute(requete)
+        finally:
+            conn.close()
+        return nom, time.perf_counter() - debut
+
+    with ThreadPoolExecutor(max_workers=nb_workers) as pool:
+        futurs = [pool.submit(executer, nom, requetes) for nom, requetes in commandes]
+        return dict(futur.result() for futur in futurs)
+
+
+def analyser_tables(conn, tables=None):
+    """ANALYZE des tables chargées : les premières requêtes sont planifiées sur des statistiques à jour"""
+    debut = time.perf_counter()
+    with conn.cursor() as cur:
+        for table in tables or TABLES_MASSIVES:
+            cur.execute(f"ANALYZE {table}")
+    conn.commit()
+    print(f"ANALYZE: {len(tables or TABLES_MASSIVES)} tables en {time.perf_counter() - debut:.2f}s")
+
+
+def finaliser_chargement_massif(conn, db_config=None, nb_workers=4, etape=None):
+    """Remet les tables en état nominal après le chargement : durée de chaque phase
+
+    1. SET LOGGED (tables réécrites une fois, sans index secondaires ni clés étrangères)
+    2. Index et contraintes UNIQUE construits en parallèle
+    3. Clés étrangères ajoutées NOT VALID puis validées en parallèle
+    4. ANALYZE de toutes les tables chargées
+    etape est une fabrique de contextes de mesure (Instrumentation.etape), facultative.
+    """
+    db_config = db_config or DB_CONFIG
+    etape = etape or _etape_sans_mesure
+    durees = {}
+
+    with conn.cursor() as cur:
+        installer_suivi(cur)
+        cur.execute("SELECT nom, table_nom, genre, definition FROM objet_differe")
+        differes = cur.fetchall()
+    conn.commit()
+
+    try:
+        # 1. Journalisation (aucune clé étrangère à ce stade : ordre indifférent)
+        debut = time.perf_counter()
+        with etape('massif_journalisation'), conn.cursor() as cur:
+            for table in TABLES_MASSIVES:
+                cur.execute(f"ALTER TABLE {table} SET LOGGED")
+            conn.commit()
+        durees['journalisation'] = time.perf_counter() - debut
+
+        # 2. Index : plusieurs index d'une même table se construisent en même temps (verrou SHARE)
+        debut = time.perf_counter()
+        with etape('massif_index'):
+            commandes = [(nom, [definition.replace('CREATE INDEX', 'CREATE INDEX IF NOT EXISTS', 1)
+                                .replace('CREATE UNIQUE INDEX', 'CREATE UNIQUE INDEX IF NOT EXISTS', 1)])
+                         for nom, _, genre, definition in differes if genre in ('index', 'unique')]
+            durees_index = _executer_en_parallele(db_config, commandes, nb_workers)
+            with conn.cursor() as cur:
+                for nom, table_nom, genre, _ in differes:
+                    if genre == 'unique':
+                        cur.execute(f'ALTER TABLE {table_nom} ADD CONSTRAINT "{nom}" UNIQUE USING INDEX "{nom}"')
+                cur.execute("DELETE FROM objet_differe WHERE genre IN ('index', 'unique')")
+            conn.commit()
+        durees['index'] = time.perf_counter() - debut
+
+        # 3. Clés étrangères : ajout immédiat sans contrôle, validation (lecture seule) en parallèle
+        debut = time.perf_counter()
+        with etape('massif_contraintes'):
+            cles = [(nom, table_nom, definition) for nom, table_nom, genre, definition in differes if genre == 'fk']
+            with conn.cursor() as cur:
+                for nom, table_nom, definition in cles:
+                    # DROP préalable : reprise après une validation interrompue
+                    cur.execute(f'ALTER TABLE {table_nom} DROP CONSTRAINT IF EXISTS "{nom}", '
+                                f'ADD CONSTRAINT "{nom}" {definition} NOT VALID')
+            conn.commit()
+            durees_fk = _executer_en_parallele(
+                db_config, [(nom, [f'ALTER TABLE {table_nom} VALIDATE CONSTRAINT "{nom}"'])
+                            for nom, table_nom, _ in cles], nb_workers)
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM objet_differe WHERE genre = 'fk'")
+            conn.commit()
+        durees['contraintes'] = time.perf_counter() - debut
+
+        # 4. Statistiques du planificateur, en parallèle par table
+        debut = time.perf_counter()
+        with etape('massif_analyze'):
+            _executer_en_parallele(db_config, [(table, [f"ANALYZE {table}"]) for table in TABLES_MASSIVES],
+                                   nb_workers)
+        durees['analyze'] = time.perf_counter() - debut
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Erreur finalisation du chargement massif (relancer pour reprendre): {str(e)}")
+        raise
+
+    for nom, duree in sorted({**durees_index, **durees_fk}.items(), key=lambda x: -x[1])[:5]:
+        print(f"  {nom}: {duree:.2f}s")
+    print("Mode massif, durée par phase: " + ", ".join(f"{phase} {duree:.2f}s" for phase, duree in durees.items()))
+    return durees
+
+
+if __name__ == "__main__":
+    # Reprise d'une finalisation interrompue
+    avec_connexion(finaliser_chargement_massif)
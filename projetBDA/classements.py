@@ -0,0 +1,168 @@
+import time
+
+from config import avec_connexion
+from version_donnees import incrementer_version
+
+CRITERES = ('population', 'croissance', 'densite')
+NIVEAUX = ('commune', 'departement', 'region')
+
+# Indicateurs des classements (mêmes années que les rapports d'exploration)
+POPULATION = 'P21_POP'
+POPULATION_DEBUT = 'P15_POP'
+SUPERFICIE = 'SUPERF'
+
+# Curseur initial d'un parcours croissant (rang le plus faible en dernier)
+RANG_MAX = 2 ** 31 - 1
+
+
+def installer_classements(cur):
+    """Classements précalculés : un rang dense par (critère, niveau), et par entité parente
+
+    La clé primaire (critere, niveau, rang) sert la pagination par curseur : une page
+    quelconque est une lecture d'index bornée, sans tri ni OFFSET.
+    """
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS classement (
+        critere VARCHAR(12) NOT NULL,
+        niveau VARCHAR(12) NOT NULL,
+        rang INTEGER NOT NULL,
+        code VARCHAR(5) NOT NULL,
+        nom VARCHAR(100) NOT NULL,
+        valeur NUMERIC NOT NULL,
+        -- Département d'une commune, région d'un département (NULL pour une région)
+        parent VARCHAR(3),
+        rang_parent INTEGER NOT NULL,
+        PRIMARY KEY (critere, niveau, rang)
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_classement_code ON classement (critere, niveau, code);
+    CREATE INDEX IF NOT EXISTS idx_classement_parent ON classement (critere, niveau, parent, rang_parent);
+
+    -- Version des données (version_donnees) pour laquelle les classements ont été calculés
+    CREATE TABLE IF NOT EXISTS classement_version (
+        id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+        version BIGINT NOT NULL
+    );
+    """)
+
+
+def classements_a_jour(cur):
+    """Vrai si aucun import n'a modifié les données depuis le dernier calcul des classements
+
+    Faux après un chargement ou une synchronisation lancés seuls : les lectures repassent
+    alors par les requêtes EAV jusqu'au prochain rafraichir_classements.
+    """
+    cur.execute("SELECT to_regclass('classement_version') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return False
+    cur.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM classement_version cv
+            JOIN version_donnees vd ON vd.version = cv.version
+        )
+    """)
+    return cur.fetchone()[0]
+
+
+def rafraichir_classements(conn):
+    """Recalcule tous les classements en une transaction (lecteurs : ancien état jusqu'au COMMIT)
+
+    DELETE et non TRUNCATE : le verrou ACCESS EXCLUSIVE de TRUNCATE bloquerait les
+    lectures de pages pendant tout le recalcul.
+    """
+    debut = time.perf_counter()
+    try:
+        with conn.cursor() as cur:
+            installer_classements(cur)
+            # Un seul recalcul à la fois ; les lectures ne sont pas bloquées
+            cur.execute("LOCK TABLE classement IN SHARE ROW EXCLUSIVE MODE")
+
+            # 1. Une ligne par commune : population, population de début, superficie
+            cur.execute("""
+                CREATE TEMP TABLE base_classement ON COMMIT DROP AS
+                SELECT
+                    c.code_insee, c.name, c.dep_id, d.reg_id,
+                    MAX(s.valeur) FILTER (WHERE ts.nom = %(population)s) AS pop,
+                    MAX(s.valeur) FILTER (WHERE ts.nom = %(population_debut)s) AS pop_debut,
+                    MAX(s.valeur) FILTER (WHERE ts.nom = %(superficie)s) AS surf
+                FROM commune c
+                JOIN departement d ON c.dep_id = d.dep_id
+                JOIN statistique s ON s.com_id = c.com_id
+                JOIN type_statistique ts ON s.type_id = ts.id
+                WHERE ts.nom IN (%(population)s, %(population_debut)s, %(superficie)s)
+                GROUP BY c.com_id, c.code_insee, c.name, c.dep_id, d.reg_id
+            """, {'population': POPULATION, 'population_debut': POPULATION_DEBUT, 'superficie': SUPERFICIE})
+
+            # 2. Entités des trois niveaux ; la densité ne compte que les communes de superficie connue
+            cur.execute("""
+                CREATE TEMP TABLE entite_classement ON COMMIT DROP AS
+                SELECT 'commune'::text AS niveau, code_insee AS code, name AS nom, dep_id AS parent,
+                       pop, pop_debut, CASE WHEN surf IS NOT NULL THEN pop END AS pop_dens, surf
+                FROM base_classement
+                UNION ALL
+                SELECT 'departement', d.dep_id, d.name, d.reg_id,
+                       SUM(b.pop), SUM(b.pop_debut), SUM(b.pop) FILTER (WHERE b.surf IS NOT NULL),
+                       SUM(b.surf) FILTER (WHERE b.pop IS NOT NULL)
+                FROM base_classement b
+                JOIN departement d ON b.dep_id = d.dep_id
+                GROUP BY d.dep_id, d.name, d.reg_id
+                UNION ALL
+                SELECT 'region', r.reg_id, r.name, NULL,
+                       SUM(b.pop), SUM(b.pop_debut), SUM(b.pop) FILTER (WHERE b.surf IS NOT NULL),
+                       SUM(b.surf) FILTER (WHERE b.pop IS NOT NULL)
+                FROM base_classement b
+                JOIN region r ON b.reg_id = r.reg_id
+                GROUP BY r.reg_id, r.name
+            """)
+
+            # 3. Rangs denses (ex aequo départagés par le code) : global et dans l'entité parente
+            cur.execute("DELETE FROM classement")
+            cur.execute("""
+                INSERT INTO classement (critere, niveau, rang, code, nom, valeur, parent, rang_parent)
+                SELECT
+                    critere, niveau,
+                    ROW_NUMBER() OVER (PARTITION BY critere, niveau ORDER BY valeur DESC, code),
+                    code, nom, valeur, parent,
+                    ROW_NUMBER() OVER (PARTITION BY critere, niveau, parent ORDER BY valeur DESC, code)
+                FROM (
+                    SELECT 'population' AS critere, niveau, code, nom, parent, pop AS valeur
+                    FROM entite_classement
+                    UNION ALL
+                    SELECT 'croissance', niveau, code, nom, parent,
+                           (pop - pop_debut) * 100.0 / pop_debut
+                    FROM entite_classement
+                    WHERE pop_debut > 0
+                    UNION ALL
+                    SELECT 'densite', niveau, code, nom, parent, pop_dens / surf
+                    FROM entite_classement
+                    WHERE surf > 0
+                ) v
+                WHERE valeur IS NOT NULL
+            """)
+            nb_lignes = cur.rowcount
+            cur.execute("ANALYZE classement")
+            # Les pages en cache (cache_resultats) sont invalidées au COMMIT
+            version = incrementer_version(cur, 'classement')
+            cur.execute("""
+                INSERT INTO classement_version (id, version) VALUES (TRUE, %s)
+                ON CONFLICT (id) DO UPDATE SET version = EXCLUDED.version
+            """, (version,))
+        conn.commit()
+        print(f"Classements: {nb_lignes} rangs ({len(CRITERES)} critères x {len(NIVEAUX)} niveaux) "
+              f"en {time.perf_counter() - debut:.2f}s")
+        return nb_lignes
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Erreur recalcul des classements: {str(e)}")
+        raise
+
+
+def verifier_classement(critere, niveau):
+    if critere not in CRITERES:
+        raise ValueError(f"Critère inconnu: {critere} (attendu: {', '.join(CRITERES)})")
+    if niveau not in NIVEAUX:
+        raise ValueError(f"Niveau inconnu: {niveau} (attendu: {', '.join(NIVEAUX)})")
+
+
+if __name__ == "__main__":
+    avec_connexion(rafraichir_classements)
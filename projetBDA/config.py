@@ -0,0 +1,30 @@
+import psycopg2
+
+# Configuration de la connexion, partagée par tous les scripts du projet
+DB_CONFIG = {
+    'host': 'localhost',
+    'database': 'inseedb',
+    'user': 'postgres',
+    'password': 'admin'
+}
+
+
+def avec_connexion(*actions, db_config=None):
+    """Point d'entrée des scripts : chaque action(conn), dans l'ordre, sur une même connexion
+
+    Une erreur est affichée sans trace et arrête la suite ; la connexion est toujours
+    fermée. Renvoie le résultat de la dernière action (None en cas d'erreur).
+    """
+    conn = None
+    resultat = None
+    try:
+        conn = psycopg2.connect(**(db_config or DB_CONFIG))
+        for action in actions:
+            resultat = action(conn)
+    except Exception as e:
+        resultat = None
+        print(f"Erreur: {e}")
+    finally:
+        if conn:
+            conn.close()
+    return resultat
@@ -0,0 +1,376 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+from tabulate import tabulate
+
+from config import avec_connexion
+from capture_plans import PARAMETRES_EXEMPLE, expliquer, parcourir
+from service_requetes import CATALOGUE
+
+# Journal hors du dépôt par défaut (répertoire temporaire), déplaçable par INSEE_JOURNAL_REQUETES
+FICHIER_JOURNAL = os.environ.get('INSEE_JOURNAL_REQUETES',
+                                 os.path.join(tempfile.gettempdir(), 'journal_requetes.json'))
+
+# Coût planifié seul (sans exécution), colonnes qualifiées par alias (Output, conditions)
+EXPLAIN_COUT = "EXPLAIN (VERBOSE, FORMAT JSON)"
+
+# Conditions du plan où chercher les prédicats
+CLES_CONDITIONS = ('Filter', 'Index Cond', 'Recheck Cond', 'Hash Cond', 'Merge Cond', 'Join Filter')
+
+# alias.colonne OPÉRATEUR (alias.colonne | constante | $n), casts et parenthèses tolérés
+COMPARAISON = re.compile(
+    r"\(*(\w+)\.(\w+)\)*(?:::[\w ]+(?:\[\])?)?\s*(=|<>|<=|>=|<|>)\s*(?:ANY\s*)?\(*(?:(\w+)\.(\w+)\b|([^()\s]+))"
+)
+OPERATEURS_INTERVALLE = ('<', '>', '<=', '>=')
+
+# Proposition retenue si elle réduit d'au moins 20 % le coût pondéré des requêtes concernées
+SEUIL_GAIN = 0.2
+
+
+class JournalRequetes:
+    """Requêtes du catalogue exécutées : nombre d'appels, latence, derniers paramètres
+
+    Se branche sur un service (ServiceRequetes, ServiceAsync) par sa liste d'observateurs.
+    Les résultats servis par le cache (durée None) comptent dans appels et appels_cache,
+    pas dans la durée : ils n'ont rien coûté au serveur.
+    """
+
+    def __init__(self, requetes=None):
+        self.requetes = requetes or {}  # nom -> {'appels', 'duree_s', 'duree_max_s', 'params'}
+        self._verrou = threading.Lock()
+
+    def brancher(self, service):
+        service.observateurs.append(self.enregistrer)
+        return self
+
+    def enregistrer(self, nom, params, duree):
+        with self._verrou:
+            entree = self.requetes.setdefault(nom, {'appels': 0, 'appels_cache': 0,
+                                                    'duree_s': 0.0, 'duree_max_s': 0.0})
+            entree['appels'] += 1
+            if duree is None:
+                entree['appels_cache'] = entree.get('appels_cache', 0) + 1
+            else:
+                entree['duree_s'] += duree
+                entree['duree_max_s'] = max(entree['duree_max_s'], duree)
+            entree['params'] = [list(p) if isinstance(p, (list, tuple)) else p for p in params]
+
+    def fusionner(self, autre):
+        for nom, entree in autre.requetes.items():
+            cumul = self.requetes.setdefault(nom, {'appels': 0, 'appels_cache': 0,
+                                                   'duree_s': 0.0, 'duree_max_s': 0.0})
+            cumul['appels'] += entree['appels']
+            cumul['appels_cache'] = cumul.get('appels_cache', 0) + entree.get('appels_cache', 0)
+            cumul['duree_s'] += entree['duree_s']
+            cumul['duree_max_s'] = max(cumul['duree_max_s'], entree['duree_max_s'])
+            cumul['params'] = entree.get('params', cumul.get('params', []))
+        return self
+
+    @classmethod
+    def charger(cls, fichier=FICHIER_JOURNAL):
+        if not os.path.exists(fichier):
+            return cls()
+        with open(fichier, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def sauvegarder(self, fichier=FICHIER_JOURNAL):
+        """Ajoute ce journal au fichier (cumul entre sessions)"""
+        cumul = JournalRequetes.charger(fichier).fusionner(self)
+        with open(f"{fichier}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(cumul.requetes, f, indent=2, ensure_ascii=False, default=str)
+        os.replace(f"{fichier}.tmp", fichier)
+
+    def charge_de_travail(self):
+        """{nom: (requête, paramètres, poids)} ; sans journal, tout le catalogue avec un poids de 1
+
+        Le poids est le temps total passé par le serveur dans la requête (exécutions hors
+        cache x latence moyenne).
+        """
+        if not self.requetes:
+            return {nom: (entree["requete"], PARAMETRES_EXEMPLE.get(nom, ()), 1.0)
+                    for nom, entree in CATALOGUE.items()}
+        return {nom: (CATALOGUE[nom]["requete"], tuple(entree.get('params', ())), entree['duree_s'] or 1e-6)
+                for nom, entree in self.requetes.items() if nom in CATALOGUE}
+
+
+def cout_planifie(cur, nom, requete, params):
+    """Coût total estimé par le planificateur et plan VERBOSE (la requête n'est pas exécutée)"""
+    explain = expliquer(cur, f"conseil_{nom}", requete, params, options=EXPLAIN_COUT)
+    return explain['Plan']['Total Cost'], explain
+
+
+def predicats_du_plan(explain, requete):
+    """Par relation : colonnes en égalité, en intervalle, de tri, en sortie et constantes de la requête"""
+    alias = {}
+    noeuds = [noeud for _, noeud in parcourir(explain['Plan'])]
+    for noeud in noeuds:
+        if 'Relation Name' in noeud:
+            alias[noeud.get('Alias', noeud['Relation Name'])] = noeud['Relation Name']
+
+    relations = {}
+
+    def relation(nom_alias):
+        table = alias.get(nom_alias)
+        if table is None:
+            return None
+        return relations.setdefault(table, {'egalite': [], 'intervalle': [], 'tri': [], 'sortie': [],
+                                            'constantes': {}})
+
+    for noeud in noeuds:
+        for cle in CLES_CONDITIONS:
+            for a, colonne, operateur, a2, colonne2, constante in COMPARAISON.findall(noeud.get(cle, '')):
+                r = relation(a)
+                if r is None:
+                    continue
+                if a2:
+                    # Jointure : côté interne d'une boucle imbriquée / d'un index
+                    if operateur == '=':
+                        r['egalite'].append(colonne)
+                        if relation(a2) is not None:
+                            relation(a2)['egalite'].append(colonne2)
+                elif operateur == '=':
+                    r['egalite'].append(colonne)
+                    # Littéral écrit dans la requête (pas un paramètre) : candidat à un index partiel
+                    litteral = constante.split('::')[0]
+                    if litteral.startswith("'") and litteral in requete:
+                        r['constantes'][colonne] = litteral
+                elif operateur in OPERATEURS_INTERVALLE:
+                    r['intervalle'].append(colonne)
+        for cle_tri in noeud.get('Sort Key', []):
+            correspondance = re.match(r'\(*(\w+)\.(\w+)', cle_tri)
+            if correspondance and relation(correspondance.group(1)) is not None:
+                relation(correspondance.group(1))['tri'].append(correspondance.group(2))
+        if 'Relation Name' in noeud:
+            for sortie in noeud.get('Output', []):
+                correspondance = re.fullmatch(r'(\w+)\.(\w+)', sortie)
+                if correspondance and relation(correspondance.group(1)) is not None:
+                    relation(correspondance.group(1))['sortie'].append(correspondance.group(2))
+    return relations
+
+
+def _uniques(colonnes):
+    return list(dict.fromkeys(colonnes))
+
+
+def proposer(table, predicats):
+    """Index candidats d'une relation : composite (égalités puis intervalle ou tri), couvrant, partiel"""
+    egalite = _uniques(predicats['egalite'])
+    suite = _uniques(predicats['intervalle'] + predicats['tri'])[:1]
+    cles = _uniques(egalite + suite)
+    if not cles:
+        return []
+    inclus = [c for c in _uniques(predicats['sortie']) if c not in cles]
+
+    candidats = [(cles, [], None), (cles, inclus, None)] if inclus else [(cles, [], None)]
+    # Variante partielle : les égalités à un littéral passent dans le WHERE de l'index
+    constantes = predicats['constantes']
+    cles_partielles = [c for c in cles if c not in constantes]
+    if constantes and cles_partielles:
+        predicat = ' AND '.join(f"{c} = {v}" for c, v in sorted(constantes.items()))
+        candidats.append((cles_partielles, inclus, predicat))
+
+    propositions = []
+    for cles_index, inclus_index, predicat in candidats:
+        nom = f"idx_conseil_{table}_{'_'.join(cles_index)}"
+        if inclus_index:
+            nom += '_couvrant'
+        if predicat:
+            nom += '_partiel'
+        if len(nom) > 63:
+            # Limite des identifiants PostgreSQL : suffixe haché pour rester distinct
+            nom = f"{nom[:54]}_{hashlib.md5(nom.encode()).hexdigest()[:8]}"
+        definition = f"CREATE INDEX {nom} ON {table} ({', '.join(cles_index)})"
+        if inclus_index:
+            definition += f" INCLUDE ({', '.join(inclus_index)})"
+        if predicat:
+            definition += f" WHERE {predicat}"
+        propositions.append({'table': table, 'nom': nom, 'cles': cles_index, 'definition': definition})
+    return propositions
+
+
+def index_existants(cur, table):
+    """Colonnes clés (dans l'ordre) de chaque index existant d'une table"""
+    cur.execute("""
+        SELECT ic.relname, array_agg(a.attname ORDER BY k.ordre)
+        FROM pg_index i
+        JOIN pg_class ic ON ic.oid = i.indexrelid
+        CROSS JOIN unnest(i.indkey) WITH ORDINALITY AS k(attnum, ordre)
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+        WHERE i.indrelid = %s::regclass AND k.ordre <= i.indnkeyatts
+        GROUP BY ic.relname
+    """, (table,))
+    return {nom: colonnes for nom, colonnes in cur.fetchall()}
+
+
+def hypopg_disponible(cur):
+    """Vrai si l'extension hypopg (index hypothétiques) est installée dans la base
+
+    Simple lecture du catalogue : l'installation (CREATE EXTENSION hypopg) reste à la
+    charge de l'administrateur.
+    """
+    cur.execute("SELECT installed_version FROM pg_available_extensions WHERE name = 'hypopg'")
+    ligne = cur.fetchone()
+    if ligne is not None and ligne[0] is None:
+        print("hypopg disponible mais non installée (CREATE EXTENSION hypopg)")
+    return ligne is not None and ligne[0] is not None
+
+
+def evaluer(conn, propositions, charge, requetes_par_table, hypothetique, seuil=SEUIL_GAIN):
+    """Coût pondéré des requêtes concernées avant / après chaque index, un index à la fois
+
+    Avec hypopg, l'index n'existe que pour le planificateur ; sinon il est réellement créé
+    dans une transaction annulée (verrou SHARE sur la table le temps de la construction,
+    réservé à conseiller(index_reels=True)).
+    """
+    evaluations = []
+    with conn.cursor() as cur:
+        couts_avant = {nom: cout_planifie(cur, nom, requete, params)[0]
+                       for nom, (requete, params, _) in charge.items()}
+        conn.rollback()
+        for proposition in propositions:
+            concernees = requetes_par_table[proposition['table']]
+            if hypothetique:
+                cur.execute("SELECT indexrelid FROM hypopg_create_index(%s)", (proposition['definition'],))
+                cur.execute("SELECT hypopg_relation_size(%s)", (cur.fetchone()[0],))
+            else:
+                cur.execute(proposition['definition'])
+                cur.execute("SELECT pg_relation_size(%s::regclass)", (proposition['nom'],))
+            taille = cur.fetchone()[0]
+            couts_apres = {nom: cout_planifie(cur, nom, *charge[nom][:2])[0] for nom in concernees}
+            if hypothetique:
+                cur.execute("SELECT hypopg_reset()")
+            conn.rollback()
+
+            avant = sum(couts_avant[nom] * charge[nom][2] for nom in concernees)
+            apres = sum(couts_apres[nom] * charge[nom][2] for nom in concernees)
+            gain = (avant - apres) / avant if avant > 0 else 0.0
+            evaluations.append(dict(
+                proposition,
+                requetes=sorted(concernees),
+                gain=round(gain, 3),
+                taille_octets=taille,
+                acceptee=gain >= seuil,
+                detail={nom: (round(couts_avant[nom], 1), round(couts_apres[nom], 1)) for nom in concernees},
+            ))
+    return evaluations
+
+
+def conseiller(conn, journal=None, seuil=SEUIL_GAIN, index_reels=False):
+    """Propositions d'index pour la charge enregistrée, évaluées par coût planifié, meilleures en tête
+
+    Sans hypopg, l'évaluation construit chaque index pour de bon (écritures bloquées sur la
+    table pendant la construction) : seulement si index_reels est demandé, sinon aucune
+    proposition n'est évaluée.
+    """
+    charge = (journal or JournalRequetes()).charge_de_travail()
+    propositions = {}
+    requetes_par_table = {}
+    try:
+        with conn.cursor() as cur:
+            hypothetique = hypopg_disponible(cur)
+            if not hypothetique and not index_reels:
+                conn.commit()
+                print("Conseiller d'index: hypopg absente, évaluation par index réels non demandée")
+                return []
+            existants = {}
+            for nom, (requete, params, _) in charge.items():
+                _, explain = cout_planifie(cur, nom, requete, params)
+                for table, predicats in predicats_du_plan(explain, requete).items():
+                    if table not in existants:
+                        existants[table] = index_existants(cur, table)
+                    for proposition in proposer(table, predicats):
+                        # Déjà couvert par un index de mêmes colonnes clés
+                        if ('INCLUDE' not in proposition['definition'] and 'WHERE' not in proposition['definition']
+                                and proposition['cles'] in existants[table].values()):
+                            continue
+                        propositions.setdefault(proposition['definition'], proposition)
+                        requetes_par_table.setdefault(table, set()).add(nom)
+        conn.commit()
+        evaluations = evaluer(conn, list(propositions.values()), charge, requetes_par_table, hypothetique, seuil)
+    except Exception as e:
+        conn.rollback()
+        print(f"Erreur conseiller d'index: {str(e)}")
+        raise
+
+    print(f"Conseiller d'index: {len(charge)} requêtes, {len(evaluations)} propositions évaluées "
+          f"({'hypopg' if hypothetique else 'index temporaires'})")
+    return sorted(evaluations, key=lambda e: -e['gain'])
+
+
+def appliquer(conn, evaluations):
+    """Crée les index acceptés avec CREATE INDEX CONCURRENTLY (sans bloquer les écritures)"""
+    conn.commit()
+    conn.autocommit = True  # CONCURRENTLY est interdit dans une transaction
+    crees = []
+    try:
+        with conn.cursor() as cur:
+            # Un index accepté par table et par jeu de requêtes suffit : le meilleur
+            deja = set()
+            for evaluation in evaluations:
+                cle = (evaluation['table'], tuple(evaluation['requetes']))
+                if not evaluation['acceptee'] or cle in deja:
+                    continue
+                debut = time.perf_counter()
+                cur.execute(evaluation['definition'].replace('CREATE INDEX', 'CREATE INDEX CONCURRENTLY IF NOT EXISTS', 1))
+                deja.add(cle)
+                crees.append(evaluation['nom'])
+                print(f"Index créé: {evaluation['nom']} en {time.perf_counter() - debut:.1f}s")
+    finally:
+        conn.autocommit = False
+    return crees
+
+
+def index_inutilises(conn):
+    """Index jamais parcourus depuis la dernière remise à zéro des statistiques (hors clés et UNIQUE)"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT
+                s.relname,
+                s.indexrelname,
+                pg_size_pretty(pg_relation_size(s.indexrelid)),
+                t.n_tup_ins + t.n_tup_upd + t.n_tup_del as ecritures
+            FROM pg_stat_user_indexes s
+            JOIN pg_index i ON i.indexrelid = s.indexrelid
+            JOIN pg_stat_user_tables t ON t.relid = s.relid
+            WHERE s.idx_scan = 0
+            AND NOT i.indisunique
+            AND NOT i.indisprimary
+            ORDER BY pg_relation_size(s.indexrelid) DESC
+        """)
+        lignes = cur.fetchall()
+        cur.execute("SELECT stats_reset FROM pg_stat_database WHERE datname = current_database()")
+        depuis = cur.fetchone()[0]
+    conn.commit()
+    return lignes, depuis
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Conseiller d'index pour le catalogue de requêtes")
+    parser.add_argument('--journal', default=FICHIER_JOURNAL,
+                        help="Journal des requêtes exécutées (sinon tout le catalogue, poids égaux)")
+    parser.add_argument('--appliquer', action='store_true', help="Crée les index acceptés (CONCURRENTLY)")
+    parser.add_argument('--seuil', type=float, default=SEUIL_GAIN, help="Gain minimal de coût pondéré (0.2 = 20 %%)")
+    parser.add_argument('--index-reels', action='store_true',
+                        help="Sans hypopg, évalue en construisant réellement chaque index (bloque les écritures)")
+    args = parser.parse_args()
+
+    def rapport(conn):
+        evaluations = conseiller(conn, JournalRequetes.charger(args.journal), args.seuil, args.index_reels)
+        print(tabulate([(e['definition'], ', '.join(e['requetes']), f"{e['gain'] * 100:.0f} %",
+                         f"{e['taille_octets'] / 1e6:.1f} Mo", 'oui' if e['acceptee'] else 'non')
+                        for e in evaluations],
+                       headers=['Index', 'Requêtes', 'Gain', 'Taille', 'Accepté'], tablefmt='pretty'))
+        if args.appliquer:
+            appliquer(conn, evaluations)
+
+        inutilises, depuis = index_inutilises(conn)
+        print(f"\nIndex jamais utilisés depuis {depuis or 'la création de la base'}:")
+        print(tabulate(inutilises, headers=['Table', 'Index', 'Taille', 'Écritures subies'], tablefmt='pretty'))
+
+    avec_connexion(rapport)
@@ -0,0 +1,208 @@
+import argparse
+import io
+import re
+import struct
+import time
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from config import avec_connexion
+
+# Format binaire de COPY : signature, drapeaux (int32), extension d'en-tête (int32) ... fin (int16 -1)
+ENTETE = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+FIN = struct.pack('>h', -1)
+
+
+def numeric_binaire(valeur):
+    """Valeur NUMERIC au format binaire de PostgreSQL (numeric_send)
+
+    Nombre de chiffres, poids, signe et échelle puis chiffres en base 10000 alignés sur la
+    virgule. Un flottant est pris par sa représentation décimale la plus courte, celle
+    qu'écrit to_csv : la valeur stockée est la même qu'en format texte.
+    """
+    nombre = valeur if isinstance(valeur, Decimal) else Decimal(str(valeur))
+    if nombre.is_nan():
+        return struct.pack('>hhHh', 0, 0, 0xC000, 0)
+    if not nombre.is_finite():
+        raise ValueError(f"Valeur NUMERIC infinie non encodable: {valeur}")
+    signe, chiffres, exposant = nombre.as_tuple()
+    echelle = max(0, -exposant)
+    texte = ''.join(map(str, chiffres)) + '0' * max(0, exposant)
+    entiers = len(texte) - echelle
+    if entiers < 0:
+        texte = '0' * -entiers + texte
+        entiers = 0
+    # Groupes de 4 chiffres de part et d'autre de la virgule
+    texte = '0' * (-entiers % 4) + texte + '0' * (-echelle % 4)
+    entiers += -entiers % 4
+    groupes = [int(texte[i:i + 4]) for i in range(0, len(texte), 4)]
+    poids = entiers // 4 - 1
+    while groupes and groupes[0] == 0:
+        groupes.pop(0)
+        poids -= 1
+    while groupes and groupes[-1] == 0:
+        groupes.pop()
+    if not groupes:
+        poids, signe = 0, 0
+    return struct.pack(f'>hhHh{len(groupes)}H', len(groupes), poids, 0x4000 if signe else 0,
+                       echelle, *groupes)
+
+
+# Type de colonne (format_type) -> dtype big-endian du format binaire ; None : texte UTF-8 ;
+# fonction : encodage de longueur variable, valeur par valeur
+TYPES_BINAIRES = {
+    'smallint': '>i2',
+    'integer': '>i4',
+    'bigint': '>i8',
+    'real': '>f4',
+    'double precision': '>f8',
+    'numeric': numeric_binaire,
+    'text': None,
+    'character varying': None,
+    'character': None,
+}
+
+
+def types_copy(cur, commande_copy):
+    """Types des colonnes d'une commande "COPY table (col, ...) FROM STDIN", ou None
+
+    None quand une colonne n'a pas d'encodage binaire ici (date...) : le flux reste en texte.
+    """
+    correspondance = re.match(r'\s*COPY\s+(\w+)\s*\(([^)]*)\)\s+FROM\s+STDIN\s*$', commande_copy, re.I)
+    if correspondance is None:
+        return None
+    table, colonnes = correspondance.group(1), [c.strip() for c in correspondance.group(2).split(',')]
+    cur.execute("""
+        SELECT a.attname, format_type(a.atttypid, NULL)
+        FROM pg_attribute a
+        WHERE a.attrelid = %s::regclass AND a.attname = ANY(%s) AND NOT a.attisdropped
+    """, (table, colonnes))
+    types = dict(cur.fetchall())
+    if any(types.get(c) not in TYPES_BINAIRES for c in colonnes):
+        return None
+    return [types[c] for c in colonnes]
+
+
+class EncodeurBinaire:
+    """Encode des DataFrame (colonnes dans l'ordre du COPY) au format binaire de COPY
+
+    Les lignes sont regroupées par motif (valeurs NULL, longueur de chaque texte) : chaque
+    groupe a une disposition fixe, décrite par un dtype structuré NumPy, et s'écrit d'un
+    seul tobytes(). L'ordre des lignes n'a pas d'importance pour COPY.
+    """
+
+    def __init__(self, types):
+        self.types = types
+        self.formats = [TYPES_BINAIRES[t] for t in types]
+        # Colonnes de longueur variable (texte, NUMERIC)
+        self.variables = [f is None or callable(f) for f in self.formats]
+        self.entete = ENTETE
+        self.fin = FIN
+
+    def encoder(self, df):
+        nb_lignes = len(df)
+        valeurs = []
+        longueurs = np.empty((nb_lignes, len(self.formats)), dtype=np.int64)
+        for j, format_binaire in enumerate(self.formats):
+            serie = df.iloc[:, j]
+            nuls = serie.isna().to_numpy()
+            if self.variables[j]:
+                if format_binaire is None:
+                    octets = serie.where(~nuls, '').astype(str).str.encode('utf-8').to_numpy(dtype=object)
+                else:
+                    octets = np.array([b'' if nul else format_binaire(v)
+                                       for v, nul in zip(serie.to_numpy(dtype=object), nuls)], dtype=object)
+                longueurs[:, j] = np.fromiter(map(len, octets), dtype=np.int64, count=nb_lignes)
+                valeurs.append(octets)
+            else:
+                genre = np.float64 if format_binaire[1] == 'f' else np.int64
+                valeurs.append(serie.to_numpy(dtype=genre, na_value=0))
+                longueurs[:, j] = np.dtype(format_binaire).itemsize
+            longueurs[nuls, j] = -1
+
+        # Un groupe par motif de longueurs (-1 : NULL)
+        motifs, groupe = np.unique(longueurs, axis=0, return_inverse=True)
+        groupe = groupe.reshape(-1)
+        ordre = np.argsort(groupe, kind='stable')
+        bornes = np.cumsum(np.bincount(groupe, minlength=len(motifs)))[:-1]
+
+        morceaux = []
+        for motif, lignes in zip(motifs, np.split(ordre, bornes)):
+            champs = [('n', '>i2')]
+            for j, longueur in enumerate(motif):
+                champs.append((f'l{j}', '>i4'))
+                if longueur > 0:
+                    champs.append((f'v{j}', f'S{longueur}' if self.variables[j] else self.formats[j]))
+            tableau = np.empty(len(lignes), dtype=champs)
+            tableau['n'] = len(self.formats)
+            for j, longueur in enumerate(motif):
+                tableau[f'l{j}'] = longueur
+                if longueur > 0:
+                    tableau[f'v{j}'] = valeurs[j][lignes]
+            morceaux.append(tableau.tobytes())
+        return b''.join(morceaux)
+
+
+def comparer_encodages(conn, df, types, repetitions=3):
+    """Débit de bout en bout (lignes/s) : texte (to_csv) contre binaire, sur le même bloc
+
+    Chaque mesure couvre l'encodage et un COPY réel dans une table temporaire aux types
+    donnés ; la transaction est annulée à la fin.
+    """
+    encodeur = EncodeurBinaire(types)
+    colonnes = [f"c{j}" for j in range(len(types))]
+    commande = f"COPY comparaison_copy ({', '.join(colonnes)}) FROM STDIN"
+    formats = (
+        ('texte', commande,
+         lambda: io.StringIO(df.to_csv(sep='\t', header=False, index=False, na_rep='\\N'))),
+        ('binaire', commande + " (FORMAT binary)",
+         lambda: io.BytesIO(encodeur.entete + encodeur.encoder(df) + encodeur.fin)),
+    )
+    resultats = {}
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"CREATE TEMP TABLE comparaison_copy "
+                        f"({', '.join(f'{c} {t}' for c, t in zip(colonnes, types))}) ON COMMIT DROP")
+            for nom, copy, flux in formats:
+                durees = []
+                for _ in range(repetitions):
+                    cur.execute("TRUNCATE comparaison_copy")
+                    debut = time.perf_counter()
+                    donnees = flux()
+                    cur.copy_expert(copy, donnees)
+                    durees.append(time.perf_counter() - debut)
+                duree = max(min(durees), 1e-9)
+                octets = len(donnees.getvalue() if nom == 'binaire' else donnees.getvalue().encode('utf-8'))
+                resultats[nom] = {'lignes_par_s': round(len(df) / duree), 'octets': octets}
+    finally:
+        conn.rollback()
+    return resultats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare les COPY texte et binaire sur un fichier INSEE")
+    parser.add_argument('fichier', nargs='?', default='base-cc-serie-historique-2021.csv')
+    parser.add_argument('--lignes', type=int, default=50000, help="Communes lues dans le fichier")
+    args = parser.parse_args()
+
+    # Même forme que statistique_import : (com_id, type_id, annee, valeur) au format long
+    large = pd.read_csv(args.fichier, sep=';', dtype={'CODGEO': str}, nrows=args.lignes)
+    colonnes = [c for c in large.columns if c != 'CODGEO']
+    long_df = large.reset_index().melt(id_vars='index', value_vars=colonnes, var_name='colonne', value_name='valeur')
+    long_df['valeur'] = pd.to_numeric(long_df['valeur'], errors='coerce')
+    long_df = long_df[long_df['valeur'].notna()]
+    bloc = pd.DataFrame({
+        'com_id': long_df['index'].to_numpy() + 1,
+        'type_id': long_df['colonne'].astype('category').cat.codes.to_numpy() + 1,
+        'annee': pd.array(np.where(long_df['colonne'].str.contains(r'\d'), 2021, 0), dtype='Int64'),
+        'valeur': long_df['valeur'].to_numpy(),
+    })
+    bloc.loc[bloc['annee'] == 0, 'annee'] = pd.NA
+
+    def rapport(conn):
+        for nom, mesure in comparer_encodages(conn, bloc, ['integer', 'integer', 'integer', 'numeric']).items():
+            print(f"{nom}: {len(bloc)} lignes, {mesure['lignes_par_s']} lignes/s, {mesure['octets'] / 1e6:.1f} Mo")
+
+    avec_connexion(rapport)
@@ -1,15 +1,30 @@
+import argparse
+import hashlib
+import os
+import re
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
 import pandas as pd
-from psycopg2 import sql
-from io import StringIO
-
-# Configuration de la connexion
-DB_CONFIG = {
-    'host': 'localhost',
-    'database': 'inseedb',
-    'user': 'postgres',
-    'password': 'admin'
-}
+import time
+
+from chargement_massif import analyser_tables, finaliser_chargement_massif, preparer_chargement_massif
+from classements import installer_classements, rafraichir_classements
+from config import DB_CONFIG
+from copy_binaire import EncodeurBinaire, types_copy
+from hierarchie import installer_hierarchie, rafraichir_hierarchie
+from index_communes import IndexCommunes
+from instrumentation import APPLICATION_CHARGEMENT, Instrumentation, charger_budgets, compter_flux, signaler_flux
+from rollups import agregats_a_jour, installer_agregats, maintenance_differee, rafraichir_populations
+from series_population import installer_series, rafraichir_series
+from stockage_large import verifier_disposition_eav
+from version_donnees import incrementer_version, installer_version
+
+# Connexions du chargeur, reconnues par l'échantillonnage de l'instrumentation
+CONFIG_CHARGEMENT = dict(DB_CONFIG, application_name=APPLICATION_CHARGEMENT)
 
 def create_tables(conn):
     """Crée les tables selon le schéma relationnel"""
@@ -31,15 +46,62 @@ def create_tables(conn):
         );
         """)
         
+        # Tables ARRONDISSEMENT, CANTON et COLLECTIVITE (colonnes ARR, CAN, CTCD des communes)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS arrondissement (
+            arr_id VARCHAR(4) PRIMARY KEY,
+            name VARCHAR(100),
+            dep_id VARCHAR(3) NOT NULL REFERENCES departement(dep_id)
+        );
+        """)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS canton (
+            can_id VARCHAR(5) PRIMARY KEY,
+            name VARCHAR(100),
+            dep_id VARCHAR(3) NOT NULL REFERENCES departement(dep_id)
+        );
+        """)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS collectivite (
+            ctcd_id VARCHAR(4) PRIMARY KEY,
+            reg_id VARCHAR(2) NOT NULL REFERENCES region(reg_id)
+        );
+        """)
+        
         # Table COMMUNE
         cur.execute("""
         CREATE TABLE IF NOT EXISTS commune (
             com_id SERIAL PRIMARY KEY,
             code_insee VARCHAR(5) NOT NULL UNIQUE,
             name VARCHAR(100) NOT NULL,
-            dep_id VARCHAR(3) NOT NULL REFERENCES departement(dep_id)
+            dep_id VARCHAR(3) NOT NULL REFERENCES departement(dep_id),
+            arr_id VARCHAR(4) REFERENCES arrondissement(arr_id),
+            can_id VARCHAR(5) REFERENCES canton(can_id),
+            ctcd_id VARCHAR(4) REFERENCES collectivite(ctcd_id)
         );
         """)
+        # Bases créées avant l'ajout des niveaux
+        cur.execute("""
+        ALTER TABLE commune
+            ADD COLUMN IF NOT EXISTS arr_id VARCHAR(4) REFERENCES arrondissement(arr_id),
+            ADD COLUMN IF NOT EXISTS can_id VARCHAR(5) REFERENCES canton(can_id),
+            ADD COLUMN IF NOT EXISTS ctcd_id VARCHAR(4) REFERENCES collectivite(ctcd_id);
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_commune_arr_id ON commune(arr_id);")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_commune_can_id ON commune(can_id);")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_commune_ctcd_id ON commune(ctcd_id);")
+
+        # Table COMMUNE_RATTACHEE (communes associées, déléguées, arrondissements municipaux)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS commune_rattachee (
+            code_insee VARCHAR(5) NOT NULL,
+            typecom VARCHAR(4) NOT NULL,
+            name VARCHAR(100) NOT NULL,
+            com_parent_id INTEGER NOT NULL REFERENCES commune(com_id),
+            PRIMARY KEY (typecom, code_insee)
+        );
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_commune_rattachee_parent ON commune_rattachee(com_parent_id);")
         
         # Table CHEFLIEUREGION
         cur.execute("""
@@ -84,107 +146,322 @@ def create_tables(conn):
         cur.execute("CREATE INDEX IF NOT EXISTS idx_statistique_com_id ON statistique(com_id);")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_statistique_type_id ON statistique(type_id);")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_statistique_annee ON statistique(annee);")
+
+        # UNIQUE (com_id, type_id, annee) laisse passer les doublons quand annee IS NULL
+        # (SUPERF, NAIS*, DECE*) : on les supprime puis on les interdit, une seule fois
+        cur.execute("SELECT to_regclass('uq_statistique_cle') IS NULL")
+        if cur.fetchone()[0]:
+            cur.execute("""
+            DELETE FROM statistique s
+            USING statistique autre
+            WHERE s.com_id = autre.com_id
+            AND s.type_id = autre.type_id
+            AND s.annee IS NULL AND autre.annee IS NULL
+            AND s.id > autre.id;
+            """)
+            cur.execute("""
+            CREATE UNIQUE INDEX uq_statistique_cle
+            ON statistique (com_id, type_id, COALESCE(annee, -1));
+            """)
+
+        # Table EMPREINTE_SOURCE (synchronisation incrémentale)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS empreinte_source (
+            source VARCHAR(200) PRIMARY KEY,
+            empreinte CHAR(64) NOT NULL,
+            date_maj TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+
+        # Compteur de version des données (invalidation des caches de résultats)
+        installer_version(cur)
+
+        # Séries de population par entité (serie_population)
+        installer_series(cur)
+
+        # Fermeture de la hiérarchie territoriale et agrégats par niveau
+        installer_hierarchie(cur)
+
+        # Classements précalculés (pagination par curseur)
+        installer_classements(cur)
+
+        # Table de transit des statistiques : recréée à la première utilisation (format com_id)
+        cur.execute("DROP TABLE IF EXISTS statistique_import;")
+
+        # Agrégats déjà installés par ces mêmes scripts : pas de recalcul complet
+        agregats_installes = agregats_a_jour(cur)
         
         conn.commit()
 
-def import_regions(conn):
+    # Agrégats de population par département / région (question2.sql), à l'installation
+    # ou quand question2.sql / question5.sql ont changé
+    if not agregats_installes:
+        installer_agregats(conn)
+
+# Taille des blocs lus dans les CSV : fixe la mémoire utilisée, quelle que soit la taille du fichier
+TAILLE_BLOC = 50000
+
+
+def lire_csv_par_blocs(fichier_csv, taille_bloc=TAILLE_BLOC, **options):
+    """Générateur de blocs de lignes d'un CSV (mémoire bornée par taille_bloc)"""
+    with pd.read_csv(fichier_csv, chunksize=taille_bloc, **options) as lecteur:
+        for bloc in lecteur:
+            yield bloc
+
+
+class FluxCopy:
+    """Adaptateur fichier pour copy_expert : formate les blocs au fil de la lecture"""
+
+    def __init__(self, blocs, preparer, nom='', encodeur=None):
+        self._blocs = iter(blocs)
+        self._preparer = preparer  # bloc -> DataFrame aux colonnes de la commande COPY
+        self._nom = nom
+        # encodeur : format binaire (copy_binaire.EncodeurBinaire), entête puis blocs puis fin
+        self._encodeur = encodeur
+        self._tampon = encodeur.entete if encodeur else ''
+        self._fin_envoyee = encodeur is None
+        self._position = 0
+        self._debut_bloc = time.perf_counter()
+        self.nb_blocs = 0
+        self.lignes = 0
+        self.octets = 0
+
+    def _bloc_suivant(self):
+        """Formate le bloc suivant (texte ou binaire COPY) ; False si la source est épuisée"""
+        for bloc in self._blocs:
+            donnees = self._preparer(bloc)
+            if donnees is None or donnees.empty:
+                continue
+            if self._encodeur is not None:
+                self._tampon = self._encodeur.encoder(donnees)
+            else:
+                self._tampon = donnees.to_csv(sep='\t', header=False, index=False, na_rep='\\N')
+            self._position = 0
+
+            # Débit par bloc (lecture + formatage + envoi du bloc précédent)
+            maintenant = time.perf_counter()
+            duree = max(maintenant - self._debut_bloc, 1e-9)
+            self._debut_bloc = maintenant
+            self.nb_blocs += 1
+            self.lignes += len(donnees)
+            print(f"  {self._nom} bloc {self.nb_blocs}: {len(donnees)} lignes, "
+                  f"{len(donnees) / duree:.0f} lignes/s")
+            return True
+        if not self._fin_envoyee:
+            self._fin_envoyee = True
+            self._tampon = self._encodeur.fin
+            self._position = 0
+            return True
+        return False
+
+    def read(self, taille=-1):
+        if self._position >= len(self._tampon) and not self._bloc_suivant():
+            return self._tampon[:0]
+        if taille is None or taille < 0:
+            fin = len(self._tampon)
+        else:
+            fin = self._position + taille
+        morceau = self._tampon[self._position:fin]
+        self._position += len(morceau)
+        self.octets += len(morceau)
+        return morceau
+
+    def readline(self, taille=-1):
+        if self._position >= len(self._tampon) and not self._bloc_suivant():
+            return ''
+        fin = self._tampon.find('\n', self._position)
+        fin = len(self._tampon) if fin < 0 else fin + 1
+        morceau = self._tampon[self._position:fin]
+        self._position = fin
+        self.octets += len(morceau)
+        return morceau
+
+
+def copier_csv_en_flux(cur, fichier_csv, commande_copy, preparer, taille_bloc=TAILLE_BLOC,
+                       format_copy='texte', **options):
+    """Envoie un CSV à COPY bloc par bloc sans jamais le matérialiser en entier
+
+    format_copy : 'texte' (défaut) ou 'binaire' (COPY ... (FORMAT binary)). En format binaire,
+    les colonnes sont encodées selon les types de la table cible ; une colonne sans encodage
+    binaire (copy_binaire.TYPES_BINAIRES) ramène ce COPY au format texte. Les NUMERIC sont
+    encodés valeur par valeur en Python : avec une telle colonne (statistique_import), le
+    binaire est plus lent que le texte et envoie plus d'octets.
+    """
+    debut = time.perf_counter()
+    types = types_copy(cur, commande_copy) if format_copy == 'binaire' else None
+    encodeur = EncodeurBinaire(types) if types else None
+    flux = FluxCopy(lire_csv_par_blocs(fichier_csv, taille_bloc, **options), preparer, nom=fichier_csv,
+                    encodeur=encodeur)
+    cur.copy_expert(commande_copy + (" (FORMAT binary)" if encodeur else ""), flux, size=1 << 20)
+    duree = max(time.perf_counter() - debut, 1e-9)
+    signaler_flux(flux.lignes, flux.octets)
+    print(f"{fichier_csv}: {flux.lignes} lignes en {flux.nb_blocs} blocs ({'binaire' if encodeur else 'texte'}), "
+          f"{flux.octets / 1e6:.1f} Mo, {flux.lignes / duree:.0f} lignes/s")
+    return flux
+
+
+def autoriser_referentiel(cur):
+    """Lève la protection de region / departement (question5.sql) jusqu'à la fin de la transaction"""
+    cur.execute("SET LOCAL insee.chargement_referentiel = 'on'")
+
+
+def import_regions(conn, fichier_csv='v_region_2024.csv', format_copy='texte'):
     """Importe les données des régions depuis v_region_2024.csv"""
     try:
-        df = pd.read_csv('v_region_2024.csv')
-        
-        # Vérification des colonnes disponibles
-        print("Colonnes dans v_region_2024.csv:", df.columns.tolist())
+        # Vérification des colonnes disponibles (lecture de l'en-tête seulement)
+        print("Colonnes dans v_region_2024.csv:", pd.read_csv(fichier_csv, nrows=0).columns.tolist())
         
         # Les colonnes attendues sont: REG, CHEFLIEU, TNCC, NCC, NCCENR, LIBELLE
         with conn.cursor() as cur:
-            # Préparation pour COPY
-            output = StringIO()
-            df.to_csv(output, sep='\t', header=False, index=False, 
-                     columns=['REG', 'LIBELLE'])  # On prend REG et LIBELLE
-            
-            output.seek(0)
-            
-            # Import
-            cur.copy_expert(
+            autoriser_referentiel(cur)
+            flux = copier_csv_en_flux(
+                cur, fichier_csv,
                 "COPY region (reg_id, name) FROM STDIN",
-                output
+                lambda bloc: bloc[['REG', 'LIBELLE']],  # On prend REG et LIBELLE
+                format_copy=format_copy, dtype=str
             )
+            incrementer_version(cur, 'region')
             conn.commit()
-            print(f"Importation réussie: {len(df)} régions importées")
+            print(f"Importation réussie: {flux.lignes} régions importées")
+            return flux.lignes
             
     except Exception as e:
         print(f"Erreur lors de l'importation des régions: {str(e)}")
         conn.rollback()
         raise
 
-def import_departements(conn):
+def import_departements(conn, fichier_csv='v_departement_2024.csv', format_copy='texte'):
     """Importe les données des départements"""
-    df = pd.read_csv('v_departement_2024.csv')
-    
     with conn.cursor() as cur:
-        # Préparation pour COPY
-        output = StringIO()
-        df.to_csv(output, sep='\t', header=False, index=False, 
-                 columns=['DEP', 'LIBELLE', 'REG'])
-        output.seek(0)
-        
-        # Import
-        cur.copy_expert(
+        autoriser_referentiel(cur)
+        flux = copier_csv_en_flux(
+            cur, fichier_csv,
             "COPY departement (dep_id, name, reg_id) FROM STDIN",
-            output
+            lambda bloc: bloc[['DEP', 'LIBELLE', 'REG']],
+            format_copy=format_copy, dtype=str
         )
+        incrementer_version(cur, 'departement')
         conn.commit()
+        return flux.lignes
 
-def import_communes(conn):
-    """Importe les données des communes"""
-    df = pd.read_csv('v_commune_2024.csv')
-    df = df[df['TYPECOM'] == 'COM']  # Seulement les communes principales
-    
+def import_niveaux(conn, fichier_csv='v_commune_2024.csv',
+                   fichier_arrondissements='v_arrondissement_2024.csv',
+                   fichier_cantons='v_canton_2024.csv'):
+    """Importe arrondissements, cantons et collectivités à partir des codes du fichier des communes
+
+    Les libellés viennent des fichiers INSEE des arrondissements / cantons s'ils sont présents.
+    """
+    df = pd.read_csv(fichier_csv, usecols=['TYPECOM', 'REG', 'DEP', 'ARR', 'CAN', 'CTCD'], dtype=str)
+    df = df[df['TYPECOM'] == 'COM']
+
+    def libelles(fichier, colonne):
+        if not os.path.exists(fichier):
+            return {}
+        ref = pd.read_csv(fichier, usecols=[colonne, 'LIBELLE'], dtype=str)
+        return dict(zip(ref[colonne], ref['LIBELLE']))
+
+    noms_arr = libelles(fichier_arrondissements, 'ARR')
+    noms_can = libelles(fichier_cantons, 'CAN')
+    arrondissements = df[['ARR', 'DEP']].dropna().drop_duplicates('ARR')
+    cantons = df[['CAN', 'DEP']].dropna().drop_duplicates('CAN')
+    collectivites = df[['CTCD', 'REG']].dropna().drop_duplicates('CTCD')
+
+    try:
+        with conn.cursor() as cur:
+            psycopg2.extras.execute_values(cur, """
+                INSERT INTO arrondissement (arr_id, name, dep_id) VALUES %s
+                ON CONFLICT (arr_id) DO UPDATE SET
+                    name = COALESCE(EXCLUDED.name, arrondissement.name), dep_id = EXCLUDED.dep_id
+            """, [(arr, noms_arr.get(arr), dep) for arr, dep in arrondissements.itertuples(index=False)])
+            psycopg2.extras.execute_values(cur, """
+                INSERT INTO canton (can_id, name, dep_id) VALUES %s
+                ON CONFLICT (can_id) DO UPDATE SET
+                    name = COALESCE(EXCLUDED.name, canton.name), dep_id = EXCLUDED.dep_id
+            """, [(can, noms_can.get(can), dep) for can, dep in cantons.itertuples(index=False)])
+            psycopg2.extras.execute_values(cur, """
+                INSERT INTO collectivite (ctcd_id, reg_id) VALUES %s
+                ON CONFLICT (ctcd_id) DO UPDATE SET reg_id = EXCLUDED.reg_id
+            """, list(collectivites.itertuples(index=False, name=None)))
+            incrementer_version(cur, 'niveaux')
+            conn.commit()
+            print(f"Niveaux importés: {len(arrondissements)} arrondissements, {len(cantons)} cantons, "
+                  f"{len(collectivites)} collectivités")
+            return len(arrondissements) + len(cantons) + len(collectivites)
+
+    except Exception as e:
+        print(f"Erreur niveaux: {str(e)}")
+        conn.rollback()
+        raise
+
+def import_communes(conn, fichier_csv='v_commune_2024.csv', format_copy='texte'):
+    """Importe les données des communes (avec arrondissement, canton et collectivité)"""
     with conn.cursor() as cur:
-        # Préparation pour COPY
-        output = StringIO()
-        df.to_csv(output, sep='\t', header=False, index=False, 
-                 columns=['COM', 'LIBELLE', 'DEP'])
-        output.seek(0)
-        
-        # Import
-        cur.copy_expert(
-            "COPY commune (code_insee, name, dep_id) FROM STDIN",
-            output
+        flux = copier_csv_en_flux(
+            cur, fichier_csv,
+            "COPY commune (code_insee, name, dep_id, arr_id, can_id, ctcd_id) FROM STDIN",
+            # Seulement les communes principales ; les autres vont dans commune_rattachee
+            lambda bloc: bloc.loc[bloc['TYPECOM'] == 'COM', ['COM', 'LIBELLE', 'DEP', 'ARR', 'CAN', 'CTCD']],
+            format_copy=format_copy, dtype=str
         )
+        incrementer_version(cur, 'commune')
         conn.commit()
+        return flux.lignes
 
-def import_chefs_lieux(conn):
-    """Importe les chefs-lieux de région et département"""
+def import_communes_rattachees(conn, index=None, fichier_csv='v_commune_2024.csv', format_copy='texte'):
+    """Importe les communes associées / déléguées et arrondissements municipaux, liés à leur parente"""
     try:
-        # Chefs-lieux de région
-        df_reg = pd.read_csv('v_region_2024.csv')
-        print("Colonnes pour chefs-lieux région:", df_reg.columns.tolist())
-        
         with conn.cursor() as cur:
+            if index is None:
+                index = IndexCommunes.depuis_base(cur)
+            cur.execute("TRUNCATE commune_rattachee;")
+            flux = copier_csv_en_flux(
+                cur, fichier_csv,
+                "COPY commune_rattachee (code_insee, typecom, name, com_parent_id) FROM STDIN",
+                lambda bloc: index.resoudre(bloc.loc[bloc['TYPECOM'] != 'COM'], 'COMPARENT',
+                                            source=f"{fichier_csv} (COMPARENT)")
+                    [['COM', 'TYPECOM', 'LIBELLE', 'com_id']],
+                format_copy=format_copy, dtype=str
+            )
+            incrementer_version(cur, 'commune_rattachee')
+            conn.commit()
+            return flux.lignes
+
+    except Exception as e:
+        print(f"Erreur communes rattachées: {str(e)}")
+        conn.rollback()
+        raise
+
+def import_chefs_lieux(conn, index=None, fichier_regions='v_region_2024.csv',
+                       fichier_departements='v_departement_2024.csv', format_copy='texte'):
+    """Importe les chefs-lieux de région et département
+
+    Les codes CHEFLIEU sont résolus en com_id par l'index des communes ; les codes
+    inconnus sont écartés et signalés au lieu d'insérer un com_id NULL.
+    """
+    try:
+        with conn.cursor() as cur:
+            if index is None:
+                index = IndexCommunes.depuis_base(cur)
+
             # Vider les tables avant import (optionnel)
             cur.execute("TRUNCATE chef_lieu_region, chef_lieu_departement;")
-            
-            # Régions
-            for _, row in df_reg.iterrows():
-                cur.execute(
-                    "INSERT INTO chef_lieu_region (reg_id, com_id) "
-                    "VALUES (%s, (SELECT com_id FROM commune WHERE code_insee = %s))",
-                    (row['REG'], row['CHEFLIEU'])
-                )
-            
-            # Départements
-            df_dep = pd.read_csv('v_departement_2024.csv')
-            
-            for _, row in df_dep.iterrows():
-                cur.execute(
-                    "INSERT INTO chef_lieu_departement (dep_id, com_id) "
-                    "VALUES (%s, (SELECT com_id FROM commune WHERE code_insee = %s))",
-                    (row['DEP'], row['CHEFLIEU'])
+
+            for table, cle, fichier, colonne in [
+                ('chef_lieu_region', 'reg_id', fichier_regions, 'REG'),
+                ('chef_lieu_departement', 'dep_id', fichier_departements, 'DEP'),
+            ]:
+                copier_csv_en_flux(
+                    cur, fichier,
+                    f"COPY {table} ({cle}, com_id) FROM STDIN",
+                    lambda bloc, fichier=fichier, colonne=colonne:
+                        index.resoudre(bloc, 'CHEFLIEU', source=fichier)[[colonne, 'com_id']],
+                    format_copy=format_copy, dtype=str
                 )
             
+            incrementer_version(cur, 'chefs_lieux')
             conn.commit()
             print("Importation chefs-lieux réussie")
+            index.rapport_non_resolus()
             
     except Exception as e:
         print(f"Erreur chefs-lieux: {str(e)}")
@@ -241,132 +518,560 @@ def importer_types_statistiques(conn):
             "INSERT INTO type_statistique (nom, description) VALUES (%s, %s) ON CONFLICT (nom) DO NOTHING",
             types_stats
         )
+        incrementer_version(cur, 'type_statistique')
         conn.commit()
         print(f"{len(types_stats)} types de statistiques ajoutés")
 
 
-def importer_statistiques_communes(conn, fichier_csv):
-    """Importe toutes les statistiques depuis le fichier INSEE de manière optimisée"""
-    try:
-        # 1. Chargement et préparation des données
-        df = pd.read_csv(fichier_csv, sep=';', dtype={'CODGEO': str})
-        df['CODGEO'] = df['CODGEO'].str.zfill(5)  # Formatage des codes INSEE sur 5 chiffres
-
-        # 2. Définition des mappings complets avec les années associées
-        mappings = {
-            # Population (avec années déduites)
-            'P21_POP': ('P21_POP', 2021),
-            'P15_POP': ('P15_POP', 2015),
-            'P10_POP': ('P10_POP', 2010),
-            'D99_POP': ('D99_POP', 1999),
-            'D90_POP': ('D90_POP', 1990),
-            'D82_POP': ('D82_POP', 1982),
-            'D75_POP': ('D75_POP', 1975),
-            'D68_POP': ('D68_POP', 1968),
-            
-            # Superficie (pas d'année)
-            'SUPERF': ('SUPERF', None),
-            
-            # Logements
-            'P21_LOG': ('P21_LOG', 2021),
-            'P15_LOG': ('P15_LOG', 2015),
-            'P10_LOG': ('P10_LOG', 2010),
-            'D99_LOG': ('D99_LOG', 1999),
-            'D90_LOG': ('D90_LOG', 1990),
-            'D82_LOG': ('D82_LOG', 1982),
-            'D75_LOG': ('D75_LOG', 1975),
-            'D68_LOG': ('D68_LOG', 1968),
-            
-            # Naissances (périodes sans année spécifique)
-            'NAIS1520': ('NAIS1520', None),
-            'NAIS1014': ('NAIS1014', None),
-            'NAIS9909': ('NAIS9909', None),
-            'NAIS9099': ('NAIS9099', None),
-            'NAIS8290': ('NAIS8290', None),
-            'NAIS7582': ('NAIS7582', None),
-            'NAIS6875': ('NAIS6875', None),
-            
-            # Décès (périodes sans année spécifique)
-            'DECE1520': ('DECE1520', None),
-            'DECE1014': ('DECE1014', None),
-            'DECE9909': ('DECE9909', None),
-            'DECE9099': ('DECE9099', None),
-            'DECE8290': ('DECE8290', None),
-            'DECE7582': ('DECE7582', None),
-            'DECE6875': ('DECE6875', None),
-            
-        }
+# Familles d'indicateurs des fichiers INSEE
+FAMILLES = {
+    'POP': 'Population',
+    'LOG': 'Logements',
+    'NAIS': 'Naissances',
+    'DECE': 'Décès',
+}
+
+
+def _annee_complete(aa):
+    """Convertit une année sur 2 chiffres ('68', '21') en année complète"""
+    aa = int(aa)
+    return 2000 + aa if aa < 50 else 1900 + aa
+
+
+def deriver_mappings(colonnes):
+    """Déduit le mapping colonne -> (type, année) à partir des noms de colonnes INSEE"""
+    mappings = {}
+    for col in colonnes:
+        # Recensements : P21_POP, D99_LOG... (année dans le nom)
+        recensement = re.fullmatch(r'[PD](\d{2})_[A-Z0-9]+', col)
+        # Périodes intercensitaires : NAIS1520, DECE6875... (pas d'année unique)
+        periode = re.fullmatch(r'(NAIS|DECE)\d{4}', col)
+        if recensement:
+            mappings[col] = (col, _annee_complete(recensement.group(1)))
+        elif periode or col == 'SUPERF':
+            mappings[col] = (col, None)
+    return mappings
+
+
+def decrire_type(nom):
+    """Description d'un type de statistique déduite de son nom"""
+    if nom == 'SUPERF':
+        return 'Superficie en km²'
+    recensement = re.fullmatch(r'[PD](\d{2})_([A-Z0-9]+)', nom)
+    if recensement:
+        famille = FAMILLES.get(recensement.group(2), recensement.group(2))
+        return f"{famille} en {_annee_complete(recensement.group(1))}"
+    periode = re.fullmatch(r'(NAIS|DECE)(\d{2})(\d{2})', nom)
+    if periode:
+        return (f"{FAMILLES[periode.group(1)]} "
+                f"{_annee_complete(periode.group(2))}-{_annee_complete(periode.group(3))}")
+    return None
 
+
+def enregistrer_types(conn, mappings):
+    """Ajoute à type_statistique les types d'un mapping qui n'y sont pas encore"""
+    types_stats = sorted({(nom, decrire_type(nom)) for nom, _ in mappings.values()})
+    with conn.cursor() as cur:
+        cur.executemany(
+            "INSERT INTO type_statistique (nom, description) VALUES (%s, %s) ON CONFLICT (nom) DO NOTHING",
+            types_stats
+        )
+        incrementer_version(cur, 'type_statistique')
+        conn.commit()
+
+
+def departement_de_code(codes):
+    """Code département d'une série de codes INSEE (3 caractères en outre-mer)"""
+    return codes.str[:2].where(~codes.str.startswith('97'), codes.str[:3])
+
+
+def charger_transit_statistiques(cur, fichier_csv, taille_bloc=TAILLE_BLOC, mappings=None,
+                                 departements=None, transit_temporaire=False, index=None,
+                                 format_copy='texte'):
+    """Charge en flux le fichier INSEE, au format long, dans la table statistique_import
+
+    Les codes INSEE sont résolus en com_id côté client par l'index des communes.
+    Renvoie (lignes en transit, valeurs invalides rejetées, communes inconnues écartées).
+    """
+    if index is None:
+        index = IndexCommunes.depuis_base(cur)
+    nb_inconnues_avant = index.nb_non_resolus(fichier_csv)
+
+    # 1. Lecture de l'en-tête seulement : les données sont lues par blocs
+    entete = pd.read_csv(fichier_csv, sep=';', nrows=0).columns
+
+    # 2. Mapping colonne -> (type, année) déduit du millésime du fichier
+    if mappings is None:
+        mappings = deriver_mappings(entete)
+
+    colonnes = [col for col in mappings if col in entete]
+    for csv_col in mappings:
+        if csv_col not in entete:
+            print(f"Colonne {csv_col} non trouvée - ignorée")
+
+    # 3. Récupération des IDs des types
+    cur.execute("SELECT id, nom FROM type_statistique")
+    type_ids = {nom: id for id, nom in cur.fetchall()}
+
+    for csv_col in list(colonnes):
+        if mappings[csv_col][0] not in type_ids:
+            print(f"Type {mappings[csv_col][0]} non trouvé - ignoré")
+            colonnes.remove(csv_col)
+
+    type_par_colonne = {col: type_ids[mappings[col][0]] for col in colonnes}
+    annee_par_colonne = {col: mappings[col][1] for col in colonnes}
+    nb_invalides = 0
+
+    def preparer(bloc):
+        """4. Passage du format large au format long, bloc par bloc"""
+        nonlocal nb_invalides
+        bloc['CODGEO'] = bloc['CODGEO'].str.zfill(5)  # Formatage des codes INSEE sur 5 chiffres
+        if departements is not None:
+            bloc = bloc[departement_de_code(bloc['CODGEO']).isin(departements)]
+        # Résolution code_insee -> com_id une fois par commune, avant le passage au format long
+        bloc = index.resoudre(bloc, 'CODGEO', source=fichier_csv)
+        long_df = bloc.melt(id_vars='com_id', value_vars=colonnes,
+                            var_name='colonne', value_name='brut')
+        long_df = long_df[long_df['brut'].notna() & (long_df['brut'] != '')]
+        long_df['valeur'] = pd.to_numeric(long_df['brut'], errors='coerce')
+
+        # Valeurs non numériques : rejetées côté client
+        invalides = long_df['valeur'].isna()
+        nb_invalides += int(invalides.sum())
+        long_df = long_df[~invalides]
+
+        long_df['type_id'] = long_df['colonne'].map(type_par_colonne)
+        long_df['annee'] = long_df['colonne'].map(annee_par_colonne).astype('Int64')
+        return long_df[['com_id', 'type_id', 'annee', 'valeur']]
+
+    # 5. Chargement en flux dans la table de transit (UNLOGGED, sans index)
+    cur.execute(f"""
+    CREATE {'TEMP' if transit_temporaire else 'UNLOGGED'} TABLE IF NOT EXISTS statistique_import (
+        com_id INTEGER,
+        type_id INTEGER,
+        annee INTEGER,
+        valeur NUMERIC
+    );
+    """)
+    cur.execute("TRUNCATE statistique_import;")
+
+    flux = copier_csv_en_flux(
+        cur, fichier_csv,
+        "COPY statistique_import (com_id, type_id, annee, valeur) FROM STDIN",
+        preparer, taille_bloc, format_copy,
+        sep=';', dtype={'CODGEO': str}
+    )
+    return flux.lignes, nb_invalides, index.nb_non_resolus(fichier_csv) - nb_inconnues_avant
+
+
+def importer_statistiques_communes(conn, fichier_csv, taille_bloc=TAILLE_BLOC, mappings=None,
+                                   departements=None, transit_temporaire=False, index=None,
+                                   format_copy='texte'):
+    """Importe toutes les statistiques depuis le fichier INSEE (COPY en flux + fusion ensembliste)
+
+    departements restreint l'import à un groupe de départements (chargement parallèle) ;
+    transit_temporaire utilise une table de transit propre à la session ; index est
+    l'IndexCommunes partagé du chargement (construit ici s'il n'est pas fourni).
+    """
+    try:
         with conn.cursor() as cur:
-            # 3. Récupération des IDs des types
-            cur.execute("SELECT id, nom FROM type_statistique")
-            type_ids = {nom: id for id, nom in cur.fetchall()}
+            nb_transit, nb_invalides, nb_inconnues = charger_transit_statistiques(
+                cur, fichier_csv, taille_bloc, mappings, departements, transit_temporaire, index,
+                format_copy
+            )
 
-            # 4. Préparation de la requête d'insertion
-            insert_query = """
+            # 6. com_id déjà résolus côté client : fusion directe
+            cur.execute("""
             INSERT INTO statistique (com_id, type_id, annee, valeur)
-            SELECT c.com_id, %s, %s, %s
-            FROM commune c 
-            WHERE c.code_insee = %s
-            ON CONFLICT (com_id, type_id, annee) DO NOTHING
-            """
-
-            # 5. Parcours des données
-            total = 0
-            for csv_col, (stat_name, year) in mappings.items():
-                if csv_col not in df.columns:
-                    print(f"Colonne {csv_col} non trouvée - ignorée")
-                    continue
-
-                type_id = type_ids.get(stat_name)
-                if not type_id:
-                    print(f"Type {stat_name} non trouvé - ignoré")
-                    continue
-
-                # 6. Filtrage des données valides
-                valid_rows = df[['CODGEO', csv_col]].dropna()
-                valid_rows = valid_rows[valid_rows[csv_col] != '']
-
-                # 7. Insertion des données
-                for _, row in valid_rows.iterrows():
-                    try:
-                        valeur = float(row[csv_col])
-                        cur.execute(
-                            insert_query,
-                            (type_id, year, valeur, row['CODGEO'])
-                        )
-                        total += 1
-                    except ValueError as e:
-                        print(f"Valeur invalide pour {row['CODGEO']} {stat_name}: {row[csv_col]}")
-                    except Exception as e:
-                        print(f"Erreur sur {row['CODGEO']} {stat_name}: {str(e)}")
-                        conn.rollback()
-                        raise
+            SELECT si.com_id, si.type_id, si.annee, si.valeur
+            FROM statistique_import si
+            ON CONFLICT (com_id, type_id, COALESCE(annee, -1)) DO NOTHING
+            """)
+            nb_charges = cur.rowcount
+            nb_doublons = nb_transit - nb_charges
 
-                conn.commit()
-                print(f"{csv_col} ({stat_name}) importé: {len(valid_rows)} lignes")
+            cur.execute("TRUNCATE statistique_import;")
+            incrementer_version(cur, fichier_csv)
+            conn.commit()
 
-            print(f"\nImportation terminée: {total} enregistrements au total")
+            nb_rejetes = nb_invalides + nb_inconnues
+            print(f"\nImportation terminée: {nb_charges} enregistrements chargés, "
+                  f"{nb_rejetes} rejetés ({nb_invalides} valeurs invalides, "
+                  f"{nb_inconnues} communes inconnues), {nb_doublons} déjà présents")
+            return nb_charges, nb_rejetes
 
     except Exception as e:
         conn.rollback()
         print(f"\nERREUR IMPORTATION: {str(e)}")
         raise
-    
 
-def insert_batch(cur, data_batch):
-    """Insère un lot de données de manière optimisée"""
-    args = ','.join(cur.mogrify("(%s,%s,%s,%s)", row).decode('utf-8') for row in data_batch)
-    cur.execute(f"""
-        INSERT INTO statistique (com_id, type_id, annee, valeur)
-        VALUES (
-            (SELECT com_id FROM commune WHERE code_insee = tmp.code_insee),
-            tmp.type_id, tmp.annee, tmp.valeur
+
+# Connexion, index des communes et format des COPY propres à chaque processus de chargement
+_conn_worker = None
+_index_worker = None
+_format_worker = 'texte'
+
+
+def _initialiser_worker(db_config, index=None, format_copy='texte'):
+    """Ouvre la connexion du processus (une seule par worker) et reçoit l'index partagé"""
+    global _conn_worker, _index_worker, _format_worker
+    _conn_worker = psycopg2.connect(**db_config)
+    _index_worker = index
+    _format_worker = format_copy
+    # Les deltas des triggers sont appliqués une seule fois, au COMMIT de chaque partition
+    with _conn_worker.cursor() as cur:
+        cur.execute("SET insee.maintenance_differee = 'on'")
+    _conn_worker.commit()
+
+
+def _charger_partition(fichier_csv, departements, mappings, taille_bloc):
+    """Tâche d'un worker : un fichier restreint à un groupe de départements"""
+    debut = time.perf_counter()
+    for tentative in range(3):
+        try:
+            # Lignes et octets des COPY du worker, remontés au processus principal
+            with compter_flux() as flux:
+                charges, rejetes = importer_statistiques_communes(
+                    _conn_worker, fichier_csv, taille_bloc, mappings=mappings,
+                    departements=departements, transit_temporaire=True, index=_index_worker,
+                    format_copy=_format_worker
+                )
+            break
+        except psycopg2.extensions.TransactionRollbackError:
+            # Interblocage possible entre deux millésimes sur les mêmes clés : on rejoue
+            if tentative == 2:
+                raise
+    return {
+        'pid': os.getpid(),
+        'fichier': fichier_csv,
+        'departements': departements,
+        'charges': charges,
+        'rejetes': rejetes,
+        'octets': flux.octets,
+        'duree': time.perf_counter() - debut,
+    }
+
+
+def charger_en_parallele(conn, fichiers, nb_workers=None, nb_partitions=None,
+                         taille_bloc=TAILLE_BLOC, db_config=None, index=None, format_copy='texte'):
+    """Charge plusieurs fichiers / millésimes INSEE en parallèle sur un pool de processus
+
+    Renvoie (lignes chargées, octets envoyés par COPY), cumulés sur tous les workers.
+    """
+    nb_workers = nb_workers or os.cpu_count()
+    nb_partitions = nb_partitions or nb_workers
+
+    # 1. Mapping propre à chaque fichier et enregistrement des types manquants
+    mappings_par_fichier = {}
+    for fichier in fichiers:
+        entete = pd.read_csv(fichier, sep=';', nrows=0).columns
+        mappings_par_fichier[fichier] = deriver_mappings(entete)
+        enregistrer_types(conn, mappings_par_fichier[fichier])
+        print(f"{fichier}: {len(mappings_par_fichier[fichier])} indicateurs")
+
+    # 2. Partition du travail par fichier et par groupe de départements
+    with conn.cursor() as cur:
+        cur.execute("SELECT dep_id FROM departement ORDER BY dep_id")
+        deps = [dep_id for (dep_id,) in cur.fetchall()]
+        cur.execute("SELECT COUNT(*) FROM statistique")
+        nb_avant = cur.fetchone()[0]
+        # Index des communes construit une fois et transmis à chaque processus
+        if index is None:
+            index = IndexCommunes.depuis_base(cur)
+    conn.commit()
+
+    groupes = [deps[i::nb_partitions] for i in range(nb_partitions)]
+    taches = [(fichier, groupe) for fichier in fichiers for groupe in groupes if groupe]
+
+    # 3. Répartition sur le pool, une connexion par processus
+    resultats = []
+    debut = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=nb_workers, initializer=_initialiser_worker,
+                             initargs=(db_config or CONFIG_CHARGEMENT, index, format_copy)) as pool:
+        futures = [
+            pool.submit(_charger_partition, fichier, groupe, mappings_par_fichier[fichier], taille_bloc)
+            for fichier, groupe in taches
+        ]
+        for futur in as_completed(futures):
+            r = futur.result()
+            resultats.append(r)
+            print(f"[worker {r['pid']}] {r['fichier']} ({len(r['departements'])} départements): "
+                  f"{r['charges']} lignes en {r['duree']:.1f}s "
+                  f"({len(resultats)}/{len(taches)} tâches)")
+    duree = max(time.perf_counter() - debut, 1e-9)
+
+    # Progression par worker
+    par_worker = defaultdict(lambda: [0, 0.0])
+    for r in resultats:
+        par_worker[r['pid']][0] += r['charges']
+        par_worker[r['pid']][1] += r['duree']
+    for pid, (lignes, temps) in sorted(par_worker.items()):
+        print(f"- worker {pid}: {lignes} lignes, {lignes / max(temps, 1e-9):.0f} lignes/s")
+
+    total = sum(r['charges'] for r in resultats)
+    print(f"Chargement parallèle: {total} lignes en {duree:.1f}s "
+          f"({total / duree:.0f} lignes/s, {nb_workers} processus)")
+
+    # 4. Vérification finale puis recalcul des agrégats des départements chargés
+    verifier_coherence(conn, nb_avant, resultats)
+    rafraichir_populations(conn, {dep for r in resultats if r['charges'] for dep in r['departements']})
+    return total, sum(r['octets'] for r in resultats)
+
+
+def verifier_coherence(conn, nb_avant, resultats):
+    """Contrôle final : lignes annoncées par les workers = lignes ajoutées, sans doublon"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM statistique")
+        nb_apres = cur.fetchone()[0]
+
+        # GROUP BY regroupe les NULL : détecte aussi les doublons sans année
+        cur.execute("""
+            SELECT COUNT(*) FROM (
+                SELECT 1
+                FROM statistique
+                GROUP BY com_id, type_id, annee
+                HAVING COUNT(*) > 1
+            ) doublons
+        """)
+        nb_doublons = cur.fetchone()[0]
+    conn.commit()
+
+    attendu = sum(r['charges'] for r in resultats)
+    coherent = nb_apres - nb_avant == attendu and nb_doublons == 0
+    print(f"\nCOHÉRENCE: {nb_apres - nb_avant} lignes ajoutées pour {attendu} annoncées, "
+          f"{nb_doublons} clés en double -> {'OK' if coherent else 'ÉCHEC'}")
+    return coherent
+
+
+def empreinte_fichier(chemin):
+    """Empreinte SHA-256 d'un fichier source, lue par blocs"""
+    h = hashlib.sha256()
+    with open(chemin, 'rb') as f:
+        for morceau in iter(lambda: f.read(1 << 20), b''):
+            h.update(morceau)
+    return h.hexdigest()
+
+
+def synchroniser_table(conn, table, fichier_csv, charger_transit, cles, colonnes,
+                       nullables=(), perimetre=None, avant_suppression=(), suivre=None, forcer=False):
+    """Applique à une table le delta entre son contenu et la source, en une transaction
+
+    charger_transit(cur) remplit la table temporaire transit_<table> ; chaque ligne est
+    comparée à la ligne stockée de même clé via une empreinte md5, et seules les
+    insertions, mises à jour et suppressions nécessaires sont appliquées.
+    perimetre restreint les suppressions (condition SQL sur t) ; avant_suppression
+    liste les requêtes qui retirent d'abord les lignes dépendantes. Si suivre nomme une
+    colonne, ses valeurs pour les lignes modifiées sont renvoyées dans delta['cles'].
+    """
+    transit = f"transit_{table}"
+    source = f"{table}:{os.path.basename(fichier_csv)}"
+    empreinte = empreinte_fichier(fichier_csv)
+    delta = {'insertions': 0, 'mises_a_jour': 0, 'suppressions': 0, 'cles': []}
+
+    def egalite(col):
+        if col in nullables:
+            return f"COALESCE(t.{col}, -1) = COALESCE(s.{col}, -1)"
+        return f"t.{col} = s.{col}"
+
+    condition = ' AND '.join(egalite(col) for col in cles)
+    empreinte_t = f"md5(ROW({', '.join('t.' + col for col in colonnes)})::text)"
+    empreinte_s = f"md5(ROW({', '.join('s.' + col for col in colonnes)})::text)"
+
+    def appliquer(cur, requete, retour):
+        """Exécute un DELETE/UPDATE/INSERT en mémorisant au besoin les clés touchées"""
+        if suivre is None:
+            cur.execute(requete)
+        else:
+            cur.execute(f"""
+                WITH modifiees AS ({requete} RETURNING {retour})
+                INSERT INTO cles_modifiees SELECT {suivre}::text FROM modifiees
+            """)
+        return cur.rowcount
+
+    try:
+        with conn.cursor() as cur:
+            # 1. Fichier inchangé depuis la dernière synchronisation : rien à faire
+            cur.execute("SELECT empreinte FROM empreinte_source WHERE source = %s", (source,))
+            precedente = cur.fetchone()
+            if precedente and precedente[0] == empreinte and not forcer:
+                conn.commit()
+                print(f"{table}: {fichier_csv} inchangé - ignoré")
+                return delta
+
+            # 2. Chargement de la source dans la table de transit
+            autoriser_referentiel(cur)
+            charger_transit(cur)
+            if suivre is not None:
+                cur.execute("CREATE TEMP TABLE cles_modifiees (cle TEXT) ON COMMIT DROP;")
+
+            # 3. Suppressions (lignes absentes de la source)
+            for requete in avant_suppression:
+                cur.execute(requete)
+            delta['suppressions'] = appliquer(cur, f"""
+                DELETE FROM {table} t
+                WHERE NOT EXISTS (SELECT 1 FROM {transit} s WHERE {condition})
+                {'AND ' + perimetre if perimetre else ''}
+            """, f"t.{suivre}")
+
+            # 4. Mises à jour (empreinte différente)
+            delta['mises_a_jour'] = appliquer(cur, f"""
+                UPDATE {table} t
+                SET {', '.join(f'{col} = s.{col}' for col in colonnes)}
+                FROM {transit} s
+                WHERE {condition}
+                AND {empreinte_t} <> {empreinte_s}
+            """, f"t.{suivre}")
+
+            # 5. Insertions (clés nouvelles)
+            delta['insertions'] = appliquer(cur, f"""
+                INSERT INTO {table} ({', '.join(cles + colonnes)})
+                SELECT {', '.join('s.' + col for col in cles + colonnes)}
+                FROM {transit} s
+                WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE {condition})
+            """, suivre)
+
+            if suivre is not None:
+                cur.execute("SELECT DISTINCT cle FROM cles_modifiees")
+                delta['cles'] = [cle for (cle,) in cur.fetchall()]
+
+            cur.execute("""
+                INSERT INTO empreinte_source (source, empreinte) VALUES (%s, %s)
+                ON CONFLICT (source) DO UPDATE SET
+                    empreinte = EXCLUDED.empreinte,
+                    date_maj = CURRENT_TIMESTAMP
+            """, (source, empreinte))
+            if delta['insertions'] or delta['mises_a_jour'] or delta['suppressions']:
+                incrementer_version(cur, source)
+        conn.commit()
+        print(f"{table}: +{delta['insertions']} ~{delta['mises_a_jour']} -{delta['suppressions']}")
+        return delta
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Erreur synchronisation {table}: {str(e)}")
+        raise
+
+
+def synchroniser(conn, fichiers_stats, forcer=False, format_copy='texte'):
+    """Synchronisation incrémentale de toutes les tables à partir des fichiers sources"""
+
+    def transit_copy(table, fichier_csv, ddl, commande, preparer, **options):
+        def charger(cur):
+            cur.execute(f"CREATE TEMP TABLE transit_{table} ({ddl}) ON COMMIT DROP;")
+            copier_csv_en_flux(cur, fichier_csv, commande, preparer, format_copy=format_copy, **options)
+        return charger
+
+    # Régions / départements : on ne supprime que ce qui n'est plus référencé
+    synchroniser_table(
+        conn, 'region', 'v_region_2024.csv',
+        transit_copy('region', 'v_region_2024.csv', "reg_id VARCHAR(2), name VARCHAR(100)",
+                     "COPY transit_region (reg_id, name) FROM STDIN",
+                     lambda bloc: bloc[['REG', 'LIBELLE']], dtype=str),
+        ['reg_id'], ['name'],
+        perimetre="NOT EXISTS (SELECT 1 FROM departement d WHERE d.reg_id = t.reg_id)",
+        forcer=forcer
+    )
+    synchroniser_table(
+        conn, 'departement', 'v_departement_2024.csv',
+        transit_copy('departement', 'v_departement_2024.csv',
+                     "dep_id VARCHAR(3), name VARCHAR(100), reg_id VARCHAR(2)",
+                     "COPY transit_departement (dep_id, name, reg_id) FROM STDIN",
+                     lambda bloc: bloc[['DEP', 'LIBELLE', 'REG']], dtype=str),
+        ['dep_id'], ['name', 'reg_id'],
+        perimetre="NOT EXISTS (SELECT 1 FROM commune c WHERE c.dep_id = t.dep_id)",
+        forcer=forcer
+    )
+
+    # Arrondissements, cantons, collectivités : ajoutés / mis à jour avant les communes
+    import_niveaux(conn)
+
+    # Communes : une commune disparue emporte ses statistiques, chefs-lieux et rattachements
+    disparues = """
+        SELECT t.com_id FROM commune t
+        WHERE NOT EXISTS (SELECT 1 FROM transit_commune s WHERE s.code_insee = t.code_insee)
+    """
+    delta_communes = synchroniser_table(
+        conn, 'commune', 'v_commune_2024.csv',
+        transit_copy('commune', 'v_commune_2024.csv',
+                     "code_insee VARCHAR(5), name VARCHAR(100), dep_id VARCHAR(3), "
+                     "arr_id VARCHAR(4), can_id VARCHAR(5), ctcd_id VARCHAR(4)",
+                     "COPY transit_commune (code_insee, name, dep_id, arr_id, can_id, ctcd_id) FROM STDIN",
+                     lambda bloc: bloc.loc[bloc['TYPECOM'] == 'COM',
+                                           ['COM', 'LIBELLE', 'DEP', 'ARR', 'CAN', 'CTCD']],
+                     dtype=str),
+        ['code_insee'], ['name', 'dep_id', 'arr_id', 'can_id', 'ctcd_id'],
+        avant_suppression=[
+            f"DELETE FROM statistique WHERE com_id IN ({disparues})",
+            f"DELETE FROM population_commune WHERE com_id IN ({disparues})",
+            f"DELETE FROM chef_lieu_region WHERE com_id IN ({disparues})",
+            f"DELETE FROM chef_lieu_departement WHERE com_id IN ({disparues})",
+            f"DELETE FROM commune_rattachee WHERE com_parent_id IN ({disparues})",
+            f"DELETE FROM hierarchie_territoire WHERE com_id IN ({disparues})",
+        ],
+        forcer=forcer
+    )
+
+    # Index des communes après leur synchronisation, partagé par les tables suivantes
+    with conn.cursor() as cur:
+        index = IndexCommunes.depuis_base(cur)
+    conn.commit()
+
+    # Communes rattachées : petite table rechargée entièrement
+    import_communes_rattachees(conn, index, format_copy=format_copy)
+
+    # Chefs-lieux : résolution code_insee -> com_id par l'index avant la table de transit
+    for table, cle, fichier, colonne in [
+        ('chef_lieu_region', 'reg_id', 'v_region_2024.csv', 'REG'),
+        ('chef_lieu_departement', 'dep_id', 'v_departement_2024.csv', 'DEP'),
+    ]:
+        synchroniser_table(
+            conn, table, fichier,
+            transit_copy(table, fichier, f"{cle} VARCHAR(3), com_id INTEGER",
+                         f"COPY transit_{table} ({cle}, com_id) FROM STDIN",
+                         lambda bloc, fichier=fichier, colonne=colonne:
+                             index.resoudre(bloc, 'CHEFLIEU', source=fichier)[[colonne, 'com_id']],
+                         dtype=str),
+            [cle], ['com_id'], forcer=forcer
         )
-        FROM (VALUES {args}) AS tmp(code_insee, type_id, annee, valeur)
-        ON CONFLICT (com_id, type_id, annee) DO NOTHING
-    """)
-    
+
+    # Statistiques : suppressions limitées aux types présents dans le fichier
+    importer_types_statistiques(conn)
+    communes_modifiees = set()
+    for fichier in fichiers_stats:
+        def charger(cur, fichier=fichier):
+            charger_transit_statistiques(cur, fichier, transit_temporaire=True, index=index,
+                                         format_copy=format_copy)
+            cur.execute("""
+                CREATE TEMP TABLE transit_statistique ON COMMIT DROP AS
+                SELECT com_id, type_id, annee, valeur
+                FROM statistique_import;
+            """)
+            cur.execute("CREATE INDEX ON transit_statistique (com_id, type_id, COALESCE(annee, -1));")
+            cur.execute("ANALYZE transit_statistique;")
+        delta = synchroniser_table(
+            conn, 'statistique', fichier, charger,
+            ['com_id', 'type_id', 'annee'], ['valeur'],
+            nullables=('annee',),
+            perimetre="t.type_id IN (SELECT DISTINCT type_id FROM transit_statistique)",
+            suivre='com_id',
+            forcer=forcer
+        )
+        communes_modifiees.update(int(com_id) for com_id in delta['cles'])
+    index.rapport_non_resolus()
+
+    # Agrégats : une commune ajoutée, déplacée ou supprimée impose un recalcul complet,
+    # sinon seuls les départements des communes modifiées sont recalculés
+    if any(delta_communes[cle] for cle in ('insertions', 'mises_a_jour', 'suppressions')):
+        rafraichir_populations(conn)
+    elif communes_modifiees:
+        with conn.cursor() as cur:
+            cur.execute("SELECT DISTINCT dep_id FROM commune WHERE com_id = ANY(%s)",
+                        (sorted(communes_modifiees),))
+            departements = [dep_id for (dep_id,) in cur.fetchall()]
+        conn.commit()
+        rafraichir_populations(conn, departements)
+
+
 def verify_import(conn):
     """Vérifie que les données ont bien été importées"""
     with conn.cursor() as cur:
@@ -397,26 +1102,111 @@ def verify_import(conn):
             print(f"{reg_id} {reg_name}: {com_name}")
             
 
-def main():
+def main(fichiers=None, nb_workers=1, incremental=False, instrumentation=None, massif=False,
+         format_copy='texte'):
+    fichiers = fichiers or ["base-cc-serie-historique-2021.csv"]
+    instr = instrumentation or Instrumentation()
     conn = None
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        create_tables(conn)
+        conn = psycopg2.connect(**CONFIG_CHARGEMENT)
+        # Disposition large active : statistique est une vue, aucun chargeur ne peut y écrire
+        verifier_disposition_eav(conn)
+        with instr.etape('create_tables'):
+            create_tables(conn)
+        # Chargement initial : tables UNLOGGED sans index secondaires ni clés étrangères
+        if massif:
+            with instr.etape('massif_preparation'):
+                preparer_chargement_massif(conn)
+
+        if incremental:
+            with instr.etape('synchroniser'), maintenance_differee(conn):
+                synchroniser(conn, fichiers, format_copy=format_copy)
+            with instr.etape('series_population'):
+                rafraichir_series(conn)
+            with instr.etape('hierarchie_territoire') as mesure:
+                mesure.lignes = rafraichir_hierarchie(conn)
+            with instr.etape('classements') as mesure:
+                mesure.lignes = rafraichir_classements(conn)
+            with instr.etape('verify_import'):
+                verify_import(conn)
+            print("Synchronisation terminée avec succès")
+            return
         
         # Ordre important pour les contraintes de clé étrangère
-        import_regions(conn)
-        import_departements(conn)
-        import_communes(conn)
-        import_chefs_lieux(conn)
-        importer_types_statistiques(conn)
-        importer_statistiques_communes(conn, "base-cc-serie-historique-2021.csv")
-        verify_import(conn)
+        with instr.etape('import_regions') as mesure:
+            mesure.lignes = import_regions(conn, format_copy=format_copy)
+        with instr.etape('import_departements') as mesure:
+            mesure.lignes = import_departements(conn, format_copy=format_copy)
+        with instr.etape('import_niveaux') as mesure:
+            mesure.lignes = import_niveaux(conn)
+        with instr.etape('import_communes') as mesure:
+            mesure.lignes = import_communes(conn, format_copy=format_copy)
+        # Index code INSEE -> com_id partagé par tous les chargeurs suivants
+        with instr.etape('index_communes') as mesure, conn.cursor() as cur:
+            index = IndexCommunes.depuis_base(cur)
+            mesure.lignes = len(index)
+        conn.commit()
+        with instr.etape('import_communes_rattachees') as mesure:
+            mesure.lignes = import_communes_rattachees(conn, index, format_copy=format_copy)
+        with instr.etape('import_chefs_lieux'):
+            import_chefs_lieux(conn, index, format_copy=format_copy)
+        with instr.etape('importer_types_statistiques'):
+            importer_types_statistiques(conn)
+        with instr.etape('importer_statistiques_communes') as mesure, maintenance_differee(conn):
+            if nb_workers > 1 or len(fichiers) > 1:
+                mesure.lignes, mesure.octets = charger_en_parallele(conn, fichiers, nb_workers, index=index,
+                                                                    format_copy=format_copy)
+            else:
+                mesure.lignes, _ = importer_statistiques_communes(conn, fichiers[0], index=index,
+                                                                  format_copy=format_copy)
+                rafraichir_populations(conn)
+        # Index, contraintes et statistiques du planificateur avant les tables dérivées
+        if massif:
+            finaliser_chargement_massif(conn, CONFIG_CHARGEMENT, max(nb_workers, 4), etape=instr.etape)
+        else:
+            with instr.etape('analyze'):
+                analyser_tables(conn)
+        # Après la maintenance différée : les agrégats départementaux / régionaux sont à jour
+        with instr.etape('series_population'):
+            rafraichir_series(conn)
+        with instr.etape('hierarchie_territoire') as mesure:
+            mesure.lignes = rafraichir_hierarchie(conn)
+        with instr.etape('classements') as mesure:
+            mesure.lignes = rafraichir_classements(conn)
+        with instr.etape('verify_import'):
+            verify_import(conn)
         print("Importation terminée avec succès")
     except Exception as e:
         print(f"Erreur: {e}")
     finally:
         if conn:
             conn.close()
+        instr.fermer()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Création de la base INSEE et import des données")
+    parser.add_argument('fichiers', nargs='*',
+                        help="Fichiers INSEE de statistiques (un ou plusieurs millésimes)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Nombre de processus de chargement des statistiques")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Synchronise uniquement les différences avec la base existante")
+    parser.add_argument('--massif', action='store_true',
+                        help="Chargement initial en tables UNLOGGED, index et contraintes construits à la fin")
+    parser.add_argument('--format-copy', choices=['binaire', 'texte'], default='texte',
+                        help="Format des COPY (binaire : plus lent tant que les NUMERIC sont encodés en Python)")
+    parser.add_argument('--metriques-jsonl',
+                        help="Ajoute les métriques de chaque étape à ce fichier (JSON lines)")
+    parser.add_argument('--metriques-prometheus',
+                        help="Écrit les métriques au format texte Prometheus dans ce fichier")
+    parser.add_argument('--budgets', help="Fichier JSON {étape: secondes} des budgets de durée")
+    args = parser.parse_args()
+    if args.massif and args.incremental:
+        parser.error("--massif est réservé au chargement initial (incompatible avec --incremental)")
+    instrumentation = Instrumentation(
+        DB_CONFIG,
+        budgets=charger_budgets(args.budgets) if args.budgets else None,
+        sortie_jsonl=args.metriques_jsonl,
+        sortie_prometheus=args.metriques_prometheus,
+    )
+    main(args.fichiers, args.workers, args.incremental, instrumentation, args.massif, args.format_copy)
\ No newline at end of file
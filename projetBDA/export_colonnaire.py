@@ -0,0 +1,296 @@
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from psycopg2 import sql
+
+from config import avec_connexion
+from version_donnees import lire_version
+
+# pyarrow n'est nécessaire que pour l'export
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Famille d'un indicateur : suffixe après '_' (P21_POP -> POP), sinon préfixe alphabétique
+# (NAIS1420 -> NAIS, SUPERF -> SUPERF)
+FAMILLE_SQL = "COALESCE(substring(ts.nom from '_([A-Z]+)$'), substring(ts.nom from '^([A-Z]+)'))"
+
+# Nom de partition Hive pour une année NULL (relu comme null par pyarrow.dataset)
+ANNEE_NULLE = '__HIVE_DEFAULT_PARTITION__'
+
+# Partitions demandées (tableaux familles / années, -1 pour une année NULL), triées par
+# partition : une seule lecture de statistique écrit toutes les partitions l'une après l'autre
+REQUETE_STATISTIQUES = f"""
+    SELECT
+        {FAMILLE_SQL} AS famille,
+        c.code_insee,
+        c.dep_id,
+        d.reg_id,
+        ts.nom AS indicateur,
+        s.annee,
+        s.valeur
+    FROM statistique s
+    JOIN type_statistique ts ON s.type_id = ts.id
+    JOIN commune c ON s.com_id = c.com_id
+    JOIN departement d ON c.dep_id = d.dep_id
+    WHERE ({FAMILLE_SQL}, COALESCE(s.annee, -1)) IN (SELECT * FROM unnest({{}}::text[], {{}}::int[]))
+    ORDER BY 1, s.annee, c.code_insee, ts.nom
+"""
+
+AGREGATS = {
+    'population_departement': "SELECT dep_id, annee, population, nb_communes FROM population_departement ORDER BY dep_id, annee",
+    'population_region': "SELECT reg_id, annee, population, nb_departements FROM population_region ORDER BY reg_id, annee",
+}
+
+# Types fixés : les codes restent des chaînes (zéros initiaux), valeurs en float64
+TYPES_COLONNES = {
+    'famille': 'string', 'code_insee': 'string', 'dep_id': 'string', 'reg_id': 'string', 'indicateur': 'string',
+    'annee': 'int32', 'valeur': 'float64', 'population': 'int64',
+    'nb_communes': 'int32', 'nb_departements': 'int32',
+}
+
+
+def _verifier_pyarrow():
+    if pa is None:
+        raise RuntimeError("L'export Parquet nécessite pyarrow (pip install pyarrow)")
+
+
+@contextmanager
+def flux_copy(conn, requete):
+    """Résultat d'une requête en CSV via COPY TO STDOUT, lisible au fil de l'eau
+
+    COPY écrit dans un tube depuis un thread ; le lecteur consomme de l'autre côté :
+    la mémoire reste bornée par la taille des lots de lecture, quelle que soit la table.
+    """
+    lecture, ecriture = os.pipe()
+    erreurs = []
+
+    def copier():
+        try:
+            with os.fdopen(ecriture, 'wb') as sortie, conn.cursor() as cur:
+                cur.copy_expert(f"COPY ({requete}) TO STDOUT WITH (FORMAT csv, HEADER)", sortie)
+        except Exception as e:
+            erreurs.append(e)
+
+    thread = threading.Thread(target=copier, daemon=True)
+    thread.start()
+    with os.fdopen(lecture, 'rb') as entree:
+        try:
+            yield entree
+        finally:
+            # Lecteur interrompu : on vide le tube pour que COPY puisse se terminer
+            while entree.read(1 << 20):
+                pass
+            thread.join()
+            # L'erreur de COPY prime sur celle du lecteur (tube fermé prématurément)
+            if erreurs:
+                raise erreurs[0]
+
+
+def _options_csv(taille_lot):
+    return (
+        pa_csv.ReadOptions(block_size=taille_lot),
+        pa_csv.ConvertOptions(
+            column_types={nom: pa.type_for_alias(alias) for nom, alias in TYPES_COLONNES.items()},
+            strings_can_be_null=True,
+        ),
+    )
+
+
+def ecrire_parquet(conn, requete, fichier, taille_lot=1 << 22):
+    """Écrit le résultat d'une requête dans un fichier Parquet, lot par lot ; renvoie le nombre de lignes"""
+    options_lecture, options_conversion = _options_csv(taille_lot)
+    os.makedirs(os.path.dirname(fichier), exist_ok=True)
+    temporaire = f"{fichier}.tmp"
+    lignes = 0
+    with flux_copy(conn, requete) as entree:
+        lecteur = pa_csv.open_csv(entree, read_options=options_lecture, convert_options=options_conversion)
+        with pq.ParquetWriter(temporaire, lecteur.schema, compression='zstd') as ecrivain:
+            for lot in lecteur:
+                ecrivain.write_batch(lot)
+                lignes += lot.num_rows
+    # Remplacement atomique : un analyste ne lit jamais un fichier partiel
+    os.replace(temporaire, fichier)
+    return lignes
+
+
+def ecrire_partitions(conn, requete, sortie, taille_lot=1 << 22):
+    """Écrit un flux trié par (famille, annee) en une partition Parquet par couple
+
+    Une seule partition est ouverte à la fois : la mémoire reste bornée par la taille
+    des lots. Renvoie {(famille, annee): lignes}.
+    """
+    options_lecture, options_conversion = _options_csv(taille_lot)
+    lignes = {}
+    courante = ecrivain = fichier = None
+    try:
+        with flux_copy(conn, requete) as entree:
+            lecteur = pa_csv.open_csv(entree, read_options=options_lecture, convert_options=options_conversion)
+            colonnes = [nom for nom in lecteur.schema.names if nom != 'famille']
+            schema = pa.schema([lecteur.schema.field(nom) for nom in colonnes])
+            for lot in lecteur:
+                if lot.num_rows == 0:
+                    continue
+                familles = lot.column('famille').to_numpy(zero_copy_only=False)
+                annees = pc.fill_null(lot.column('annee'), -1).to_numpy(zero_copy_only=False)
+                # Bornes des suites de lignes d'une même partition dans le lot
+                ruptures = np.flatnonzero((familles[1:] != familles[:-1]) | (annees[1:] != annees[:-1])) + 1
+                bornes = [0, *ruptures.tolist(), lot.num_rows]
+                for debut, fin in zip(bornes[:-1], bornes[1:]):
+                    cle = (familles[debut], None if annees[debut] == -1 else int(annees[debut]))
+                    if cle != courante:
+                        if ecrivain is not None:
+                            ecrivain.close()
+                            # Remplacement atomique : un analyste ne lit jamais un fichier partiel
+                            os.replace(f"{fichier}.tmp", fichier)
+                        courante = cle
+                        fichier = os.path.join(_repertoire_partition(sortie, *cle), 'part-0.parquet')
+                        os.makedirs(os.path.dirname(fichier), exist_ok=True)
+                        ecrivain = pq.ParquetWriter(f"{fichier}.tmp", schema, compression='zstd')
+                        lignes[cle] = 0
+                    tranche = lot.slice(debut, fin - debut)
+                    ecrivain.write_batch(pa.RecordBatch.from_arrays([tranche.column(nom) for nom in colonnes],
+                                                                    schema=schema))
+                    lignes[cle] += fin - debut
+        if ecrivain is not None:
+            ecrivain.close()
+            os.replace(f"{fichier}.tmp", fichier)
+            ecrivain = None
+    finally:
+        # Erreur en cours d'écriture : la partition ouverte n'est pas publiée
+        if ecrivain is not None:
+            ecrivain.close()
+    return lignes
+
+
+def _repertoire_partition(sortie, famille, annee):
+    return os.path.join(sortie, 'statistique', f"famille={famille}",
+                        f"annee={ANNEE_NULLE if annee is None else annee}")
+
+
+def charger_manifeste(sortie):
+    chemin = os.path.join(sortie, 'manifeste.json')
+    if not os.path.exists(chemin):
+        return None
+    with open(chemin, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def exporter(conn, sortie, incremental=False):
+    """Exporte statistique (partitionné par famille et année) et les agrégats de population en Parquet
+
+    En mode incrémental, seules les partitions modifiées depuis le dernier export sont
+    réécrites : lignes écrites depuis (xmin plus récent que le seuil mémorisé) ou nombre
+    de lignes différent (suppressions). Rien n'est fait si la version des données n'a pas changé.
+    """
+    _verifier_pyarrow()
+    debut = time.perf_counter()
+    manifeste = charger_manifeste(sortie) if incremental else None
+    version = lire_version(conn)
+    if manifeste is not None and version is not None and manifeste['version_donnees'] == version:
+        print(f"Export à jour (version des données {version})")
+        return manifeste
+
+    try:
+        with conn.cursor() as cur:
+            # Instantané unique : toutes les partitions reflètent le même état de la base
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+            # Seuil du prochain export incrémental : transactions non terminées au moment de l'instantané
+            cur.execute("SELECT (txid_snapshot_xmin(txid_current_snapshot()) % 4294967296)::text")
+            seuil = cur.fetchone()[0]
+
+            # 1. Partitions (famille, année) et indicateur de modification depuis le dernier export :
+            #    lignes de statistique, mais aussi commune (dep_id), departement (reg_id) ou type
+            #    modifiés depuis (xmin plus récent que le seuil mémorisé)
+            cur.execute(f"""
+                SELECT
+                    {FAMILLE_SQL} AS famille,
+                    s.annee,
+                    COUNT(*),
+                    bool_or(age(s.xmin) <= age(%(seuil)s::xid) OR age(c.xmin) <= age(%(seuil)s::xid)
+                            OR age(d.xmin) <= age(%(seuil)s::xid) OR age(ts.xmin) <= age(%(seuil)s::xid))
+                FROM statistique s
+                JOIN type_statistique ts ON s.type_id = ts.id
+                JOIN commune c ON s.com_id = c.com_id
+                JOIN departement d ON c.dep_id = d.dep_id
+                GROUP BY 1, 2
+                ORDER BY 1, 2
+            """, {'seuil': manifeste['seuil_xid'] if manifeste else seuil})
+            partitions = cur.fetchall()
+
+        anciennes = manifeste['partitions'] if manifeste else {}
+        nouvelles = {}
+        a_ecrire = []
+        # 2. Partitions nouvelles ou modifiées, réécrites par une seule requête triée
+        for famille, annee, nb_lignes, modifiee in partitions:
+            cle = f"{famille}/{annee}"
+            fichier = os.path.join(_repertoire_partition(sortie, famille, annee), 'part-0.parquet')
+            precedente = anciennes.get(cle)
+            if precedente and not modifiee and precedente['lignes'] == nb_lignes and os.path.exists(fichier):
+                nouvelles[cle] = precedente
+            else:
+                a_ecrire.append((famille, annee))
+        if a_ecrire:
+            requete = sql.SQL(REQUETE_STATISTIQUES).format(
+                sql.Literal([famille for famille, _ in a_ecrire]),
+                sql.Literal([-1 if annee is None else annee for _, annee in a_ecrire]),
+            ).as_string(conn)
+            for (famille, annee), lignes in ecrire_partitions(conn, requete, sortie).items():
+                cle = f"{famille}/{annee}"
+                fichier = os.path.join(_repertoire_partition(sortie, famille, annee), 'part-0.parquet')
+                nouvelles[cle] = {'famille': famille, 'annee': annee, 'lignes': lignes,
+                                  'fichier': os.path.relpath(fichier, sortie)}
+                print(f"  statistique {cle}: {lignes} lignes")
+        nb_ecrites = len(a_ecrire)
+
+        # 3. Partitions disparues
+        for cle, ancienne in anciennes.items():
+            if cle not in nouvelles:
+                shutil.rmtree(os.path.dirname(os.path.join(sortie, ancienne['fichier'])), ignore_errors=True)
+                print(f"  statistique {cle}: supprimée")
+
+        # 4. Agrégats de population (petits : réécrits à chaque export)
+        for nom, requete in AGREGATS.items():
+            lignes = ecrire_parquet(conn, requete, os.path.join(sortie, f"{nom}.parquet"))
+            print(f"  {nom}: {lignes} lignes")
+        conn.commit()
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Erreur export colonnaire: {str(e)}")
+        raise
+
+    manifeste = {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'version_donnees': version,
+        'seuil_xid': seuil,
+        'partitions': nouvelles,
+    }
+    chemin = os.path.join(sortie, 'manifeste.json')
+    with open(f"{chemin}.tmp", 'w', encoding='utf-8') as f:
+        json.dump(manifeste, f, indent=2, ensure_ascii=False)
+    os.replace(f"{chemin}.tmp", chemin)
+
+    print(f"Export: {nb_ecrites}/{len(partitions)} partitions écrites en "
+          f"{time.perf_counter() - debut:.1f}s -> {sortie}")
+    return manifeste
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export Parquet des statistiques et agrégats INSEE")
+    parser.add_argument('sortie', help="Répertoire de destination")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Ne réécrit que les partitions modifiées depuis le dernier export")
+    args = parser.parse_args()
+
+    avec_connexion(lambda conn: exporter(conn, args.sortie, args.incremental))
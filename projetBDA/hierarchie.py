@@ -0,0 +1,114 @@
+import time
+
+from config import avec_connexion
+
+# Niveaux de la table de fermeture : (niveau, requête (code, com_id))
+NIVEAUX = {
+    'arrondissement': "SELECT arr_id, com_id FROM commune WHERE arr_id IS NOT NULL",
+    'canton': "SELECT can_id, com_id FROM commune WHERE can_id IS NOT NULL",
+    'collectivite': "SELECT ctcd_id, com_id FROM commune WHERE ctcd_id IS NOT NULL",
+    'departement': "SELECT dep_id, com_id FROM commune",
+    'region': "SELECT d.reg_id, c.com_id FROM commune c JOIN departement d ON c.dep_id = d.dep_id",
+    # Communes associées / déléguées / arrondissements municipaux : valeurs de la commune parente
+    'commune_rattachee': "SELECT code_insee, com_parent_id FROM commune_rattachee",
+}
+
+
+def installer_hierarchie(cur):
+    """Table de fermeture (niveau, code) -> communes et agrégats indexés de chaque indicateur par niveau"""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS hierarchie_territoire (
+        niveau VARCHAR(20) NOT NULL,
+        code VARCHAR(5) NOT NULL,
+        com_id INTEGER NOT NULL REFERENCES commune(com_id),
+        PRIMARY KEY (niveau, code, com_id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_hierarchie_com_id ON hierarchie_territoire (com_id);
+
+    CREATE TABLE IF NOT EXISTS agregat_niveau (
+        niveau VARCHAR(20) NOT NULL,
+        code VARCHAR(5) NOT NULL,
+        type_id INTEGER NOT NULL REFERENCES type_statistique(id),
+        annee INTEGER,
+        valeur NUMERIC,
+        nb_communes INTEGER NOT NULL
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_agregat_niveau_cle
+    ON agregat_niveau (niveau, code, type_id, COALESCE(annee, -1));
+    """)
+
+
+def rafraichir_hierarchie(conn):
+    """Reconstruit la fermeture puis les agrégats de tous les niveaux, en une transaction
+
+    Les lecteurs voient l'ancien état jusqu'au COMMIT : DELETE et non TRUNCATE, dont le
+    verrou ACCESS EXCLUSIVE les bloquerait pendant toute la reconstruction.
+    """
+    debut = time.perf_counter()
+    try:
+        with conn.cursor() as cur:
+            installer_hierarchie(cur)
+            # Un seul recalcul à la fois ; les lectures ne sont pas bloquées
+            cur.execute("LOCK TABLE hierarchie_territoire, agregat_niveau IN SHARE ROW EXCLUSIVE MODE")
+            cur.execute("DELETE FROM agregat_niveau")
+            cur.execute("DELETE FROM hierarchie_territoire")
+
+            # 1. Fermeture : chaque commune rattachée à chacun de ses ancêtres
+            for niveau, requete in NIVEAUX.items():
+                cur.execute(f"""
+                    INSERT INTO hierarchie_territoire (niveau, code, com_id)
+                    SELECT DISTINCT %s, h.code, h.com_id
+                    FROM ({requete}) AS h(code, com_id)
+                """, (niveau,))
+            cur.execute("ANALYZE hierarchie_territoire")
+
+            # 2. Agrégats : somme de chaque indicateur par (niveau, code, année)
+            cur.execute("""
+                INSERT INTO agregat_niveau (niveau, code, type_id, annee, valeur, nb_communes)
+                SELECT h.niveau, h.code, s.type_id, s.annee, SUM(s.valeur), COUNT(*)
+                FROM hierarchie_territoire h
+                JOIN statistique s ON s.com_id = h.com_id
+                WHERE s.valeur IS NOT NULL
+                GROUP BY h.niveau, h.code, s.type_id, s.annee
+            """)
+            nb_agregats = cur.rowcount
+            cur.execute("ANALYZE agregat_niveau")
+        conn.commit()
+        print(f"Hiérarchie territoriale: {nb_agregats} agrégats en {time.perf_counter() - debut:.2f}s")
+        return nb_agregats
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Erreur recalcul de la hiérarchie territoriale: {str(e)}")
+        raise
+
+
+def agregat(conn, niveau, code, indicateur, annee=None):
+    """Valeur d'un indicateur pour une entité de n'importe quel niveau (lecture par index)"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT a.valeur
+            FROM agregat_niveau a
+            JOIN type_statistique ts ON a.type_id = ts.id
+            WHERE a.niveau = %s AND a.code = %s AND ts.nom = %s
+            AND COALESCE(a.annee, -1) = COALESCE(%s, -1)
+        """, (niveau, code, indicateur, annee))
+        ligne = cur.fetchone()
+    return ligne[0] if ligne else None
+
+
+def communes_du_niveau(conn, niveau, code):
+    """Communes d'une entité (code INSEE, nom), par la table de fermeture"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT c.code_insee, c.name
+            FROM hierarchie_territoire h
+            JOIN commune c ON c.com_id = h.com_id
+            WHERE h.niveau = %s AND h.code = %s
+            ORDER BY c.code_insee
+        """, (niveau, code))
+        return cur.fetchall()
+
+
+if __name__ == "__main__":
+    avec_connexion(rafraichir_hierarchie)
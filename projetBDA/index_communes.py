@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+
+class IndexCommunes:
+    """Résolution code INSEE -> (com_id, dep_id, reg_id) côté client, chargée une fois par import
+
+    Les codes sont placés dans un pd.Index (table de hachage) : une colonne entière de
+    DataFrame est résolue en un appel, sans aller-retour vers le serveur. Les codes
+    introuvables sont comptés par source pour un rapport global en fin de chargement.
+    """
+
+    def __init__(self, codes, com_ids, dep_ids, reg_ids):
+        self.codes = pd.Index(codes)
+        self.com_ids = np.asarray(com_ids, dtype=np.int64)
+        self.dep_ids = np.asarray(dep_ids, dtype=object)
+        self.reg_ids = np.asarray(reg_ids, dtype=object)
+        self.non_resolus = {}  # source -> {code: occurrences}
+
+    @classmethod
+    def depuis_base(cls, cur):
+        """Lit commune/departement en une requête (sans COMMIT : utilisable dans une transaction)"""
+        cur.execute("""
+            SELECT c.code_insee, c.com_id, c.dep_id, d.reg_id
+            FROM commune c
+            JOIN departement d ON c.dep_id = d.dep_id
+            ORDER BY c.code_insee
+        """)
+        lignes = cur.fetchall()
+        index = cls(
+            [l[0] for l in lignes],
+            [l[1] for l in lignes],
+            [l[2] for l in lignes],
+            [l[3] for l in lignes],
+        )
+        print(f"Index des communes: {len(index)} codes INSEE")
+        return index
+
+    def __len__(self):
+        return len(self.codes)
+
+    def positions(self, codes):
+        """Position de chaque code dans l'index (-1 si inconnu)"""
+        return self.codes.get_indexer(pd.Index(codes))
+
+    def resoudre(self, df, colonne, source=''):
+        """Ajoute com_id (et dep_id, reg_id) à df et retire les lignes au code inconnu
+
+        Les codes inconnus sont mémorisés pour rapport_non_resolus() au lieu de produire
+        des com_id NULL.
+        """
+        positions = self.positions(df[colonne])
+        connues = positions >= 0
+        if not connues.all():
+            compte = self.non_resolus.setdefault(source, {})
+            for code, nb in df.loc[~connues, colonne].value_counts().items():
+                compte[code] = compte.get(code, 0) + int(nb)
+        df = df.loc[connues].copy()
+        positions = positions[connues]
+        df['com_id'] = self.com_ids[positions]
+        df['dep_id'] = self.dep_ids[positions]
+        df['reg_id'] = self.reg_ids[positions]
+        return df
+
+    def nb_non_resolus(self, source=None):
+        """Nombre de lignes écartées (toutes sources, ou une seule)"""
+        sources = [source] if source is not None else list(self.non_resolus)
+        return sum(sum(self.non_resolus.get(s, {}).values()) for s in sources)
+
+    def rapport_non_resolus(self, exemples=10):
+        """Rapport groupé des codes INSEE introuvables, par source"""
+        if not self.non_resolus:
+            print("Codes INSEE: tous résolus")
+            return
+        for source, compte in self.non_resolus.items():
+            codes = sorted(compte, key=compte.get, reverse=True)
+            print(f"{source}: {sum(compte.values())} lignes, {len(codes)} codes INSEE inconnus "
+                  f"(ex. {', '.join(codes[:exemples])})")
@@ -0,0 +1,188 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+import psycopg2
+from tabulate import tabulate
+
+from cache_colonnaire import MoteurColonnaire
+from config import DB_CONFIG
+from service_requetes import CATALOGUE, RAPPORTS_EXPLORATION
+from version_donnees import lire_version
+
+# Format : MAGIE | taille du répertoire (uint32) | répertoire JSON | tableaux alignés sur 64 octets
+# Le répertoire donne pour chaque tableau son décalage, son dtype et sa forme.
+MAGIE = b'INSEESNP'
+VERSION_FORMAT = 1
+ALIGNEMENT = 64
+
+
+class TableChaines:
+    """Chaînes stockées bout à bout en UTF-8 + décalages (n + 1) ; décodées à la demande"""
+
+    def __init__(self, octets, decalages):
+        self._octets = octets
+        self._decalages = decalages
+
+    @staticmethod
+    def encoder(chaines):
+        """(octets concaténés, décalages int64) d'une liste de chaînes"""
+        encodees = [c.encode('utf-8') for c in chaines]
+        decalages = np.zeros(len(encodees) + 1, dtype='<i8')
+        decalages[1:] = np.cumsum([len(e) for e in encodees], dtype=np.int64)
+        return np.frombuffer(b''.join(encodees), dtype=np.uint8), decalages
+
+    def __len__(self):
+        return len(self._decalages) - 1
+
+    def __getitem__(self, i):
+        return bytes(self._octets[self._decalages[i]:self._decalages[i + 1]]).decode('utf-8')
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+def _tableaux_du_moteur(moteur):
+    """Tableaux à largeur fixe du moteur, dans l'ordre d'écriture"""
+    tableaux = {
+        'codes_communes': np.asarray(moteur.codes_communes, dtype='S5'),
+        'dep_commune': np.asarray(moteur.dep_commune, dtype='<i4'),
+        'codes_departements': np.asarray(moteur.codes_departements, dtype='S3'),
+        'reg_departement': np.asarray(moteur.reg_departement, dtype='<i4'),
+        'codes_regions': np.asarray(moteur.codes_regions, dtype='S2'),
+        'valeurs': np.ascontiguousarray(moteur.valeurs, dtype='<f8'),
+    }
+    for nom, chaines in (('noms_communes', moteur.noms_communes),
+                         ('noms_departements', moteur.noms_departements),
+                         ('noms_regions', moteur.noms_regions),
+                         ('types', moteur.types)):
+        tableaux[f'{nom}.octets'], tableaux[f'{nom}.decalages'] = TableChaines.encoder(list(chaines))
+    return tableaux
+
+
+def ecrire_instantane(moteur, fichier, meta=None):
+    """Écrit un MoteurColonnaire dans un fichier instantané (remplacement atomique)"""
+    tableaux = _tableaux_du_moteur(moteur)
+
+    # Décalages relatifs à la zone de données, chaque tableau aligné
+    repertoire = {'version': VERSION_FORMAT, 'meta': meta or {}, 'tableaux': {}}
+    position = 0
+    for nom, tableau in tableaux.items():
+        position = -(-position // ALIGNEMENT) * ALIGNEMENT
+        repertoire['tableaux'][nom] = {'decalage': position, 'dtype': tableau.dtype.str,
+                                       'forme': list(tableau.shape)}
+        position += tableau.nbytes
+
+    entete = json.dumps(repertoire).encode('utf-8')
+    debut_donnees = -(-(len(MAGIE) + 4 + len(entete)) // ALIGNEMENT) * ALIGNEMENT
+
+    temporaire = f"{fichier}.tmp"
+    with open(temporaire, 'wb') as f:
+        f.write(MAGIE)
+        f.write(struct.pack('<I', len(entete)))
+        f.write(entete)
+        for nom, tableau in tableaux.items():
+            f.seek(debut_donnees + repertoire['tableaux'][nom]['decalage'])
+            f.write(tableau.tobytes())
+    os.replace(temporaire, fichier)
+    return os.path.getsize(fichier)
+
+
+def construire_instantane(conn, fichier):
+    """Instantané de la hiérarchie et de tous les indicateurs depuis PostgreSQL"""
+    debut = time.perf_counter()
+    version = lire_version(conn)
+    moteur = MoteurColonnaire.depuis_base(conn)
+    taille = ecrire_instantane(moteur, fichier, meta={
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'version_donnees': version,
+    })
+    print(f"Instantané {fichier}: {moteur.valeurs.shape[0]} communes x {moteur.valeurs.shape[1]} "
+          f"indicateurs, {taille / 1e6:.1f} Mo en {time.perf_counter() - debut:.2f}s")
+    return taille
+
+
+def ouvrir_instantane(fichier):
+    """MoteurColonnaire adossé au fichier projeté en mémoire (sans copie, pages partagées entre processus)
+
+    Seuls les petits tableaux de codes département / région sont décodés en chaînes.
+    """
+    with open(fichier, 'rb') as f:
+        projection = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if projection[:len(MAGIE)] != MAGIE:
+        raise ValueError(f"{fichier}: pas un instantané INSEE")
+    (taille_entete,) = struct.unpack_from('<I', projection, len(MAGIE))
+    repertoire = json.loads(projection[len(MAGIE) + 4:len(MAGIE) + 4 + taille_entete])
+    if repertoire['version'] != VERSION_FORMAT:
+        raise ValueError(f"{fichier}: format {repertoire['version']} non pris en charge")
+    debut_donnees = -(-(len(MAGIE) + 4 + taille_entete) // ALIGNEMENT) * ALIGNEMENT
+
+    def tableau(nom):
+        description = repertoire['tableaux'][nom]
+        dtype = np.dtype(description['dtype'])
+        nombre = int(np.prod(description['forme'], dtype=np.int64))
+        # np.frombuffer garde une référence à la projection : elle vit aussi longtemps que le moteur
+        return np.frombuffer(projection, dtype=dtype, count=nombre,
+                             offset=debut_donnees + description['decalage']).reshape(description['forme'])
+
+    def chaines(nom):
+        return TableChaines(tableau(f'{nom}.octets'), tableau(f'{nom}.decalages'))
+
+    moteur = MoteurColonnaire(
+        codes_communes=tableau('codes_communes'),
+        noms_communes=chaines('noms_communes'),
+        dep_commune=tableau('dep_commune'),
+        codes_departements=tableau('codes_departements').astype(str),
+        noms_departements=chaines('noms_departements'),
+        reg_departement=tableau('reg_departement'),
+        codes_regions=tableau('codes_regions').astype(str),
+        noms_regions=chaines('noms_regions'),
+        types=chaines('types'),
+        valeurs=tableau('valeurs'),
+    )
+    moteur.meta = repertoire['meta']
+    return moteur
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Instantané binaire des données INSEE (sans PostgreSQL à la lecture)")
+    sous_commandes = parser.add_subparsers(dest='commande', required=True)
+    construire = sous_commandes.add_parser('construire', help="Crée l'instantané depuis la base")
+    construire.add_argument('fichier')
+    explorer = sous_commandes.add_parser('explorer', help="Rapports d'exploration depuis l'instantané")
+    explorer.add_argument('fichier')
+    explorer.add_argument('--croissance', nargs=2, type=int, metavar=('DEBUT', 'FIN'),
+                          help="Taux de croissance par région entre deux années (ex. 15 21)")
+    args = parser.parse_args()
+
+    if args.commande == 'construire':
+        conn = psycopg2.connect(**DB_CONFIG)
+        try:
+            construire_instantane(conn, args.fichier)
+        finally:
+            conn.close()
+        return
+
+    debut = time.perf_counter()
+    moteur = ouvrir_instantane(args.fichier)
+    print(f"Instantané ouvert en {(time.perf_counter() - debut) * 1000:.1f} ms "
+          f"(version des données {moteur.meta.get('version_donnees')}, {moteur.meta.get('date')})")
+    resultats = moteur.explorer()
+    for nom in RAPPORTS_EXPLORATION:
+        titre = CATALOGUE[nom]["titre"]
+        print(f"\n\033[1m=== {titre} ===\033[0m")
+        print(tabulate(resultats[titre], headers=CATALOGUE[nom]["headers"], tablefmt="pretty"))
+    if args.croissance:
+        start_year, end_year = args.croissance
+        print(f"\nTaux de croissance démographique entre {start_year} et {end_year} par région:")
+        print(tabulate(moteur.croissance_par_region(start_year, end_year),
+                       headers=['Région', f'Pop {start_year}', f'Pop {end_year}', 'Taux (%)'],
+                       tablefmt='pretty'))
+
+
+if __name__ == "__main__":
+    main()
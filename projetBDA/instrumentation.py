@@ -0,0 +1,242 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+
+# Budgets par défaut (secondes) ; au-delà, l'étape est signalée comme lente
+BUDGETS_DEFAUT = {
+    'create_tables': 30,
+    'import_regions': 5,
+    'import_departements': 5,
+    'import_niveaux': 10,
+    'import_communes': 30,
+    'import_communes_rattachees': 10,
+    'import_chefs_lieux': 10,
+    'importer_types_statistiques': 5,
+    'importer_statistiques_communes': 300,
+    'synchroniser': 300,
+    'massif_preparation': 10,
+    'massif_journalisation': 120,
+    'massif_contraintes': 120,
+    'massif_index': 120,
+    'massif_analyze': 30,
+    'index_communes': 10,
+    'analyze': 30,
+    'series_population': 60,
+    'hierarchie_territoire': 60,
+    'classements': 60,
+    'verify_import': 30,
+}
+
+# application_name des connexions du chargeur : seules ces sessions sont échantillonnées
+APPLICATION_CHARGEMENT = 'insee_chargement'
+
+# Étape en cours : les flux COPY y ajoutent leurs lignes et octets
+_etape_courante = None
+
+
+def signaler_flux(lignes, octets):
+    """Appelé par le chargeur après chaque COPY en flux (sans effet hors d'une étape mesurée)"""
+    if _etape_courante is not None:
+        _etape_courante.lignes_flux += lignes
+        _etape_courante.octets += octets
+
+
+@contextmanager
+def compter_flux():
+    """Compte les lignes et octets des COPY du bloc dans une Mesure à part
+
+    Pour les processus de chargement parallèle, qui n'ont pas d'étape en cours : le
+    processus principal additionne les comptes renvoyés par chaque tâche.
+    """
+    global _etape_courante
+    precedente = _etape_courante
+    mesure = Mesure('flux')
+    _etape_courante = mesure
+    try:
+        yield mesure
+    finally:
+        _etape_courante = precedente
+
+
+class Mesure:
+    """Mesures d'une étape ; lignes peut être renseigné par l'appelant"""
+
+    def __init__(self, nom):
+        self.nom = nom
+        self.lignes = None
+        self.lignes_flux = 0
+        self.octets = 0
+        self.duree_s = 0.0
+        self.echantillons = 0
+        self.echantillons_actifs = 0
+        self.echantillons_verrou = 0
+        self.intervalle = 0.0
+        self.statut = 'ok'
+
+    def en_dict(self, budget=None):
+        lignes = self.lignes if self.lignes is not None else (self.lignes_flux or None)
+        return {
+            'etape': self.nom,
+            'statut': self.statut,
+            'duree_s': round(self.duree_s, 4),
+            'lignes': lignes,
+            'lignes_par_s': round(lignes / self.duree_s, 1) if lignes and self.duree_s > 0 else None,
+            'octets': self.octets,
+            # Estimations par échantillonnage de pg_stat_activity
+            'temps_serveur_s': round(self.echantillons_actifs * self.intervalle, 3),
+            'attente_verrous_s': round(self.echantillons_verrou * self.intervalle, 3),
+            'budget_s': budget,
+            'hors_budget': budget is not None and self.duree_s > budget,
+        }
+
+
+class Echantillonneur(threading.Thread):
+    """Lit pg_stat_activity à intervalle régulier sur une connexion dédiée
+
+    Seules les sessions du chargeur sont comptées (application_name, y compris les
+    workers du chargement parallèle) : une session active compte comme temps serveur,
+    une session en attente d'un verrou (wait_event_type = 'Lock') comme attente de verrou.
+    """
+
+    def __init__(self, db_config, intervalle=0.1, application=APPLICATION_CHARGEMENT):
+        super().__init__(daemon=True)
+        self.intervalle = intervalle
+        self.application = application
+        self._arret = threading.Event()
+        self._conn = psycopg2.connect(**db_config)
+        self._conn.autocommit = True
+        self.mesure = None
+
+    def run(self):
+        with self._conn.cursor() as cur:
+            while not self._arret.wait(self.intervalle):
+                mesure = self.mesure
+                if mesure is None:
+                    continue
+                cur.execute("""
+                    SELECT
+                        COUNT(*) FILTER (WHERE state = 'active'),
+                        COUNT(*) FILTER (WHERE wait_event_type = 'Lock')
+                    FROM pg_stat_activity
+                    WHERE datname = current_database()
+                    AND backend_type = 'client backend'
+                    AND application_name = %s
+                    AND pid <> pg_backend_pid()
+                """, (self.application,))
+                actifs, verrous = cur.fetchone()
+                mesure.echantillons += 1
+                mesure.echantillons_actifs += actifs
+                mesure.echantillons_verrou += verrous
+
+    def arreter(self):
+        self._arret.set()
+        self.join()
+        self._conn.close()
+
+
+class Instrumentation:
+    """Mesure chaque étape du chargement et publie les métriques (JSON lines / Prometheus)"""
+
+    def __init__(self, db_config=None, budgets=None, sortie_jsonl=None, sortie_prometheus=None,
+                 intervalle_echantillonnage=0.1):
+        self.budgets = dict(BUDGETS_DEFAUT, **(budgets or {}))
+        self.sortie_jsonl = sortie_jsonl
+        self.sortie_prometheus = sortie_prometheus
+        self.resultats = []
+        self._echantillonneur = None
+        if db_config is not None:
+            try:
+                self._echantillonneur = Echantillonneur(db_config, intervalle_echantillonnage)
+                self._echantillonneur.start()
+            except psycopg2.Error as e:
+                print(f"Instrumentation: pas d'échantillonnage serveur ({e})")
+
+    @contextmanager
+    def etape(self, nom):
+        """Mesure le bloc comme une étape ; la Mesure renvoyée accepte mesure.lignes = n"""
+        global _etape_courante
+        # Étape englobante éventuelle, rétablie en sortie
+        precedente = _etape_courante
+        mesure = Mesure(nom)
+        if self._echantillonneur is not None:
+            mesure.intervalle = self._echantillonneur.intervalle
+            self._echantillonneur.mesure = mesure
+        _etape_courante = mesure
+        debut = time.perf_counter()
+        try:
+            yield mesure
+        except Exception:
+            mesure.statut = 'erreur'
+            raise
+        finally:
+            mesure.duree_s = time.perf_counter() - debut
+            _etape_courante = precedente
+            if self._echantillonneur is not None:
+                self._echantillonneur.mesure = precedente
+            self._publier(mesure)
+
+    def _publier(self, mesure):
+        resultat = mesure.en_dict(self.budgets.get(mesure.nom))
+        self.resultats.append(resultat)
+        if self.sortie_jsonl:
+            with open(self.sortie_jsonl, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(dict(resultat, date=time.strftime('%Y-%m-%dT%H:%M:%S')),
+                                   ensure_ascii=False) + '\n')
+
+    def fermer(self):
+        """Arrête l'échantillonnage, écrit le fichier Prometheus et affiche le résumé"""
+        if self._echantillonneur is not None:
+            self._echantillonneur.arreter()
+            self._echantillonneur = None
+        if self.sortie_prometheus:
+            ecrire_prometheus(self.resultats, self.sortie_prometheus)
+        self.afficher_resume()
+
+    def afficher_resume(self):
+        print("\n=== Étapes du chargement ===")
+        for r in self.resultats:
+            debit = f"{r['lignes_par_s']:.0f} lignes/s" if r['lignes_par_s'] else ''
+            ligne = (f"{r['etape']:<32} {r['duree_s']:>9.2f}s  {debit:>18}  "
+                     f"serveur {r['temps_serveur_s']:.1f}s  verrous {r['attente_verrous_s']:.1f}s")
+            if r['hors_budget']:
+                # Étape lente mise en évidence
+                ligne = f"\033[1;31m{ligne}  > budget {r['budget_s']}s\033[0m"
+            elif r['statut'] != 'ok':
+                ligne += f"  [{r['statut']}]"
+            print(ligne)
+
+
+def ecrire_prometheus(resultats, fichier):
+    """Fichier texte au format d'exposition Prometheus (textfile collector)"""
+    metriques = [
+        ('insee_import_duree_secondes', 'duree_s', "Durée de l'étape"),
+        ('insee_import_lignes', 'lignes', "Lignes traitées par l'étape"),
+        ('insee_import_octets', 'octets', "Octets envoyés par COPY"),
+        ('insee_import_temps_serveur_secondes', 'temps_serveur_s', "Temps actif côté serveur (échantillonné)"),
+        ('insee_import_attente_verrous_secondes', 'attente_verrous_s', "Attente de verrous (échantillonnée)"),
+        ('insee_import_hors_budget', 'hors_budget', "1 si l'étape a dépassé son budget"),
+    ]
+    lignes = []
+    for nom, cle, aide in metriques:
+        lignes.append(f"# HELP {nom} {aide}")
+        lignes.append(f"# TYPE {nom} gauge")
+        for r in resultats:
+            valeur = r[cle]
+            if valeur is None:
+                continue
+            lignes.append(f'{nom}{{etape="{r["etape"]}"}} {float(valeur)}')
+    # Écriture atomique : le collecteur ne lit jamais un fichier à moitié écrit
+    temporaire = f"{fichier}.tmp"
+    with open(temporaire, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lignes) + '\n')
+    os.replace(temporaire, fichier)
+
+
+def charger_budgets(fichier):
+    """Budgets {étape: secondes} depuis un fichier JSON"""
+    with open(fichier, encoding='utf-8') as f:
+        return {etape: float(budget) for etape, budget in json.load(f).items()}
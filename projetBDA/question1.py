@@ -1,219 +1,151 @@
-import psycopg2
-from tabulate import tabulate
-import pandas as pd
-from io import StringIO
-
-DB_CONFIG = {
-    'host': 'localhost',
-    'database': 'inseedb',
-    'user': 'postgres',
-    'password': 'admin'
-}
-
-def get_departments_in_region(region_name):
-    """Liste des départements d'une région donnée"""
-    conn = psycopg2.connect(**DB_CONFIG)
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT d.dep_id, d.name, c.name as chef_lieu
-                FROM departement d
-                JOIN region r ON d.reg_id = r.reg_id
-                JOIN chef_lieu_departement cld ON d.dep_id = cld.dep_id
-                JOIN commune c ON cld.com_id = c.com_id
-                WHERE r.name = %s
-                ORDER BY d.name
-            """, (region_name,))
-            
-            results = cur.fetchall()
-            print(f"\nDépartements de la région {region_name}:")
-            print(tabulate(results, headers=['Code', 'Département', 'Chef-lieu'], tablefmt='pretty'))
-            
-    finally:
-        conn.close()
-
-def get_communes_above_population(department_code, min_population):
-    """Communes de plus de X habitants dans un département"""
-    conn = psycopg2.connect(**DB_CONFIG)
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT c.name, s.valeur as population
-                FROM commune c
-                JOIN statistique s ON c.com_id = s.com_id
-                JOIN type_statistique ts ON s.type_id = ts.id
-                WHERE c.dep_id = %s 
-                AND ts.nom = 'P21_POP'
-                AND s.valeur > %s
-                ORDER BY s.valeur DESC
-            """, (department_code, min_population))
-            
-            results = cur.fetchall()
-            print(f"\nCommunes de plus de {min_population} habitants dans le département {department_code}:")
-            print(tabulate(results, headers=['Commune', 'Population'], tablefmt='pretty'))
-            
-    finally:
-        conn.close()
-
-def population_growth_rate(start_year, end_year):
-    """Taux de croissance démographique par région"""
-    conn = psycopg2.connect(**DB_CONFIG)
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                WITH pop_start AS (
-                    SELECT r.reg_id, r.name, SUM(s.valeur) as population
-                    FROM region r
-                    JOIN departement d ON r.reg_id = d.reg_id
-                    JOIN commune c ON d.dep_id = c.dep_id
-                    JOIN statistique s ON c.com_id = s.com_id
-                    JOIN type_statistique ts ON s.type_id = ts.id
-                    WHERE ts.nom = %s
-                    GROUP BY r.reg_id, r.name
-                ),
-                pop_end AS (
-                    SELECT r.reg_id, SUM(s.valeur) as population
-                    FROM region r
-                    JOIN departement d ON r.reg_id = d.reg_id
-                    JOIN commune c ON d.dep_id = c.dep_id
-                    JOIN statistique s ON c.com_id = s.com_id
-                    JOIN type_statistique ts ON s.type_id = ts.id
-                    WHERE ts.nom = %s
-                    GROUP BY r.reg_id
-                )
-                SELECT 
-                    ps.name as region,
-                    ps.population as pop_start,
-                    pe.population as pop_end,
-                    ROUND((pe.population - ps.population) * 100.0 / ps.population, 2) as growth_rate
-                FROM pop_start ps
-                JOIN pop_end pe ON ps.reg_id = pe.reg_id
-                ORDER BY growth_rate DESC
-            """, (f'P{start_year}_POP', f'P{end_year}_POP'))
-            
-            results = cur.fetchall()
-            print(f"\nTaux de croissance démographique entre {start_year} et {end_year} par région:")
-            print(tabulate(results, headers=['Région', f'Pop {start_year}', f'Pop {end_year}', 'Taux (%)'], tablefmt='pretty'))
-            
-    finally:
-        conn.close()
-        
-def explorer_donnees(conn):
-    """Requêtes analytiques de base avec affichage amélioré"""
-    from tabulate import tabulate
-
-    requetes = {
-        # 1. Top 5 des communes les plus peuplées (en 2021)
-        "Top 5 des communes les plus peuplées (2021)": {
-            "requete": """
-                SELECT c.name as commune, d.name as departement, s.valeur as population 
-                FROM commune c
-                JOIN departement d ON c.dep_id = d.dep_id
-                JOIN statistique s ON c.com_id = s.com_id
-                JOIN type_statistique ts ON s.type_id = ts.id
-                WHERE ts.nom = 'P21_POP'
-                ORDER BY s.valeur DESC 
-                LIMIT 5
-            """,
-            "headers": ["Commune", "Département", "Population"]
-        },
-        
-        # 2. Population par région (en 2021)
-        "Population par région (2021)": {
-            "requete": """
-                SELECT r.name as region, SUM(s.valeur) as population
-                FROM region r
-                JOIN departement d ON r.reg_id = d.reg_id
-                JOIN commune c ON d.dep_id = c.dep_id
-                JOIN statistique s ON c.com_id = s.com_id
-                JOIN type_statistique ts ON s.type_id = ts.id
-                WHERE ts.nom = 'P21_POP'
-                GROUP BY r.reg_id, r.name
-                ORDER BY population DESC
-            """,
-            "headers": ["Région", "Population"]
-        },
-        
-        # 3. Évolution démographique 2015-2021
-        "Evolution démographique 2015-2021": {
-            "requete": """
-                WITH pop_2015 AS (
-                    SELECT c.com_id, c.name, s.valeur
-                    FROM commune c
-                    JOIN statistique s ON c.com_id = s.com_id
-                    JOIN type_statistique ts ON s.type_id = ts.id
-                    WHERE ts.nom = 'P15_POP'
-                ),
-                pop_2021 AS (
-                    SELECT c.com_id, s.valeur
-                    FROM commune c
-                    JOIN statistique s ON c.com_id = s.com_id
-                    JOIN type_statistique ts ON s.type_id = ts.id
-                    WHERE ts.nom = 'P21_POP'
-                )
-                SELECT 
-                    p15.name as commune,
-                    d.name as departement,
-                    p15.valeur as pop_2015,
-                    p21.valeur as pop_2021,
-                    ROUND((p21.valeur - p15.valeur) * 100.0 / p15.valeur, 2) as evolution_pct
-                FROM pop_2015 p15
-                JOIN pop_2021 p21 ON p15.com_id = p21.com_id
-                JOIN commune c ON p15.com_id = c.com_id
-                JOIN departement d ON c.dep_id = d.dep_id
-                WHERE p15.valeur > 0  
-                ORDER BY evolution_pct DESC
-                LIMIT 5
-            """,
-            "headers": ["Commune", "Département", "Pop 2015", "Pop 2021", "Évolution (%)"]
-        },
-        
-        # 4. Densité de population par département
-        "Densité de population par département": {
-            "requete": """
-                SELECT 
-                    d.name as departement,
-                    ROUND(SUM(pop.valeur) / NULLIF(SUM(surf.valeur), 0), 2) as densite
-                FROM departement d
-                JOIN commune c ON d.dep_id = c.dep_id
-                JOIN statistique pop ON c.com_id = pop.com_id
-                JOIN type_statistique tpop ON pop.type_id = tpop.id
-                JOIN statistique surf ON c.com_id = surf.com_id
-                JOIN type_statistique tsurf ON surf.type_id = tsurf.id
-                WHERE tpop.nom = 'P21_POP' AND tsurf.nom = 'SUPERF'
-                GROUP BY d.dep_id, d.name
-                ORDER BY densite DESC
-                LIMIT 5
-            """,
-            "headers": ["Département", "Densité (hab/km²)"]
-        }
-    }
-
-    with conn.cursor() as cur:
-        for titre, data in requetes.items():
-            print(f"\n\033[1m=== {titre} ===\033[0m")  # Texte en gras
-            cur.execute(data["requete"])
-            results = cur.fetchall()
-            
-            # Affichage avec tabulate
-            print(tabulate(results, headers=data["headers"], tablefmt="pretty"))
-            
-            # Ajout d'une ligne vide entre les résultats
-            print()
-                      
-# Exemples d'utilisation
-if __name__ == "__main__":
-    get_departments_in_region("Occitanie")
-    get_communes_above_population("90", 1000)  # Paris
-    population_growth_rate(15, 21)  # 2015-2021
-    
-    
-    conn = None
-    try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        explorer_donnees(conn)
-    except Exception as e:
-        print(f"Erreur: {e}")
-    finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+import sys
+
+from tabulate import tabulate
+
+from cache_resultats import ServiceEnCache
+from classements import classements_a_jour
+from config import DB_CONFIG, avec_connexion
+from conseiller_index import JournalRequetes
+from series_population import NIVEAUX, SeriesPopulation
+from service_requetes import CATALOGUE, LECTURES_CLASSEMENT, RAPPORTS_EXPLORATION
+from sortie_flux import diffuser
+
+_service = None
+_series = None
+# Requêtes exécutées (fréquence, latence) pour le conseiller d'index
+_journal = JournalRequetes()
+
+def get_service():
+    """Service de requêtes partagé (pool de connexions + requêtes préparées + cache de résultats)"""
+    global _service
+    if _service is None:
+        _service = ServiceEnCache(DB_CONFIG)
+        _journal.brancher(_service)
+    return _service
+
+def get_series():
+    """Séries de population en mémoire, rechargées quand la version des données change"""
+    global _series
+    version = get_service().version()
+    if _series is None or _series[0] != version:
+        with get_service().connexion() as conn:
+            _series = (version, SeriesPopulation.depuis_base(conn))
+    return _series[1]
+
+def afficher_resultats(titre, results, headers):
+    """Couche de présentation : affichage tabulé d'un résultat"""
+    print(titre)
+    print(tabulate(results, headers=headers, tablefmt='pretty'))
+
+def stream_results(nom, params=(), format='tableau', sortie=None, itersize=2000, **options):
+    """Résultat d'une requête du catalogue écrit au fil de l'eau (csv, jsonl, tableau par pages)
+
+    Curseur nommé côté serveur : mémoire constante et première ligne immédiate, quelle que
+    soit la taille du résultat. Renvoie le nombre de lignes écrites.
+    """
+    return diffuser(get_service(), nom, params, format, sortie or sys.stdout, itersize, **options)
+
+def get_departments_in_region(region_name, afficher=False):
+    """Liste des départements d'une région donnée"""
+    results = get_service().departements_region(region_name)
+    if afficher:
+        afficher_resultats(f"\nDépartements de la région {region_name}:", results,
+                           CATALOGUE["departements_region"]["headers"])
+    return results
+
+def get_communes_above_population(department_code, min_population, afficher=False, format=None):
+    """Communes de plus de X habitants dans un département
+
+    Avec format ('csv', 'jsonl', 'tableau'), le résultat est écrit en flux sur la sortie
+    standard au lieu d'être renvoyé ; la fonction renvoie alors le nombre de lignes.
+    """
+    if format is not None:
+        return stream_results(get_service().lecture("communes_au_dessus"), (department_code, min_population), format)
+    results = get_service().communes_au_dessus(department_code, min_population)
+    if afficher:
+        afficher_resultats(f"\nCommunes de plus de {min_population} habitants dans le département {department_code}:",
+                           results, CATALOGUE["communes_au_dessus"]["headers"])
+    return results
+
+def population_growth_rate(start_year, end_year, afficher=False):
+    """Taux de croissance démographique par région"""
+    results = get_service().taux_croissance(start_year, end_year)
+    if afficher:
+        afficher_resultats(f"\nTaux de croissance démographique entre {start_year} et {end_year} par région:",
+                           results, ['Région', f'Pop {start_year}', f'Pop {end_year}', 'Taux (%)'])
+    return results
+
+def population_growth_rates(niveaux=NIVEAUX, paires=None, top_k=None, taux_min=None, taux_max=None,
+                            afficher=False):
+    """Taux de croissance pour toutes les paires d'années et tous les niveaux (séries précalculées)"""
+    results = get_series().croissance(niveaux, paires, top_k, taux_min, taux_max)
+    if afficher:
+        afficher_resultats("\nTaux de croissance démographique par paire d'années:",
+                           results.values.tolist(),
+                           ['Niveau', 'Code', 'Nom', 'Début', 'Fin', 'Pop début', 'Pop fin', 'Taux (%)'])
+    return results
+
+def get_ranking_page(critere, niveau, apres=None, taille=50, croissant=False, parent=None, afficher=False):
+    """Page d'un classement (population, croissance, densite) par curseur : (lignes, curseur suivant)"""
+    results, suivant = get_service().classement(critere, niveau, apres, taille, croissant, parent)
+    if afficher:
+        portee = f" ({parent})" if parent is not None else ""
+        afficher_resultats(f"\nClassement {critere} des {niveau}s{portee}:", results,
+                           CATALOGUE["classement_suivant"]["headers"])
+    return results, suivant
+
+def get_departments_in_regions(region_names, afficher=False):
+    """Départements de plusieurs régions en une seule requête : {région: lignes}"""
+    results = get_service().departements_regions(region_names)
+    if afficher:
+        for region_name, lignes in results.items():
+            afficher_resultats(f"\nDépartements de la région {region_name}:", lignes,
+                               CATALOGUE["departements_regions"]["headers"][1:])
+    return results
+
+def get_communes_above_population_batch(department_codes, min_population, afficher=False):
+    """Communes au-dessus d'un seuil (commun ou un par département) pour plusieurs départements en une requête"""
+    results = get_service().communes_au_dessus_lot(department_codes, min_population)
+    if afficher:
+        for cle, lignes in results.items():
+            department_code, seuil = cle if isinstance(cle, tuple) else (cle, min_population)
+            afficher_resultats(f"\nCommunes de plus de {seuil} habitants dans le département {department_code}:",
+                               lignes, CATALOGUE["communes_au_dessus_lot"]["headers"][1:])
+    return results
+        
+def explorer_donnees(conn=None):
+    """Requêtes analytiques de base avec affichage amélioré"""
+    if conn is None:
+        resultats = get_service().explorer()
+    else:
+        # Connexion fournie : les rapports n'ont pas de paramètre
+        resultats = {}
+        with conn.cursor() as cur:
+            a_jour = classements_a_jour(cur)
+            for nom in RAPPORTS_EXPLORATION:
+                cur.execute(CATALOGUE[LECTURES_CLASSEMENT.get(nom, nom) if a_jour else nom]["requete"])
+                resultats[CATALOGUE[nom]["titre"]] = cur.fetchall()
+
+    for nom in RAPPORTS_EXPLORATION:
+        titre = CATALOGUE[nom]["titre"]
+        print(f"\n\033[1m=== {titre} ===\033[0m")  # Texte en gras
+        
+        # Affichage avec tabulate
+        print(tabulate(resultats[titre], headers=CATALOGUE[nom]["headers"], tablefmt="pretty"))
+        
+        # Ajout d'une ligne vide entre les résultats
+        print()
+
+    return resultats
+                      
+# Exemples d'utilisation
+if __name__ == "__main__":
+    get_departments_in_region("Occitanie", afficher=True)
+    get_communes_above_population("90", 1000, afficher=True)  # Paris
+    population_growth_rate(15, 21, afficher=True)  # 2015-2021
+    
+    
+    avec_connexion(explorer_donnees)
+    print(f"Compteurs du service: {get_service().compteurs()}")
+    get_service().fermer()
+    _journal.sauvegarder()
\ No newline at end of file
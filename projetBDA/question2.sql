@@ -1,31 +1,83 @@
--- Vue pour les départements (version sécurisée)
-CREATE OR REPLACE VIEW stats_population_departement AS
-SELECT 
+-- Agrégats de population matérialisés (mêmes tables que question3.sql)
+-- Une ligne par (département, année) et par (région, année) pour chaque indicateur *_POP,
+-- calculée à partir de commune.dep_id et departement.reg_id.
+CREATE TABLE IF NOT EXISTS population_departement (
+    dep_id VARCHAR(3) REFERENCES departement(dep_id),
+    annee INTEGER,
+    population INTEGER NOT NULL,
+    date_maj TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (dep_id, annee)
+);
+
+CREATE TABLE IF NOT EXISTS population_region (
+    reg_id VARCHAR(2) REFERENCES region(reg_id),
+    annee INTEGER,
+    population INTEGER NOT NULL,
+    date_maj TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (reg_id, annee)
+);
+
+ALTER TABLE population_departement ADD COLUMN IF NOT EXISTS nb_communes INTEGER;
+ALTER TABLE population_region ADD COLUMN IF NOT EXISTS nb_departements INTEGER;
+
+-- Index utilisés par le recalcul partiel (rollups.rafraichir_populations)
+CREATE INDEX IF NOT EXISTS idx_commune_dep_id ON commune(dep_id);
+CREATE INDEX IF NOT EXISTS idx_departement_reg_id ON departement(reg_id);
+
+-- Calcul initial des départements
+INSERT INTO population_departement (dep_id, annee, population, nb_communes)
+SELECT
+    c.dep_id,
+    s.annee,
+    ROUND(SUM(s.valeur))::INTEGER,
+    COUNT(*)
+FROM statistique s
+JOIN type_statistique ts ON s.type_id = ts.id
+JOIN commune c ON s.com_id = c.com_id
+WHERE ts.nom LIKE '%\_POP'
+AND s.annee IS NOT NULL
+AND s.valeur IS NOT NULL
+GROUP BY c.dep_id, s.annee
+ON CONFLICT (dep_id, annee) DO UPDATE SET
+    population = EXCLUDED.population,
+    nb_communes = EXCLUDED.nb_communes,
+    date_maj = CURRENT_TIMESTAMP;
+
+-- Calcul initial des régions (à partir des départements)
+INSERT INTO population_region (reg_id, annee, population, nb_departements)
+SELECT
+    d.reg_id,
+    pd.annee,
+    SUM(pd.population),
+    COUNT(*)
+FROM population_departement pd
+JOIN departement d ON pd.dep_id = d.dep_id
+GROUP BY d.reg_id, pd.annee
+ON CONFLICT (reg_id, annee) DO UPDATE SET
+    population = EXCLUDED.population,
+    nb_departements = EXCLUDED.nb_departements,
+    date_maj = CURRENT_TIMESTAMP;
+
+-- Vues de lecture : simples lectures par clé primaire des agrégats
+DROP VIEW IF EXISTS stats_population_region;
+DROP VIEW IF EXISTS stats_population_departement;
+
+CREATE VIEW stats_population_departement AS
+SELECT
     d.dep_id,
     d.name,
-    p.annee,
-    p.population,
-    (SELECT COUNT(*) FROM commune WHERE dep_id = d.dep_id) as nb_communes
+    pd.annee,
+    pd.population,
+    pd.nb_communes
 FROM departement d
-LEFT JOIN (
-    SELECT s.com_id, 
-           SUBSTRING(ts.nom FROM 'P([0-9]+)_POP')::INTEGER as annee,
-           s.valeur as population
-    FROM statistique s
-    JOIN type_statistique ts ON s.type_id = ts.id
-    WHERE ts.nom LIKE '%_POP'
-) p ON d.dep_id = SUBSTRING(p.com_id::TEXT FROM 1 FOR 2)  -- Adaptation selon votre schéma
-GROUP BY d.dep_id, d.name, p.annee, p.population;
-
--- Vue pour les régions
-CREATE OR REPLACE VIEW stats_population_region AS
-SELECT 
+JOIN population_departement pd ON d.dep_id = pd.dep_id;
+
+CREATE VIEW stats_population_region AS
+SELECT
     r.reg_id,
     r.name,
-    p.annee,
-    SUM(p.population) as population,
-    COUNT(DISTINCT d.dep_id) as nb_departements
+    pr.annee,
+    pr.population,
+    pr.nb_departements
 FROM region r
-JOIN departement d ON r.reg_id = d.reg_id
-JOIN stats_population_departement p ON d.dep_id = p.dep_id
-GROUP BY r.reg_id, r.name, p.annee;
\ No newline at end of file
+JOIN population_region pr ON r.reg_id = pr.reg_id;
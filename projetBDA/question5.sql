@@ -1,36 +1,260 @@
--- Protection des tables
-CREATE OR REPLACE FUNCTION bloquer_modifications()
-RETURNS TRIGGER AS $$
-BEGIN
-    RAISE EXCEPTION 'Modifications directes non autorisées sur %', TG_TABLE_NAME;
-END;
-$$ LANGUAGE plpgsql;
-
-CREATE TRIGGER tr_protect_region
-BEFORE INSERT OR UPDATE OR DELETE ON region
-FOR EACH STATEMENT EXECUTE FUNCTION bloquer_modifications();
-
-CREATE TRIGGER tr_protect_departement
-BEFORE INSERT OR UPDATE OR DELETE ON departement
-FOR EACH STATEMENT EXECUTE FUNCTION bloquer_modifications();
-
--- Mise à jour automatique
-CREATE OR REPLACE FUNCTION after_stat_update()
-RETURNS TRIGGER AS $$
-DECLARE
-    code_annee TEXT;
-BEGIN
-    -- Détection d'une nouvelle année
-    SELECT SUBSTRING(ts.nom FROM 'P([0-9]+)_POP') INTO code_annee
-    FROM type_statistique ts WHERE ts.id = NEW.type_id;
-    
-    IF code_annee IS NOT NULL THEN
-        CALL calculer_population_derniere_annee();
-    END IF;
-    RETURN NULL;
-END;
-$$ LANGUAGE plpgsql;
-
-CREATE TRIGGER tr_after_stat_update
-AFTER INSERT OR UPDATE ON statistique
-FOR EACH ROW EXECUTE FUNCTION after_stat_update();
\ No newline at end of file
+-- Protection des tables
+-- Les chargeurs (create&import_data.py) écrivent le référentiel avec
+-- SET LOCAL insee.chargement_referentiel = 'on' ; toute autre modification est refusée
+CREATE OR REPLACE FUNCTION bloquer_modifications()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF COALESCE(current_setting('insee.chargement_referentiel', true), 'off') = 'on' THEN
+        RETURN NULL;
+    END IF;
+    RAISE EXCEPTION 'Modifications directes non autorisées sur %', TG_TABLE_NAME;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tr_protect_region ON region;
+DROP TRIGGER IF EXISTS tr_protect_departement ON departement;
+
+CREATE TRIGGER tr_protect_region
+BEFORE INSERT OR UPDATE OR DELETE ON region
+FOR EACH STATEMENT EXECUTE FUNCTION bloquer_modifications();
+
+CREATE TRIGGER tr_protect_departement
+BEFORE INSERT OR UPDATE OR DELETE ON departement
+FOR EACH STATEMENT EXECUTE FUNCTION bloquer_modifications();
+
+-- Mise à jour automatique des agrégats de population (par deltas)
+-- Les triggers sont FOR EACH STATEMENT : un INSERT ... SELECT d'un million de lignes
+-- déclenche une seule agrégation sur la table de transition, et non un million de recalculs.
+DROP TRIGGER IF EXISTS tr_after_stat_update ON statistique;
+DROP FUNCTION IF EXISTS after_stat_update();
+
+-- Population par commune (même table que question3.sql), tenue à jour par les deltas
+CREATE TABLE IF NOT EXISTS population_commune (
+    com_id INTEGER REFERENCES commune(com_id),
+    annee INTEGER,
+    population INTEGER NOT NULL,
+    PRIMARY KEY (com_id, annee)
+);
+
+-- Calcul initial, dans la même transaction que celui de question2.sql
+INSERT INTO population_commune (com_id, annee, population)
+SELECT s.com_id, s.annee, ROUND(SUM(s.valeur))::INTEGER
+FROM statistique s
+JOIN type_statistique ts ON s.type_id = ts.id
+WHERE ts.nom LIKE '%\_POP'
+AND s.annee IS NOT NULL
+AND s.valeur IS NOT NULL
+GROUP BY s.com_id, s.annee
+ON CONFLICT (com_id, annee) DO UPDATE SET
+    population = EXCLUDED.population;
+
+-- File des deltas : alimentée par les triggers, vidée par appliquer_deltas_population()
+CREATE TABLE IF NOT EXISTS population_delta_en_attente (
+    com_id INTEGER NOT NULL,
+    annee INTEGER NOT NULL,
+    delta NUMERIC NOT NULL,
+    nb INTEGER NOT NULL
+);
+
+-- Maintenance différée : SET insee.maintenance_differee = 'on' dans la session d'import
+CREATE OR REPLACE FUNCTION maintenance_differee()
+RETURNS BOOLEAN AS $$
+    SELECT COALESCE(current_setting('insee.maintenance_differee', true), 'off') = 'on';
+$$ LANGUAGE sql STABLE;
+
+-- Une ligne par transaction ayant différé des deltas : son trigger différé les applique au COMMIT
+CREATE TABLE IF NOT EXISTS population_maintenance_planifiee (
+    txid BIGINT PRIMARY KEY DEFAULT txid_current()
+);
+
+-- Application des deltas en attente : commune, puis département, puis région
+-- Les lignes sont verrouillées dans l'ordre des clés : deux transactions concurrentes
+-- (workers de chargement) ne peuvent pas s'interbloquer sur les agrégats.
+CREATE OR REPLACE FUNCTION appliquer_deltas_population()
+RETURNS INTEGER AS $$
+DECLARE
+    -- Pas de nom de colonne ici (nb_communes...) : il rendrait les requêtes ambiguës
+    v_nb INTEGER;
+BEGIN
+    WITH lot AS (
+        DELETE FROM population_delta_en_attente
+        RETURNING com_id, annee, delta, nb
+    ),
+    par_commune AS (
+        SELECT com_id, annee, SUM(delta) AS delta, SUM(nb) AS nb
+        FROM lot
+        GROUP BY com_id, annee
+    ),
+    -- Une commune supprimée entre-temps (synchronisation en COMMIT différé) n'a plus de
+    -- ligne à tenir : ses agrégats sont recalculés par rafraichir_populations
+    maj_commune AS (
+        INSERT INTO population_commune (com_id, annee, population)
+        SELECT p.com_id, p.annee, ROUND(p.delta)::INTEGER
+        FROM par_commune p
+        WHERE EXISTS (SELECT 1 FROM commune c WHERE c.com_id = p.com_id)
+        ORDER BY p.com_id, p.annee
+        ON CONFLICT (com_id, annee) DO UPDATE SET
+            population = population_commune.population + EXCLUDED.population
+        RETURNING 1
+    ),
+    par_departement AS (
+        SELECT c.dep_id, p.annee, SUM(p.delta) AS delta, SUM(p.nb) AS nb
+        FROM par_commune p
+        JOIN commune c ON c.com_id = p.com_id
+        GROUP BY c.dep_id, p.annee
+    ),
+    maj_departement AS (
+        INSERT INTO population_departement (dep_id, annee, population, nb_communes)
+        SELECT dep_id, annee, ROUND(delta)::INTEGER, nb
+        FROM par_departement
+        ORDER BY dep_id, annee
+        ON CONFLICT (dep_id, annee) DO UPDATE SET
+            population = population_departement.population + EXCLUDED.population,
+            nb_communes = COALESCE(population_departement.nb_communes, 0) + EXCLUDED.nb_communes,
+            date_maj = CURRENT_TIMESTAMP
+        RETURNING 1
+    ),
+    -- Départements qui apparaissent (+1) ou disparaissent (-1) pour une année :
+    -- population_departement est lue ici avant les modifications de maj_departement
+    par_region AS (
+        SELECT d.reg_id, p.annee, SUM(p.delta) AS delta,
+               SUM((COALESCE(pd.nb_communes, 0) + p.nb > 0)::INTEGER
+                   - (pd.dep_id IS NOT NULL)::INTEGER) AS nb
+        FROM par_departement p
+        JOIN departement d ON d.dep_id = p.dep_id
+        LEFT JOIN population_departement pd ON pd.dep_id = p.dep_id AND pd.annee = p.annee
+        GROUP BY d.reg_id, p.annee
+    ),
+    maj_region AS (
+        INSERT INTO population_region (reg_id, annee, population, nb_departements)
+        SELECT reg_id, annee, ROUND(delta)::INTEGER, nb
+        FROM par_region
+        ORDER BY reg_id, annee
+        ON CONFLICT (reg_id, annee) DO UPDATE SET
+            population = population_region.population + EXCLUDED.population,
+            nb_departements = COALESCE(population_region.nb_departements, 0) + EXCLUDED.nb_departements,
+            date_maj = CURRENT_TIMESTAMP
+        RETURNING 1
+    )
+    -- Les CTE de modification s'exécutent toutes, qu'elles soient lues ou non
+    SELECT COUNT(*) INTO v_nb FROM par_commune;
+
+    -- Comme le recalcul complet : pas de ligne sans commune ni département
+    IF v_nb > 0 THEN
+        DELETE FROM population_departement WHERE nb_communes <= 0;
+        DELETE FROM population_region WHERE nb_departements <= 0;
+    END IF;
+
+    RETURN v_nb;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Deltas différés : appliqués une fois, au COMMIT de la transaction qui les a empilés
+CREATE OR REPLACE FUNCTION planifier_deltas_population()
+RETURNS VOID AS $$
+    INSERT INTO population_maintenance_planifiee DEFAULT VALUES ON CONFLICT DO NOTHING;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION appliquer_deltas_au_commit()
+RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM population_maintenance_planifiee WHERE txid = NEW.txid;
+    PERFORM appliquer_deltas_population();
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tr_deltas_population_commit ON population_maintenance_planifiee;
+
+CREATE CONSTRAINT TRIGGER tr_deltas_population_commit
+AFTER INSERT ON population_maintenance_planifiee
+DEFERRABLE INITIALLY DEFERRED
+FOR EACH ROW EXECUTE FUNCTION appliquer_deltas_au_commit();
+
+-- Deltas d'un INSERT : + valeurs nouvelles
+CREATE OR REPLACE FUNCTION stat_population_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO population_delta_en_attente (com_id, annee, delta, nb)
+    SELECT n.com_id, n.annee, SUM(n.valeur), COUNT(*)
+    FROM nouvelles n
+    JOIN type_statistique ts ON n.type_id = ts.id
+    WHERE ts.nom LIKE '%\_POP' AND n.annee IS NOT NULL AND n.valeur IS NOT NULL
+    GROUP BY n.com_id, n.annee;
+
+    IF maintenance_differee() THEN
+        PERFORM planifier_deltas_population();
+    ELSE
+        PERFORM appliquer_deltas_population();
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Deltas d'un UPDATE : + nouvelles valeurs - anciennes valeurs
+CREATE OR REPLACE FUNCTION stat_population_update()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO population_delta_en_attente (com_id, annee, delta, nb)
+    SELECT v.com_id, v.annee, SUM(v.delta), SUM(v.nb)
+    FROM (
+        SELECT n.com_id, n.annee, n.type_id, n.valeur AS delta, 1 AS nb
+        FROM nouvelles n
+        WHERE n.annee IS NOT NULL AND n.valeur IS NOT NULL
+        UNION ALL
+        SELECT a.com_id, a.annee, a.type_id, -a.valeur, -1
+        FROM anciennes a
+        WHERE a.annee IS NOT NULL AND a.valeur IS NOT NULL
+    ) v
+    JOIN type_statistique ts ON v.type_id = ts.id
+    WHERE ts.nom LIKE '%\_POP'
+    GROUP BY v.com_id, v.annee
+    HAVING SUM(v.delta) <> 0 OR SUM(v.nb) <> 0;
+
+    IF maintenance_differee() THEN
+        PERFORM planifier_deltas_population();
+    ELSE
+        PERFORM appliquer_deltas_population();
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Deltas d'un DELETE : - anciennes valeurs
+CREATE OR REPLACE FUNCTION stat_population_delete()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO population_delta_en_attente (com_id, annee, delta, nb)
+    SELECT a.com_id, a.annee, -SUM(a.valeur), -COUNT(*)
+    FROM anciennes a
+    JOIN type_statistique ts ON a.type_id = ts.id
+    WHERE ts.nom LIKE '%\_POP' AND a.annee IS NOT NULL AND a.valeur IS NOT NULL
+    GROUP BY a.com_id, a.annee;
+
+    IF maintenance_differee() THEN
+        PERFORM planifier_deltas_population();
+    ELSE
+        PERFORM appliquer_deltas_population();
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tr_stat_population_insert ON statistique;
+DROP TRIGGER IF EXISTS tr_stat_population_update ON statistique;
+DROP TRIGGER IF EXISTS tr_stat_population_delete ON statistique;
+
+CREATE TRIGGER tr_stat_population_insert
+AFTER INSERT ON statistique
+REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT EXECUTE FUNCTION stat_population_insert();
+
+CREATE TRIGGER tr_stat_population_update
+AFTER UPDATE ON statistique
+REFERENCING OLD TABLE AS anciennes NEW TABLE AS nouvelles
+FOR EACH STATEMENT EXECUTE FUNCTION stat_population_update();
+
+CREATE TRIGGER tr_stat_population_delete
+AFTER DELETE ON statistique
+REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT EXECUTE FUNCTION stat_population_delete();
@@ -0,0 +1,167 @@
+import hashlib
+import os
+import time
+from contextlib import contextmanager
+
+from config import avec_connexion
+
+REPERTOIRE = os.path.dirname(os.path.abspath(__file__))
+# Agrégats et vues (question2.sql), puis triggers de maintenance par deltas (question5.sql)
+FICHIERS_SQL = [os.path.join(REPERTOIRE, 'question2.sql'), os.path.join(REPERTOIRE, 'question5.sql')]
+
+
+def installer_agregats(conn):
+    """Crée les tables d'agrégats, leur calcul initial, les vues et les triggers de maintenance
+
+    Les deux scripts s'exécutent dans la même transaction : aucune modification de
+    statistique ne peut se glisser entre le calcul initial et l'installation des triggers.
+    """
+    with conn.cursor() as cur:
+        for fichier in FICHIERS_SQL:
+            with open(fichier, encoding='utf-8') as f:
+                cur.execute(f.read())
+        # Empreinte des scripts installés, relue par agregats_a_jour
+        cur.execute("COMMENT ON FUNCTION appliquer_deltas_population() IS %s", (empreinte_scripts(),))
+    conn.commit()
+
+
+def empreinte_scripts():
+    """Empreinte SHA-256 du contenu des scripts de FICHIERS_SQL"""
+    h = hashlib.sha256()
+    for fichier in FICHIERS_SQL:
+        with open(fichier, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def agregats_a_jour(cur):
+    """Vrai si les scripts installés sont ceux du dépôt (rien à réinstaller)"""
+    cur.execute("SELECT obj_description(to_regproc('appliquer_deltas_population'), 'pg_proc')")
+    return cur.fetchone()[0] == empreinte_scripts()
+
+
+def triggers_installes(cur):
+    """Vrai si la maintenance par triggers de question5.sql est installée"""
+    cur.execute("SELECT to_regproc('appliquer_deltas_population') IS NOT NULL")
+    return cur.fetchone()[0]
+
+
+@contextmanager
+def maintenance_differee(conn):
+    """Diffère la maintenance par triggers (question5.sql) au COMMIT de chaque transaction
+
+    Pendant le bloc, les triggers ne font qu'empiler leurs deltas dans
+    population_delta_en_attente ; un trigger différé les applique en une seule fois
+    au COMMIT de la transaction qui les a produits (rien au ROLLBACK).
+    """
+    with conn.cursor() as cur:
+        # SET de session validé tout de suite : il survit aux COMMIT des importeurs
+        cur.execute("SET insee.maintenance_differee = 'on'")
+    conn.commit()
+    try:
+        yield
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("RESET insee.maintenance_differee")
+        conn.commit()
+
+
+def rafraichir_populations(conn, departements=None):
+    """Recalcule les agrégats des départements donnés (tous si None) et de leurs régions
+
+    Tout se fait dans une seule transaction : les lecteurs voient l'ancien état jusqu'au
+    COMMIT puis le nouveau, jamais un état intermédiaire.
+    """
+    debut = time.perf_counter()
+    try:
+        with conn.cursor() as cur:
+            # Un seul recalcul à la fois ; les lectures ne sont pas bloquées
+            cur.execute("LOCK TABLE population_departement, population_region IN SHARE ROW EXCLUSIVE MODE")
+
+            # Deltas des triggers encore en attente : appliqués avant d'être écrasés
+            # par le recalcul, sinon ils seraient comptés deux fois plus tard
+            if triggers_installes(cur):
+                cur.execute("SELECT appliquer_deltas_population()")
+
+            if departements is None:
+                cur.execute("SELECT dep_id FROM departement")
+                departements = [dep_id for (dep_id,) in cur.fetchall()]
+            departements = sorted(set(departements))
+            if not departements:
+                conn.commit()
+                return 0, 0
+
+            cur.execute("SELECT DISTINCT reg_id FROM departement WHERE dep_id = ANY(%s)", (departements,))
+            regions = [reg_id for (reg_id,) in cur.fetchall()]
+
+            # 1. Départements touchés
+            cur.execute("DELETE FROM population_departement WHERE dep_id = ANY(%s)", (departements,))
+            cur.execute("""
+                INSERT INTO population_departement (dep_id, annee, population, nb_communes)
+                SELECT
+                    c.dep_id,
+                    s.annee,
+                    ROUND(SUM(s.valeur))::INTEGER,
+                    COUNT(*)
+                FROM commune c
+                JOIN statistique s ON s.com_id = c.com_id
+                JOIN type_statistique ts ON s.type_id = ts.id
+                WHERE c.dep_id = ANY(%s)
+                AND ts.nom LIKE '%%\\_POP'
+                AND s.annee IS NOT NULL
+                AND s.valeur IS NOT NULL
+                GROUP BY c.dep_id, s.annee
+            """, (departements,))
+
+            # 2. Régions de ces départements, à partir des agrégats départementaux
+            cur.execute("DELETE FROM population_region WHERE reg_id = ANY(%s)", (regions,))
+            cur.execute("""
+                INSERT INTO population_region (reg_id, annee, population, nb_departements)
+                SELECT
+                    d.reg_id,
+                    pd.annee,
+                    SUM(pd.population),
+                    COUNT(*)
+                FROM departement d
+                JOIN population_departement pd ON pd.dep_id = d.dep_id
+                WHERE d.reg_id = ANY(%s)
+                GROUP BY d.reg_id, pd.annee
+            """, (regions,))
+        conn.commit()
+        print(f"Agrégats de population recalculés: {len(departements)} départements, "
+              f"{len(regions)} régions en {time.perf_counter() - debut:.2f}s")
+        return len(departements), len(regions)
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Erreur recalcul des agrégats: {str(e)}")
+        raise
+
+
+def population_region(conn, reg_id, annee):
+    """Population d'une région pour une année (lecture par clé primaire)"""
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT population FROM population_region WHERE reg_id = %s AND annee = %s",
+            (reg_id, annee)
+        )
+        ligne = cur.fetchone()
+    return ligne[0] if ligne else None
+
+
+def population_departement(conn, dep_id, annee):
+    """Population d'un département pour une année (lecture par clé primaire)"""
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT population FROM population_departement WHERE dep_id = %s AND annee = %s",
+            (dep_id, annee)
+        )
+        ligne = cur.fetchone()
+    return ligne[0] if ligne else None
+
+
+if __name__ == "__main__":
+    avec_connexion(installer_agregats, rafraichir_populations)
@@ -11,12 +11,44 @@ CREATE TABLE departement (
     reg_id VARCHAR(2) NOT NULL REFERENCES region(reg_id)
 );
 
+-- Table ARRONDISSEMENT
+CREATE TABLE arrondissement (
+    arr_id VARCHAR(4) PRIMARY KEY,
+    name VARCHAR(100),
+    dep_id VARCHAR(3) NOT NULL REFERENCES departement(dep_id)
+);
+
+-- Table CANTON
+CREATE TABLE canton (
+    can_id VARCHAR(5) PRIMARY KEY,
+    name VARCHAR(100),
+    dep_id VARCHAR(3) NOT NULL REFERENCES departement(dep_id)
+);
+
+-- Table COLLECTIVITE
+CREATE TABLE collectivite (
+    ctcd_id VARCHAR(4) PRIMARY KEY,
+    reg_id VARCHAR(2) NOT NULL REFERENCES region(reg_id)
+);
+
 -- Table COMMUNE
 CREATE TABLE commune (
     com_id SERIAL PRIMARY KEY,
     code_insee VARCHAR(5) NOT NULL UNIQUE,
     name VARCHAR(100) NOT NULL,
-    dep_id VARCHAR(3) NOT NULL REFERENCES departement(dep_id)
+    dep_id VARCHAR(3) NOT NULL REFERENCES departement(dep_id),
+    arr_id VARCHAR(4) REFERENCES arrondissement(arr_id),
+    can_id VARCHAR(5) REFERENCES canton(can_id),
+    ctcd_id VARCHAR(4) REFERENCES collectivite(ctcd_id)
+);
+
+-- Table COMMUNERATTACHEE (communes associées, déléguées, arrondissements municipaux)
+CREATE TABLE commune_rattachee (
+    code_insee VARCHAR(5) NOT NULL,
+    typecom VARCHAR(4) NOT NULL,
+    name VARCHAR(100) NOT NULL,
+    com_parent_id INTEGER NOT NULL REFERENCES commune(com_id),
+    PRIMARY KEY (typecom, code_insee)
 );
 
 -- Table CHEFLIEUREGION
@@ -53,4 +85,7 @@ CREATE TABLE statistique (
 -- Index pour améliorer les performances
 CREATE INDEX idx_statistique_com_id ON statistique(com_id);
 CREATE INDEX idx_statistique_type_id ON statistique(type_id);
-CREATE INDEX idx_statistique_annee ON statistique(annee);
\ No newline at end of file
+CREATE INDEX idx_statistique_annee ON statistique(annee);CREATE INDEX idx_commune_arr_id ON commune(arr_id);
+CREATE INDEX idx_commune_can_id ON commune(can_id);
+CREATE INDEX idx_commune_ctcd_id ON commune(ctcd_id);
+CREATE INDEX idx_commune_rattachee_parent ON commune_rattachee(com_parent_id);
@@ -0,0 +1,194 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from config import avec_connexion
+
+NIVEAUX = ('commune', 'departement', 'region')
+
+
+def installer_series(cur):
+    """Série de population par entité : une ligne par (niveau, code), un tableau aligné sur les années"""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS serie_population (
+        niveau VARCHAR(12) NOT NULL,
+        code VARCHAR(5) NOT NULL,
+        nom VARCHAR(100) NOT NULL,
+        populations FLOAT8[] NOT NULL,
+        PRIMARY KEY (niveau, code)
+    );
+
+    -- Années des positions de populations[] (D68 ... P21), une seule ligne
+    CREATE TABLE IF NOT EXISTS serie_population_annees (
+        id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+        annees INTEGER[] NOT NULL
+    );
+    """)
+
+
+def rafraichir_series(conn):
+    """Recalcule toutes les séries (communes depuis statistique, départements / régions depuis les agrégats)
+
+    Une année sans donnée pour une entité vaut NULL dans le tableau (NaN côté NumPy).
+    Tout se fait dans une transaction : les lecteurs voient les anciennes séries jusqu'au COMMIT.
+    """
+    debut = time.perf_counter()
+    try:
+        with conn.cursor() as cur:
+            installer_series(cur)
+            # Un seul recalcul à la fois ; les lectures ne sont pas bloquées
+            cur.execute("LOCK TABLE serie_population, serie_population_annees IN SHARE ROW EXCLUSIVE MODE")
+
+            # 1. Années de recensement présentes : positions communes à toutes les séries
+            cur.execute("""
+                SELECT COALESCE(array_agg(DISTINCT s.annee ORDER BY s.annee), '{}')
+                FROM statistique s
+                JOIN type_statistique ts ON s.type_id = ts.id
+                WHERE ts.nom LIKE '%\\_POP' AND s.annee IS NOT NULL
+            """)
+            annees = cur.fetchone()[0]
+            cur.execute("""
+                INSERT INTO serie_population_annees (id, annees) VALUES (TRUE, %s)
+                ON CONFLICT (id) DO UPDATE SET annees = EXCLUDED.annees
+            """, (annees,))
+
+            # DELETE et non TRUNCATE (verrou ACCESS EXCLUSIVE : lecteurs bloqués jusqu'au COMMIT)
+            cur.execute("DELETE FROM serie_population")
+
+            # 2. Communes : une agrégation ordonnée sur la grille communes x années
+            cur.execute("""
+                INSERT INTO serie_population (niveau, code, nom, populations)
+                SELECT 'commune', c.code_insee, c.name, array_agg(p.valeur::float8 ORDER BY a.annee)
+                FROM commune c
+                CROSS JOIN unnest(%s::int[]) AS a(annee)
+                LEFT JOIN (
+                    SELECT s.com_id, s.annee, s.valeur
+                    FROM statistique s
+                    JOIN type_statistique ts ON s.type_id = ts.id
+                    WHERE ts.nom LIKE '%%\\_POP'
+                ) p ON p.com_id = c.com_id AND p.annee = a.annee
+                GROUP BY c.com_id, c.code_insee, c.name
+            """, (annees,))
+            nb_communes = cur.rowcount
+
+            # 3. Départements et régions : agrégats de population déjà maintenus
+            for niveau, table, cle in (('departement', 'population_departement', 'dep_id'),
+                                       ('region', 'population_region', 'reg_id')):
+                cur.execute(f"""
+                    INSERT INTO serie_population (niveau, code, nom, populations)
+                    SELECT %s, e.{cle}, e.name, array_agg(p.population::float8 ORDER BY a.annee)
+                    FROM {niveau} e
+                    CROSS JOIN unnest(%s::int[]) AS a(annee)
+                    LEFT JOIN {table} p ON p.{cle} = e.{cle} AND p.annee = a.annee
+                    GROUP BY e.{cle}, e.name
+                """, (niveau, annees))
+            cur.execute("ANALYZE serie_population")
+        conn.commit()
+        print(f"Séries de population: {nb_communes} communes, {len(annees)} années "
+              f"en {time.perf_counter() - debut:.2f}s")
+        return annees
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Erreur recalcul des séries de population: {str(e)}")
+        raise
+
+
+class SeriesPopulation:
+    """Séries de population en mémoire : une matrice (entités x années) par niveau"""
+
+    def __init__(self, annees, niveaux):
+        self.annees = np.asarray(annees, dtype=np.int32)
+        self.niveaux = niveaux  # niveau -> (codes, noms, matrice float64)
+        self.index_annee = {int(a): j for j, a in enumerate(self.annees)}
+
+    @classmethod
+    def depuis_base(cls, conn):
+        with conn.cursor() as cur:
+            cur.execute("SELECT annees FROM serie_population_annees")
+            ligne = cur.fetchone()
+            annees = ligne[0] if ligne else []
+            cur.execute("SELECT niveau, code, nom, populations FROM serie_population ORDER BY niveau, code")
+            lignes = cur.fetchall()
+        conn.commit()
+
+        niveaux = {}
+        for niveau in NIVEAUX:
+            du_niveau = [l for l in lignes if l[0] == niveau]
+            matrice = np.array([[np.nan if v is None else v for v in l[3]] for l in du_niveau],
+                               dtype=np.float64).reshape(len(du_niveau), len(annees))
+            niveaux[niveau] = (np.array([l[1] for l in du_niveau]),
+                               np.array([l[2] for l in du_niveau], dtype=object),
+                               matrice)
+        return cls(annees, niveaux)
+
+    def paires(self, annees=None):
+        """Toutes les paires (début, fin) avec début < fin parmi les années demandées"""
+        annees = sorted(self.annees.tolist() if annees is None else annees)
+        return [(a, b) for i, a in enumerate(annees) for b in annees[i + 1:]]
+
+    def croissance(self, niveaux=NIVEAUX, paires=None, top_k=None, taux_min=None, taux_max=None,
+                   croissant=False):
+        """Taux de croissance (%) pour toutes les paires et tous les niveaux demandés, en une passe
+
+        Pour chaque niveau, la matrice (entités x paires) est calculée d'un bloc ; taux_min /
+        taux_max filtrent, top_k garde par niveau et par paire les k plus forts taux (les k
+        plus faibles si croissant). Renvoie un DataFrame trié par niveau, paire, taux.
+        """
+        paires = self.paires() if paires is None else paires
+        inconnues = [a for paire in paires for a in paire if a not in self.index_annee]
+        if inconnues:
+            raise ValueError(f"Années absentes des séries: {sorted(set(inconnues))}")
+        debuts = np.array([self.index_annee[a] for a, _ in paires], dtype=np.intp)
+        fins = np.array([self.index_annee[b] for _, b in paires], dtype=np.intp)
+
+        morceaux = []
+        for niveau in niveaux:
+            codes, noms, matrice = self.niveaux[niveau]
+            pop_debut = matrice[:, debuts]
+            pop_fin = matrice[:, fins]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                taux = np.where(pop_debut > 0, (pop_fin - pop_debut) * 100.0 / pop_debut, np.nan)
+
+            garder = ~np.isnan(taux)
+            if taux_min is not None:
+                garder &= taux >= taux_min
+            if taux_max is not None:
+                garder &= taux <= taux_max
+            if top_k is not None and top_k < len(codes):
+                # Rang de chaque entité dans sa colonne (paire), NaN / filtrés en dernier
+                scores = np.where(garder, taux if croissant else -taux, np.inf)
+                rangs = np.argsort(np.argsort(scores, axis=0, kind='stable'), axis=0)
+                garder &= rangs < top_k
+
+            lignes, colonnes = np.nonzero(garder)
+            morceaux.append(pd.DataFrame({
+                'niveau': niveau,
+                'code': codes[lignes],
+                'nom': noms[lignes],
+                'annee_debut': self.annees[debuts[colonnes]],
+                'annee_fin': self.annees[fins[colonnes]],
+                'pop_debut': pop_debut[lignes, colonnes],
+                'pop_fin': pop_fin[lignes, colonnes],
+                'taux': np.round(taux[lignes, colonnes], 2),
+            }))
+
+        resultat = pd.concat(morceaux, ignore_index=True) if morceaux else pd.DataFrame()
+        if resultat.empty:
+            return resultat
+        return resultat.sort_values(['niveau', 'annee_debut', 'annee_fin', 'taux'],
+                                    ascending=[True, True, True, croissant], ignore_index=True)
+
+
+if __name__ == "__main__":
+    def rapport(conn):
+        rafraichir_series(conn)
+        series = SeriesPopulation.depuis_base(conn)
+        debut = time.perf_counter()
+        resultat = series.croissance(top_k=3)
+        print(f"{len(series.paires())} paires x {len(NIVEAUX)} niveaux en "
+              f"{(time.perf_counter() - debut) * 1000:.1f} ms")
+        print(resultat.to_string(index=False))
+
+    avec_connexion(rapport)
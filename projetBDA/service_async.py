@@ -0,0 +1,256 @@
+import argparse
+import asyncio
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import asyncpg
+import numpy as np
+
+from config import DB_CONFIG
+from service_requetes import CATALOGUE, RAPPORTS_EXPLORATION, ServiceRequetes, cle_requete
+
+class ServiceSature(RuntimeError):
+    """Trop de requêtes en attente : la demande est refusée plutôt que mise en file"""
+
+
+class ServiceAsync:
+    """Catalogue de requêtes sur asyncpg : pool asynchrone, requêtes identiques fusionnées, contre-pression
+
+    concurrence_max borne les requêtes envoyées en même temps à la base ;
+    attente_max borne celles qui attendent leur tour (au-delà : ServiceSature).
+    Les requêtes sont préparées automatiquement par asyncpg (cache par connexion).
+    """
+
+    def __init__(self, db_config=None, taille_pool=10, concurrence_max=None, attente_max=1000):
+        self.db_config = db_config or DB_CONFIG
+        self.taille_pool = taille_pool
+        self.concurrence_max = concurrence_max or taille_pool
+        self.attente_max = attente_max
+        self._pool = None
+        self._places = asyncio.Semaphore(self.concurrence_max)
+        self._en_attente = 0
+        self._en_vol = {}  # (nom, params) -> tâche en cours, partagée par les demandes identiques
+        self._latences = deque(maxlen=100000)
+        self._compteurs = {'demandes': 0, 'requetes': 0, 'fusionnees': 0, 'refusees': 0, 'erreurs': 0}
+        # Comme ServiceRequetes.observateurs : observateur(nom, params, durée en s)
+        self.observateurs = []
+
+    async def ouvrir(self):
+        self._pool = await asyncpg.create_pool(min_size=1, max_size=self.taille_pool, **self.db_config)
+        return self
+
+    async def fermer(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def __aenter__(self):
+        return await self.ouvrir()
+
+    async def __aexit__(self, *exc):
+        await self.fermer()
+
+    async def _executer(self, nom, params):
+        """Exécution réelle, bornée par le sémaphore de concurrence"""
+        if self._en_attente >= self.attente_max:
+            self._compteurs['refusees'] += 1
+            raise ServiceSature(f"{self._en_attente} requêtes en attente (max {self.attente_max})")
+        self._en_attente += 1
+        try:
+            await self._places.acquire()
+        finally:
+            self._en_attente -= 1
+        try:
+            async with self._pool.acquire() as conn:
+                debut = time.perf_counter()
+                lignes = await conn.fetch(CATALOGUE[nom]["requete"], *params)
+                duree = time.perf_counter() - debut
+            self._compteurs['requetes'] += 1
+            for observateur in self.observateurs:
+                observateur(nom, params, duree)
+            return [tuple(ligne) for ligne in lignes]
+        except Exception:
+            self._compteurs['erreurs'] += 1
+            raise
+        finally:
+            self._places.release()
+
+    async def executer(self, nom, params=()):
+        """Exécute une requête du catalogue ; une demande identique en cours est partagée"""
+        if nom not in CATALOGUE:
+            raise KeyError(f"Requête inconnue: {nom}")
+        cle = cle_requete(nom, params)
+        debut = time.perf_counter()
+        self._compteurs['demandes'] += 1
+
+        tache = self._en_vol.get(cle)
+        if tache is None:
+            tache = asyncio.ensure_future(self._executer(nom, tuple(params)))
+            self._en_vol[cle] = tache
+            tache.add_done_callback(lambda _: self._en_vol.pop(cle, None))
+        else:
+            self._compteurs['fusionnees'] += 1
+
+        # shield : l'annulation d'un demandeur n'annule pas la requête des autres
+        resultat = await asyncio.shield(tache)
+        self._latences.append(time.perf_counter() - debut)
+        return resultat
+
+    def compteurs(self):
+        """Compteurs et latences (p50 / p99 sur les dernières demandes)"""
+        stats = dict(self._compteurs)
+        stats['en_attente'] = self._en_attente
+        stats['en_vol'] = len(self._en_vol)
+        if self._latences:
+            latences = np.array(self._latences)
+            stats['latence_p50_s'] = float(np.percentile(latences, 50))
+            stats['latence_p99_s'] = float(np.percentile(latences, 99))
+        return stats
+
+    # Catalogue
+    async def departements_region(self, region_name):
+        """Liste des départements d'une région donnée"""
+        return await self.executer("departements_region", (region_name,))
+
+    async def communes_au_dessus(self, department_code, min_population):
+        """Communes de plus de X habitants dans un département"""
+        return await self.executer("communes_au_dessus", (department_code, min_population))
+
+    async def taux_croissance(self, start_year, end_year):
+        """Taux de croissance démographique par région"""
+        return await self.executer("taux_croissance", (f'P{start_year}_POP', f'P{end_year}_POP'))
+
+    async def explorer(self):
+        """Résultats des rapports d'exploration, par titre (exécutés en parallèle)"""
+        resultats = await asyncio.gather(*(self.executer(nom) for nom in RAPPORTS_EXPLORATION))
+        return {CATALOGUE[nom]["titre"]: lignes for nom, lignes in zip(RAPPORTS_EXPLORATION, resultats)}
+
+
+# Benchmark : débit soutenu et p99, asynchrone contre synchrone
+
+async def charge_de_travail(pool, nb, graine=0):
+    """Mélange de recherches représentatif du front : départements d'une région, communes au-dessus d'un seuil"""
+    async with pool.acquire() as conn:
+        regions = [r['name'] for r in await conn.fetch("SELECT name FROM region")]
+        departements = [d['dep_id'] for d in await conn.fetch("SELECT dep_id FROM departement")]
+    rng = random.Random(graine)
+    demandes = []
+    for _ in range(nb):
+        if rng.random() < 0.5:
+            demandes.append(("departements_region", (rng.choice(regions),)))
+        else:
+            demandes.append(("communes_au_dessus", (rng.choice(departements), rng.choice([1000, 5000, 10000]))))
+    return demandes
+
+
+def _resume(latences, duree, erreurs=0):
+    latences = np.array(latences)
+    return {
+        'requetes': len(latences),
+        'erreurs': erreurs,
+        'debit_req_s': round(len(latences) / duree, 1),
+        'p50_ms': round(float(np.percentile(latences, 50)) * 1000, 2),
+        'p99_ms': round(float(np.percentile(latences, 99)) * 1000, 2),
+    }
+
+
+async def mesurer_async(service, demandes, concurrence):
+    """Débit du service asynchrone avec `concurrence` clients simultanés"""
+    file = asyncio.Queue()
+    for demande in demandes:
+        file.put_nowait(demande)
+    latences = []
+    erreurs = 0
+
+    async def client():
+        nonlocal erreurs
+        while not file.empty():
+            nom, params = file.get_nowait()
+            debut = time.perf_counter()
+            try:
+                await service.executer(nom, params)
+                latences.append(time.perf_counter() - debut)
+            except ServiceSature:
+                erreurs += 1
+
+    debut = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrence)))
+    return _resume(latences, time.perf_counter() - debut, erreurs)
+
+
+def mesurer_sync(demandes, concurrence, taille_pool, db_config=None):
+    """Même charge sur le service synchrone de question1 (threads + pool psycopg2)"""
+    latences = []
+
+    def appel(demande):
+        nom, params = demande
+        debut = time.perf_counter()
+        service.executer(nom, params)
+        return time.perf_counter() - debut
+
+    with ServiceRequetes(db_config, taille_pool=taille_pool) as service:
+        debut = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrence) as executeur:
+            latences.extend(executeur.map(appel, demandes))
+        duree = time.perf_counter() - debut
+    return _resume(latences, duree)
+
+
+def paliers_concurrence(concurrence):
+    """Concurrences mesurées : puissances de deux jusqu'à `concurrence` incluse"""
+    paliers = [1]
+    while paliers[-1] * 2 < concurrence:
+        paliers.append(paliers[-1] * 2)
+    return paliers + [concurrence] if concurrence > 1 else paliers
+
+
+def debit_a_p99(resultats, p99_cible_ms):
+    """Meilleur débit dont le p99 tient la cible (None si aucun palier ne la tient)"""
+    tenus = [r for r in resultats if r['p99_ms'] <= p99_cible_ms]
+    return max(tenus, key=lambda r: r['debit_req_s']) if tenus else None
+
+
+async def comparer(nb_demandes=5000, concurrence=200, taille_pool=10):
+    """Même charge, mêmes paliers de concurrence (clients simultanés) des deux côtés
+
+    Chaque côté a le même nombre de connexions (taille_pool) ; la comparaison se fait
+    ensuite au débit soutenu sous une même cible de p99 (debit_a_p99).
+    """
+    paliers = paliers_concurrence(concurrence)
+    resultats = {'asynchrone': [], 'synchrone': []}
+    async with ServiceAsync(DB_CONFIG, taille_pool=taille_pool, attente_max=nb_demandes) as service:
+        demandes = await charge_de_travail(service._pool, nb_demandes)
+        for palier in paliers:
+            resultats['asynchrone'].append(dict(await mesurer_async(service, demandes, palier), concurrence=palier))
+        print(f"Compteurs du service asynchrone: {service.compteurs()}")
+    # Côté synchrone, un thread par client simultané
+    for palier in paliers:
+        resultats['synchrone'].append(dict(mesurer_sync(demandes, palier, taille_pool), concurrence=palier))
+    return resultats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark du service de requêtes asynchrone")
+    parser.add_argument('--demandes', type=int, default=5000)
+    parser.add_argument('--concurrence', type=int, default=200, help="Clients simultanés du dernier palier")
+    parser.add_argument('--pool', type=int, default=10)
+    parser.add_argument('--p99-cible', type=float, default=50.0, help="Latence p99 à tenir (ms)")
+    args = parser.parse_args()
+
+    resultats = asyncio.run(comparer(args.demandes, args.concurrence, args.pool))
+    for nom, paliers in resultats.items():
+        for resultat in paliers:
+            print(f"{nom:<11} x{resultat['concurrence']:<4} {resultat['debit_req_s']:>9.1f} req/s  "
+                  f"p50 {resultat['p50_ms']:.2f} ms  p99 {resultat['p99_ms']:.2f} ms  "
+                  f"({resultat['requetes']} requêtes, {resultat['erreurs']} refusées)")
+
+    print(f"\nDébit soutenu à p99 <= {args.p99_cible:g} ms:")
+    for nom, paliers in resultats.items():
+        meilleur = debit_a_p99(paliers, args.p99_cible)
+        if meilleur is None:
+            print(f"{nom:<11} cible non tenue (p99 minimal {min(r['p99_ms'] for r in paliers):.2f} ms)")
+        else:
+            print(f"{nom:<11} {meilleur['debit_req_s']:>9.1f} req/s  (x{meilleur['concurrence']} clients, "
+                  f"p99 {meilleur['p99_ms']:.2f} ms)")
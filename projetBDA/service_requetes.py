@@ -0,0 +1,562 @@
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+from classements import RANG_MAX, classements_a_jour, verifier_classement
+from config import DB_CONFIG
+
+# Catalogue des requêtes : paramètres positionnels $1, $2... (syntaxe PREPARE)
+CATALOGUE = {
+    "departements_region": {
+        "requete": """
+            SELECT d.dep_id, d.name, c.name as chef_lieu
+            FROM departement d
+            JOIN region r ON d.reg_id = r.reg_id
+            JOIN chef_lieu_departement cld ON d.dep_id = cld.dep_id
+            JOIN commune c ON cld.com_id = c.com_id
+            WHERE r.name = $1
+            ORDER BY d.name
+        """,
+        "headers": ["Code", "Département", "Chef-lieu"]
+    },
+
+    "communes_au_dessus": {
+        "requete": """
+            SELECT c.name, s.valeur as population
+            FROM commune c
+            JOIN statistique s ON c.com_id = s.com_id
+            JOIN type_statistique ts ON s.type_id = ts.id
+            WHERE c.dep_id = $1
+            AND ts.nom = 'P21_POP'
+            AND s.valeur > $2
+            ORDER BY s.valeur DESC
+        """,
+        "headers": ["Commune", "Population"]
+    },
+
+    "taux_croissance": {
+        "requete": """
+            WITH pop_start AS (
+                SELECT r.reg_id, r.name, SUM(s.valeur) as population
+                FROM region r
+                JOIN departement d ON r.reg_id = d.reg_id
+                JOIN commune c ON d.dep_id = c.dep_id
+                JOIN statistique s ON c.com_id = s.com_id
+                JOIN type_statistique ts ON s.type_id = ts.id
+                WHERE ts.nom = $1
+                GROUP BY r.reg_id, r.name
+            ),
+            pop_end AS (
+                SELECT r.reg_id, SUM(s.valeur) as population
+                FROM region r
+                JOIN departement d ON r.reg_id = d.reg_id
+                JOIN commune c ON d.dep_id = c.dep_id
+                JOIN statistique s ON c.com_id = s.com_id
+                JOIN type_statistique ts ON s.type_id = ts.id
+                WHERE ts.nom = $2
+                GROUP BY r.reg_id
+            )
+            SELECT
+                ps.name as region,
+                ps.population as pop_start,
+                pe.population as pop_end,
+                ROUND((pe.population - ps.population) * 100.0 / ps.population, 2) as growth_rate
+            FROM pop_start ps
+            JOIN pop_end pe ON ps.reg_id = pe.reg_id
+            ORDER BY growth_rate DESC
+        """,
+        "headers": ["Région", "Pop début", "Pop fin", "Taux (%)"]
+    },
+
+    # Variantes par lot : un tableau de clés, une seule requête ensembliste
+    "departements_regions": {
+        "requete": """
+            SELECT r.name as region, d.dep_id, d.name, c.name as chef_lieu
+            FROM region r
+            JOIN departement d ON d.reg_id = r.reg_id
+            JOIN chef_lieu_departement cld ON d.dep_id = cld.dep_id
+            JOIN commune c ON cld.com_id = c.com_id
+            WHERE r.name = ANY($1::text[])
+            ORDER BY r.name, d.name
+        """,
+        # Première colonne : clé de regroupement (retirée par regrouper)
+        "headers": ["Région", "Code", "Département", "Chef-lieu"]
+    },
+
+    "communes_au_dessus_lot": {
+        "requete": """
+            SELECT q.rang, c.name, s.valeur as population
+            FROM unnest($1::text[], $2::numeric[]) WITH ORDINALITY AS q(dep_id, seuil, rang)
+            JOIN commune c ON c.dep_id = q.dep_id
+            JOIN statistique s ON c.com_id = s.com_id
+            JOIN type_statistique ts ON s.type_id = ts.id
+            WHERE ts.nom = 'P21_POP'
+            AND s.valeur > q.seuil
+            ORDER BY q.rang, s.valeur DESC
+        """,
+        "headers": ["Rang", "Commune", "Population"]
+    },
+
+    # Pages de classement par curseur : le premier champ est le curseur de la page suivante
+    "classement_suivant": {
+        "requete": """
+            SELECT rang, code, nom, valeur
+            FROM classement
+            WHERE critere = $1 AND niveau = $2 AND rang > $3
+            ORDER BY rang
+            LIMIT $4
+        """,
+        "headers": ["Rang", "Code", "Nom", "Valeur"]
+    },
+
+    "classement_precedent": {
+        "requete": """
+            SELECT rang, code, nom, valeur
+            FROM classement
+            WHERE critere = $1 AND niveau = $2 AND rang < $3
+            ORDER BY rang DESC
+            LIMIT $4
+        """,
+        "headers": ["Rang", "Code", "Nom", "Valeur"]
+    },
+
+    "classement_parent_suivant": {
+        "requete": """
+            SELECT rang_parent, code, nom, valeur
+            FROM classement
+            WHERE critere = $1 AND niveau = $2 AND parent = $3 AND rang_parent > $4
+            ORDER BY rang_parent
+            LIMIT $5
+        """,
+        "headers": ["Rang", "Code", "Nom", "Valeur"]
+    },
+
+    "classement_parent_precedent": {
+        "requete": """
+            SELECT rang_parent, code, nom, valeur
+            FROM classement
+            WHERE critere = $1 AND niveau = $2 AND parent = $3 AND rang_parent < $4
+            ORDER BY rang_parent DESC
+            LIMIT $5
+        """,
+        "headers": ["Rang", "Code", "Nom", "Valeur"]
+    },
+
+    "classement_position": {
+        "requete": """
+            SELECT
+                cl.rang, cl.parent, cl.rang_parent, cl.valeur,
+                (SELECT MAX(rang) FROM classement WHERE critere = $1 AND niveau = $2) as taille
+            FROM classement cl
+            WHERE cl.critere = $1 AND cl.niveau = $2 AND cl.code = $3
+        """,
+        "headers": ["Rang", "Parent", "Rang (parent)", "Valeur", "Taille"]
+    },
+
+    # Rapports de explorer_donnees (sans paramètre)
+    "top_communes_2021": {
+        "titre": "Top 5 des communes les plus peuplées (2021)",
+        "requete": """
+            SELECT c.name as commune, d.name as departement, s.valeur as population
+            FROM commune c
+            JOIN departement d ON c.dep_id = d.dep_id
+            JOIN statistique s ON c.com_id = s.com_id
+            JOIN type_statistique ts ON s.type_id = ts.id
+            WHERE ts.nom = 'P21_POP'
+            ORDER BY s.valeur DESC
+            LIMIT 5
+        """,
+        "headers": ["Commune", "Département", "Population"]
+    },
+
+    "population_region_2021": {
+        "titre": "Population par région (2021)",
+        "requete": """
+            SELECT r.name as region, SUM(s.valeur) as population
+            FROM region r
+            JOIN departement d ON r.reg_id = d.reg_id
+            JOIN commune c ON d.dep_id = c.dep_id
+            JOIN statistique s ON c.com_id = s.com_id
+            JOIN type_statistique ts ON s.type_id = ts.id
+            WHERE ts.nom = 'P21_POP'
+            GROUP BY r.reg_id, r.name
+            ORDER BY population DESC
+        """,
+        "headers": ["Région", "Population"]
+    },
+
+    "evolution_2015_2021": {
+        "titre": "Evolution démographique 2015-2021",
+        "requete": """
+            WITH pop_2015 AS (
+                SELECT c.com_id, c.name, s.valeur
+                FROM commune c
+                JOIN statistique s ON c.com_id = s.com_id
+                JOIN type_statistique ts ON s.type_id = ts.id
+                WHERE ts.nom = 'P15_POP'
+            ),
+            pop_2021 AS (
+                SELECT c.com_id, s.valeur
+                FROM commune c
+                JOIN statistique s ON c.com_id = s.com_id
+                JOIN type_statistique ts ON s.type_id = ts.id
+                WHERE ts.nom = 'P21_POP'
+            )
+            SELECT
+                p15.name as commune,
+                d.name as departement,
+                p15.valeur as pop_2015,
+                p21.valeur as pop_2021,
+                ROUND((p21.valeur - p15.valeur) * 100.0 / p15.valeur, 2) as evolution_pct
+            FROM pop_2015 p15
+            JOIN pop_2021 p21 ON p15.com_id = p21.com_id
+            JOIN commune c ON p15.com_id = c.com_id
+            JOIN departement d ON c.dep_id = d.dep_id
+            WHERE p15.valeur > 0
+            ORDER BY evolution_pct DESC
+            LIMIT 5
+        """,
+        "headers": ["Commune", "Département", "Pop 2015", "Pop 2021", "Évolution (%)"]
+    },
+
+    "densite_departement": {
+        "titre": "Densité de population par département",
+        "requete": """
+            SELECT
+                d.name as departement,
+                ROUND(SUM(pop.valeur) / NULLIF(SUM(surf.valeur), 0), 2) as densite
+            FROM departement d
+            JOIN commune c ON d.dep_id = c.dep_id
+            JOIN statistique pop ON c.com_id = pop.com_id
+            JOIN type_statistique tpop ON pop.type_id = tpop.id
+            JOIN statistique surf ON c.com_id = surf.com_id
+            JOIN type_statistique tsurf ON surf.type_id = tsurf.id
+            WHERE tpop.nom = 'P21_POP' AND tsurf.nom = 'SUPERF'
+            GROUP BY d.dep_id, d.name
+            ORDER BY densite DESC
+            LIMIT 5
+        """,
+        "headers": ["Département", "Densité (hab/km²)"]
+    },
+
+    # Mêmes résultats lus dans le classement précalculé (classements.py), sans tri du
+    # résultat de la jointure ; les requêtes ci-dessus restent la référence sur statistique
+    "communes_au_dessus_classement": {
+        "requete": """
+            SELECT nom, valeur as population
+            FROM classement
+            WHERE critere = 'population' AND niveau = 'commune'
+            AND parent = $1
+            AND valeur > $2
+            ORDER BY rang_parent
+        """,
+        "headers": ["Commune", "Population"]
+    },
+
+    "top_communes_classement": {
+        "titre": "Top 5 des communes les plus peuplées (2021)",
+        "requete": """
+            SELECT cl.nom as commune, d.name as departement, cl.valeur as population
+            FROM classement cl
+            JOIN departement d ON cl.parent = d.dep_id
+            WHERE cl.critere = 'population' AND cl.niveau = 'commune'
+            AND cl.rang <= 5
+            ORDER BY cl.rang
+        """,
+        "headers": ["Commune", "Département", "Population"]
+    },
+
+    "densite_departement_classement": {
+        "titre": "Densité de population par département",
+        "requete": """
+            SELECT nom as departement, ROUND(valeur, 2) as densite
+            FROM classement
+            WHERE critere = 'densite' AND niveau = 'departement'
+            AND rang <= 5
+            ORDER BY rang
+        """,
+        "headers": ["Département", "Densité (hab/km²)"]
+    }
+}
+
+# Ordre d'affichage des rapports d'exploration
+RAPPORTS_EXPLORATION = [
+    "top_communes_2021",
+    "population_region_2021",
+    "evolution_2015_2021",
+    "densite_departement",
+]
+
+# Variante lue dans le classement d'une entrée du catalogue, exécutée à sa place
+# tant que les classements sont à jour (ServiceRequetes.lecture)
+LECTURES_CLASSEMENT = {
+    "communes_au_dessus": "communes_au_dessus_classement",
+    "top_communes_2021": "top_communes_classement",
+    "densite_departement": "densite_departement_classement",
+}
+
+
+def cle_requete(nom, params):
+    """Clé hachable d'une requête et de ses paramètres (les listes deviennent des tuples)"""
+    return (nom, tuple(tuple(p) if isinstance(p, list) else p for p in params))
+
+
+def parametres_nommes(requete, params):
+    """Requête $1, $2... réécrite pour psycopg2 (%(p1)s, %(p2)s...) avec le dictionnaire associé
+
+    Sert aux curseurs nommés : DECLARE ... CURSOR ne peut pas s'appuyer sur une requête préparée.
+    """
+    requete = re.sub(r'\$(\d+)', r'%(p\1)s', requete.replace('%', '%%'))
+    return requete, {f"p{i}": p for i, p in enumerate(params, start=1)}
+
+
+def regrouper(lignes, cles, nb_colonnes_cle=1):
+    """Résultat d'une requête par lot regroupé par clé, dans l'ordre des clés demandées
+
+    Les nb_colonnes_cle premières colonnes de chaque ligne forment la clé ; chaque clé
+    demandée est présente, même sans résultat.
+    """
+    groupes = {cle: [] for cle in cles}
+    for ligne in lignes:
+        cle = ligne[0] if nb_colonnes_cle == 1 else tuple(ligne[:nb_colonnes_cle])
+        groupes.setdefault(cle, []).append(tuple(ligne[nb_colonnes_cle:]))
+    return groupes
+
+
+class ConnexionPreparee(psycopg2.extensions.connection):
+    """Connexion en autocommit qui mémorise les requêtes déjà préparées"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.autocommit = True
+        self.preparees = set()
+
+
+class ServiceRequetes:
+    """Service de requêtes réutilisable : pool borné + requêtes préparées côté serveur"""
+
+    def __init__(self, db_config=None, taille_pool=5, attente_max=None):
+        self.taille_pool = taille_pool
+        self.attente_max = attente_max
+        self._pool = psycopg2.pool.ThreadedConnectionPool(
+            1, taille_pool,
+            connection_factory=ConnexionPreparee,
+            **(db_config or DB_CONFIG)
+        )
+        # ThreadedConnectionPool lève PoolError quand il est vide : on attend
+        # plutôt une place libre via un sémaphore de même taille
+        self._places = threading.BoundedSemaphore(taille_pool)
+        self._verrou = threading.Lock()
+        # Appelés après chaque exécution réussie : observateur(nom, params, durée en s) ;
+        # durée None pour un résultat servi par le cache (ServiceEnCache)
+        self.observateurs = []
+        self._compteurs = {
+            'requetes': 0,
+            'erreurs': 0,
+            'preparations': 0,
+            'attente_pool_s': 0.0,
+            'attente_pool_max_s': 0.0,
+            'execution_s': 0.0,
+            'execution_max_s': 0.0,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fermer()
+
+    def fermer(self):
+        """Ferme toutes les connexions du pool"""
+        self._pool.closeall()
+
+    @contextmanager
+    def connexion(self):
+        """Emprunte une connexion au pool (bloquant, borné par taille_pool)"""
+        debut = time.perf_counter()
+        if not self._places.acquire(timeout=self.attente_max):
+            raise psycopg2.pool.PoolError("Aucune connexion disponible dans le délai imparti")
+        conn = None
+        try:
+            conn = self._pool.getconn()
+            attente = time.perf_counter() - debut
+            with self._verrou:
+                self._compteurs['attente_pool_s'] += attente
+                self._compteurs['attente_pool_max_s'] = max(self._compteurs['attente_pool_max_s'], attente)
+            yield conn
+        finally:
+            if conn is not None:
+                self._pool.putconn(conn, close=bool(conn.closed))
+            self._places.release()
+
+    def _preparer(self, cur, conn, nom):
+        """PREPARE une requête du catalogue une seule fois par connexion"""
+        if nom not in conn.preparees:
+            cur.execute(f"PREPARE {nom} AS {CATALOGUE[nom]['requete']}")
+            conn.preparees.add(nom)
+            with self._verrou:
+                self._compteurs['preparations'] += 1
+
+    def classements_a_jour(self):
+        """Vrai si les classements précalculés reflètent la version courante des données"""
+        with self.connexion() as conn:
+            with conn.cursor() as cur:
+                return classements_a_jour(cur)
+
+    def lecture(self, nom):
+        """Entrée à exécuter pour nom : sa variante classement si elle est à jour, nom sinon"""
+        variante = LECTURES_CLASSEMENT.get(nom)
+        if variante is None or not self.classements_a_jour():
+            return nom
+        return variante
+
+    def executer(self, nom, params=()):
+        """Exécute une requête du catalogue et renvoie les lignes"""
+        if nom not in CATALOGUE:
+            raise KeyError(f"Requête inconnue: {nom}")
+
+        with self.connexion() as conn:
+            debut = time.perf_counter()
+            try:
+                with conn.cursor() as cur:
+                    self._preparer(cur, conn, nom)
+                    if params:
+                        marqueurs = ', '.join(['%s'] * len(params))
+                        cur.execute(f"EXECUTE {nom} ({marqueurs})", tuple(params))
+                    else:
+                        cur.execute(f"EXECUTE {nom}")
+                    results = cur.fetchall()
+            except Exception:
+                with self._verrou:
+                    self._compteurs['erreurs'] += 1
+                raise
+            duree = time.perf_counter() - debut
+
+        self._compter(nom, params, duree)
+        return results
+
+    def flux(self, nom, params=(), itersize=2000):
+        """Générateur des lignes d'une requête du catalogue via un curseur nommé côté serveur
+
+        Les lignes arrivent par lots de itersize : la mémoire reste bornée et la première
+        ligne est disponible sans attendre la fin de la requête. La connexion reste empruntée
+        jusqu'à épuisement (ou fermeture) du générateur ; le résultat n'est pas mis en cache.
+        """
+        if nom not in CATALOGUE:
+            raise KeyError(f"Requête inconnue: {nom}")
+        requete, valeurs = parametres_nommes(CATALOGUE[nom]["requete"], params)
+
+        with self.connexion() as conn:
+            debut = time.perf_counter()
+            # Un curseur nommé vit dans une transaction : autocommit suspendu le temps du flux
+            conn.autocommit = False
+            try:
+                with conn.cursor(name=f"flux_{nom}") as cur:
+                    cur.itersize = itersize
+                    cur.execute(requete, valeurs)
+                    yield from cur
+            except Exception:
+                with self._verrou:
+                    self._compteurs['erreurs'] += 1
+                raise
+            finally:
+                # Lecture seule : ROLLBACK ferme le curseur, y compris si le flux est abandonné
+                if not conn.closed:
+                    conn.rollback()
+                    conn.autocommit = True
+            duree = time.perf_counter() - debut
+
+        self._compter(nom, params, duree)
+
+    def _compter(self, nom, params, duree):
+        """Compteurs d'exécution et notification des observateurs (journal du conseiller d'index)"""
+        with self._verrou:
+            self._compteurs['requetes'] += 1
+            self._compteurs['execution_s'] += duree
+            self._compteurs['execution_max_s'] = max(self._compteurs['execution_max_s'], duree)
+        for observateur in self.observateurs:
+            observateur(nom, params, duree)
+
+    def compteurs(self):
+        """Renvoie une copie des compteurs d'attente pool et d'exécution"""
+        with self._verrou:
+            stats = dict(self._compteurs)
+        n = stats['requetes'] or 1
+        stats['attente_pool_moyenne_s'] = stats['attente_pool_s'] / n
+        stats['execution_moyenne_s'] = stats['execution_s'] / n
+        return stats
+
+    # Catalogue
+    def departements_region(self, region_name):
+        """Liste des départements d'une région donnée"""
+        return self.executer("departements_region", (region_name,))
+
+    def communes_au_dessus(self, department_code, min_population):
+        """Communes de plus de X habitants dans un département"""
+        return self.executer(self.lecture("communes_au_dessus"), (department_code, min_population))
+
+    def taux_croissance(self, start_year, end_year):
+        """Taux de croissance démographique par région"""
+        return self.executer("taux_croissance", (f'P{start_year}_POP', f'P{end_year}_POP'))
+
+    def departements_regions(self, region_names):
+        """Départements de plusieurs régions en une requête : {région: lignes}"""
+        region_names = list(region_names)
+        return regrouper(self.executer("departements_regions", (region_names,)), region_names)
+
+    def communes_au_dessus_lot(self, department_codes, min_population):
+        """Communes au-dessus d'un seuil pour plusieurs départements en une requête
+
+        min_population est un seuil commun (résultat {département: lignes}) ou une liste
+        de seuils, un par département (résultat {(département, seuil): lignes}).
+        """
+        department_codes = list(department_codes)
+        if isinstance(min_population, (list, tuple)):
+            seuils = list(min_population)
+            if len(seuils) != len(department_codes):
+                raise ValueError("Un seuil par département attendu")
+            cles = list(zip(department_codes, seuils))
+        else:
+            seuils = [min_population] * len(department_codes)
+            cles = department_codes
+
+        # rang = position de la demande dans les tableaux (WITH ORDINALITY)
+        lignes = self.executer("communes_au_dessus_lot", (department_codes, seuils))
+        return regrouper([(cles[rang - 1], *ligne) for rang, *ligne in lignes], cles)
+
+    def classement(self, critere, niveau, apres=None, taille=50, croissant=False, parent=None):
+        """Une page d'un classement par curseur : (lignes (rang, code, nom, valeur), curseur suivant)
+
+        apres est le curseur renvoyé par la page précédente (None : première page) ; le
+        curseur suivant vaut None à la dernière page. Chaque page est une lecture d'index
+        bornée à taille lignes, quelle que soit sa position. croissant parcourt le classement
+        depuis la fin ; parent restreint aux communes d'un département ou aux départements
+        d'une région, avec le rang dans ce parent.
+        """
+        verifier_classement(critere, niveau)
+        if apres is None:
+            apres = RANG_MAX if croissant else 0
+        nom = ("classement_parent_" if parent is not None else "classement_") + \
+              ("precedent" if croissant else "suivant")
+        params = (critere, niveau, apres, taille) if parent is None else (critere, niveau, parent, apres, taille)
+        lignes = self.executer(nom, params)
+        return lignes, (lignes[-1][0] if len(lignes) == taille else None)
+
+    def position_classement(self, critere, niveau, code):
+        """(rang, parent, rang dans le parent, valeur, taille du classement) d'une entité, ou None
+
+        Le curseur de la page qui commence à l'entité est rang - 1.
+        """
+        verifier_classement(critere, niveau)
+        lignes = self.executer("classement_position", (critere, niveau, code))
+        return lignes[0] if lignes else None
+
+    def explorer(self):
+        """Résultats des rapports d'exploration, par titre"""
+        return {CATALOGUE[nom]["titre"]: self.executer(self.lecture(nom))
+                for nom in RAPPORTS_EXPLORATION}
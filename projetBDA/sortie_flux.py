@@ -0,0 +1,108 @@
+import argparse
+import csv
+import json
+import re
+import sys
+import time
+from decimal import Decimal
+from itertools import islice
+
+from tabulate import tabulate
+
+from config import DB_CONFIG
+from service_requetes import CATALOGUE, ServiceRequetes
+
+FORMATS = ('csv', 'jsonl', 'tableau')
+
+
+def _valeur_json(valeur):
+    """NUMERIC (Decimal) en entier ou flottant JSON"""
+    if isinstance(valeur, Decimal):
+        return int(valeur) if valeur == valeur.to_integral_value() else float(valeur)
+    raise TypeError(f"Type non sérialisable: {type(valeur).__name__}")
+
+
+def ecrire_csv(lignes, headers, sortie=sys.stdout):
+    """Écrit les lignes en CSV au fil de l'eau ; renvoie le nombre de lignes"""
+    ecrivain = csv.writer(sortie)
+    ecrivain.writerow(headers)
+    nb = 0
+    for ligne in lignes:
+        ecrivain.writerow(ligne)
+        nb += 1
+    return nb
+
+
+def ecrire_jsonl(lignes, headers, sortie=sys.stdout):
+    """Écrit un objet JSON par ligne (clés = en-têtes) ; renvoie le nombre de lignes
+
+    Les en-têtes doivent couvrir toutes les colonnes : zip tronquerait sinon les lignes
+    sans erreur. La largeur est vérifiée à chaque ligne.
+    """
+    nb = 0
+    for ligne in lignes:
+        if len(ligne) != len(headers):
+            raise ValueError(f"{len(headers)} en-têtes pour des lignes de {len(ligne)} colonnes: {headers}")
+        sortie.write(json.dumps(dict(zip(headers, ligne)), ensure_ascii=False, default=_valeur_json))
+        sortie.write('\n')
+        nb += 1
+    return nb
+
+
+def ecrire_tableaux(lignes, headers, sortie=sys.stdout, taille_page=50):
+    """Affiche les lignes en tableaux tabulate de taille_page lignes, page après page"""
+    lignes = iter(lignes)
+    nb = 0
+    while True:
+        page = list(islice(lignes, taille_page))
+        if not page:
+            break
+        print(tabulate(page, headers=headers, tablefmt='pretty'), file=sortie)
+        nb += len(page)
+        sortie.flush()
+    return nb
+
+
+def ecrire(lignes, headers, format='tableau', sortie=sys.stdout, **options):
+    """Écrit un flux de lignes au format demandé (csv, jsonl, tableau)"""
+    if format == 'csv':
+        return ecrire_csv(lignes, headers, sortie)
+    if format == 'jsonl':
+        return ecrire_jsonl(lignes, headers, sortie)
+    if format == 'tableau':
+        return ecrire_tableaux(lignes, headers, sortie, **options)
+    raise ValueError(f"Format inconnu: {format} (attendu: {', '.join(FORMATS)})")
+
+
+def diffuser(service, nom, params=(), format='tableau', sortie=sys.stdout, itersize=2000, **options):
+    """Exécute une requête du catalogue en curseur serveur et écrit son résultat au fil de l'eau"""
+    return ecrire(service.flux(nom, params, itersize), CATALOGUE[nom]["headers"], format, sortie, **options)
+
+
+def _parametres(nom, textes):
+    """Paramètres de ligne de commande d'une requête du catalogue
+
+    Un paramètre casté en tableau dans la requête ($1::text[]) devient une liste, même
+    d'un seul élément ('a,b' -> ['a', 'b'], 'a' -> ['a']). Les autres restent des chaînes :
+    psycopg2 les insère comme littéraux, typés par PostgreSQL selon leur usage.
+    """
+    tableaux = {int(n) for n in re.findall(r'\$(\d+)::\w+\[\]', CATALOGUE[nom]["requete"])}
+    return [texte.split(',') if rang in tableaux else texte
+            for rang, texte in enumerate(textes, start=1)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Résultat d'une requête du catalogue, écrit au fil de l'eau")
+    parser.add_argument('requete', choices=sorted(CATALOGUE), help="Nom de la requête du catalogue")
+    parser.add_argument('params', nargs='*', help="Paramètres $1, $2... ('a,b' pour un paramètre tableau)")
+    parser.add_argument('--format', choices=FORMATS, default='tableau')
+    parser.add_argument('--itersize', type=int, default=2000, help="Lignes par aller-retour serveur")
+    parser.add_argument('--taille-page', type=int, default=50, help="Lignes par tableau (format tableau)")
+    args = parser.parse_args()
+
+    options = {'taille_page': args.taille_page} if args.format == 'tableau' else {}
+    debut = time.perf_counter()
+    with ServiceRequetes(DB_CONFIG, taille_pool=1) as service:
+        nb = diffuser(service, args.requete, _parametres(args.requete, args.params), args.format,
+                      itersize=args.itersize, **options)
+    print(f"{nb} lignes en {time.perf_counter() - debut:.2f}s", file=sys.stderr)
@@ -0,0 +1,330 @@
+import re
+import statistics
+import time
+
+from psycopg2 import sql
+from tabulate import tabulate
+
+from config import avec_connexion
+from service_requetes import CATALOGUE, RAPPORTS_EXPLORATION
+
+# Rapports de explorer_donnees sur la disposition large : une colonne par indicateur,
+# plus de jointure sur type_statistique ni d'auto-jointure de statistique
+CATALOGUE_LARGE = {
+    "top_communes_2021": """
+        SELECT c.name as commune, d.name as departement, w.p21_pop as population
+        FROM statistique_large w
+        JOIN commune c ON w.com_id = c.com_id
+        JOIN departement d ON c.dep_id = d.dep_id
+        WHERE w.p21_pop IS NOT NULL
+        ORDER BY w.p21_pop DESC
+        LIMIT 5
+    """,
+
+    "population_region_2021": """
+        SELECT r.name as region, SUM(w.p21_pop) as population
+        FROM region r
+        JOIN departement d ON r.reg_id = d.reg_id
+        JOIN commune c ON d.dep_id = c.dep_id
+        JOIN statistique_large w ON c.com_id = w.com_id
+        WHERE w.p21_pop IS NOT NULL
+        GROUP BY r.reg_id, r.name
+        ORDER BY population DESC
+    """,
+
+    "evolution_2015_2021": """
+        SELECT
+            c.name as commune,
+            d.name as departement,
+            w.p15_pop as pop_2015,
+            w.p21_pop as pop_2021,
+            ROUND((w.p21_pop - w.p15_pop) * 100.0 / w.p15_pop, 2) as evolution_pct
+        FROM statistique_large w
+        JOIN commune c ON w.com_id = c.com_id
+        JOIN departement d ON c.dep_id = d.dep_id
+        WHERE w.p15_pop > 0 AND w.p21_pop IS NOT NULL
+        ORDER BY evolution_pct DESC
+        LIMIT 5
+    """,
+
+    "densite_departement": """
+        SELECT
+            d.name as departement,
+            ROUND(SUM(w.p21_pop) / NULLIF(SUM(w.superf), 0), 2) as densite
+        FROM departement d
+        JOIN commune c ON d.dep_id = c.dep_id
+        JOIN statistique_large w ON c.com_id = w.com_id
+        WHERE w.p21_pop IS NOT NULL AND w.superf IS NOT NULL
+        GROUP BY d.dep_id, d.name
+        ORDER BY densite DESC
+        LIMIT 5
+    """,
+}
+
+
+def colonnes_indicateurs(cur):
+    """Indicateurs migrables : (type_id, nom de colonne, année, année de fin) pour chaque type
+
+    Un type présent avec plusieurs périodes ne tient pas dans une seule colonne : il est
+    signalé et laissé de côté. Un type sans valeur n'a pas encore de période : il n'est
+    migré qu'une fois chargé (basculer_vers_large refuse la bascule d'ici là).
+    """
+    cur.execute("""
+        SELECT ts.id, ts.nom, MIN(s.annee), MIN(s.annee_fin),
+               COUNT(DISTINCT (COALESCE(s.annee, -1), COALESCE(s.annee_fin, -1)))
+        FROM type_statistique ts
+        JOIN statistique s ON s.type_id = ts.id
+        GROUP BY ts.id, ts.nom
+        ORDER BY ts.id
+    """)
+    colonnes = []
+    for type_id, nom, annee, annee_fin, nb_periodes in cur.fetchall():
+        if nb_periodes > 1:
+            print(f"Type {nom}: {nb_periodes} périodes distinctes - non migré")
+            continue
+        colonne = re.sub(r'[^a-z0-9_]', '_', nom.lower())
+        colonnes.append((type_id, colonne, annee, annee_fin))
+    return colonnes
+
+
+def _pivot(colonnes, table):
+    """INSERT dans statistique_large depuis une table EAV (alias s), une ligne par commune"""
+    return sql.SQL("INSERT INTO statistique_large (com_id, {}) SELECT s.com_id, {} FROM {} s").format(
+        sql.SQL(', ').join(sql.Identifier(colonne) for _, colonne, _, _ in colonnes),
+        sql.SQL(', ').join(
+            sql.SQL("MAX(s.valeur) FILTER (WHERE s.type_id = {})").format(sql.Literal(type_id))
+            for type_id, _, _, _ in colonnes
+        ),
+        table
+    )
+
+
+def installer_maintenance_large(cur, colonnes):
+    """Triggers sur la table EAV : les communes touchées par un ordre sont recalculées dans statistique_large
+
+    Un déclenchement par ordre (tables de transition), comme les agrégats de question5.sql ;
+    la table EAV est désignée par TG_TABLE_NAME et reste la source après un renommage.
+    """
+    # Table EAV laissée en %I : complétée par format() à l'exécution
+    inserer = sql.SQL("{} WHERE s.com_id = ANY($1) GROUP BY s.com_id").format(_pivot(colonnes, sql.SQL('%I')))
+    cur.execute(sql.SQL("""
+        CREATE OR REPLACE FUNCTION rafraichir_statistique_large(table_eav TEXT, communes INTEGER[])
+        RETURNS VOID AS $$
+        BEGIN
+            DELETE FROM statistique_large WHERE com_id = ANY(communes);
+            EXECUTE format({}, table_eav) USING communes;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE OR REPLACE FUNCTION maj_statistique_large()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                PERFORM rafraichir_statistique_large(TG_TABLE_NAME, ARRAY(SELECT DISTINCT com_id FROM nouvelles));
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                PERFORM rafraichir_statistique_large(TG_TABLE_NAME, ARRAY(SELECT DISTINCT com_id FROM anciennes));
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS tr_large_insert ON statistique;
+        DROP TRIGGER IF EXISTS tr_large_update ON statistique;
+        DROP TRIGGER IF EXISTS tr_large_delete ON statistique;
+
+        CREATE TRIGGER tr_large_insert AFTER INSERT ON statistique
+        REFERENCING NEW TABLE AS nouvelles
+        FOR EACH STATEMENT EXECUTE FUNCTION maj_statistique_large();
+
+        CREATE TRIGGER tr_large_update AFTER UPDATE ON statistique
+        REFERENCING OLD TABLE AS anciennes NEW TABLE AS nouvelles
+        FOR EACH STATEMENT EXECUTE FUNCTION maj_statistique_large();
+
+        CREATE TRIGGER tr_large_delete AFTER DELETE ON statistique
+        REFERENCING OLD TABLE AS anciennes
+        FOR EACH STATEMENT EXECUTE FUNCTION maj_statistique_large();
+    """).format(sql.Literal(inserer.as_string(cur))))
+
+
+def migrer_vers_large(conn):
+    """Crée statistique_large (une ligne par commune, une colonne typée par indicateur) et la remplit
+
+    Elle est ensuite tenue à jour par triggers à chaque chargement de la table EAV.
+    """
+    debut = time.perf_counter()
+    try:
+        with conn.cursor() as cur:
+            if _table_eav(cur) != 'statistique':
+                raise RuntimeError("Disposition large déjà active : revenir_a_eav() avant de migrer")
+            colonnes = colonnes_indicateurs(cur)
+
+            # 1. Table large + correspondance colonne -> (type, période) pour la vue de compatibilité
+            cur.execute("DROP VIEW IF EXISTS statistique_compat")
+            cur.execute("DROP TABLE IF EXISTS statistique_large")
+            cur.execute(sql.SQL("""
+                CREATE TABLE statistique_large (
+                    com_id INTEGER PRIMARY KEY REFERENCES commune(com_id),
+                    {}
+                )
+            """).format(sql.SQL(', ').join(
+                sql.SQL("{} NUMERIC").format(sql.Identifier(colonne)) for _, colonne, _, _ in colonnes
+            )))
+            cur.execute("DROP TABLE IF EXISTS colonne_statistique")
+            cur.execute("""
+                CREATE TABLE colonne_statistique (
+                    type_id INTEGER PRIMARY KEY REFERENCES type_statistique(id),
+                    colonne VARCHAR(63) NOT NULL UNIQUE,
+                    annee INTEGER,
+                    annee_fin INTEGER
+                )
+            """)
+            cur.executemany(
+                "INSERT INTO colonne_statistique (type_id, colonne, annee, annee_fin) VALUES (%s, %s, %s, %s)",
+                colonnes
+            )
+
+            # 2. Pivot EAV -> large en une seule agrégation
+            cur.execute(sql.SQL("{} GROUP BY s.com_id").format(_pivot(colonnes, sql.Identifier('statistique'))))
+            nb_communes = cur.rowcount
+            cur.execute("ANALYZE statistique_large")
+
+            # 3. Maintenance par triggers et vue de compatibilité au format (com_id, type_id, annee, valeur)
+            installer_maintenance_large(cur, colonnes)
+            creer_vue_compatibilite(cur, colonnes)
+        conn.commit()
+        print(f"statistique_large: {nb_communes} communes x {len(colonnes)} indicateurs "
+              f"en {time.perf_counter() - debut:.1f}s")
+        return nb_communes
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Erreur migration vers la disposition large: {str(e)}")
+        raise
+
+
+def creer_vue_compatibilite(cur, colonnes, nom_vue='statistique_compat'):
+    """Vue EAV au-dessus de statistique_large : les requêtes existantes restent valides"""
+    cur.execute(sql.SQL("""
+        CREATE OR REPLACE VIEW {} AS
+        SELECT
+            NULL::INTEGER AS id,
+            w.com_id,
+            v.type_id,
+            v.annee,
+            v.annee_fin,
+            v.valeur
+        FROM statistique_large w
+        CROSS JOIN LATERAL (VALUES {}) AS v(type_id, annee, annee_fin, valeur)
+        WHERE v.valeur IS NOT NULL
+    """).format(
+        sql.Identifier(nom_vue),
+        sql.SQL(', ').join(
+            sql.SQL("({}, {}::INTEGER, {}::INTEGER, w.{})").format(
+                sql.Literal(type_id), sql.Literal(annee), sql.Literal(annee_fin), sql.Identifier(colonne))
+            for type_id, colonne, annee, annee_fin in colonnes
+        )
+    ))
+
+
+def basculer_vers_large(conn):
+    """Bascule : statistique devient statistique_eav et une vue statistique la remplace
+
+    Refusée si des valeurs de la table EAV n'ont pas de colonne (type chargé après la
+    migration, période différente) : la vue ne les restituerait pas. Pendant la bascule,
+    les chargeurs refusent d'écrire (verifier_disposition_eav).
+    """
+    try:
+        with conn.cursor() as cur:
+            if _table_eav(cur) != 'statistique':
+                raise RuntimeError("Disposition large déjà active")
+            cur.execute("""
+                SELECT DISTINCT ts.nom
+                FROM statistique s
+                JOIN type_statistique ts ON ts.id = s.type_id
+                LEFT JOIN colonne_statistique cs ON cs.type_id = s.type_id
+                WHERE cs.type_id IS NULL
+                OR s.annee IS DISTINCT FROM cs.annee
+                OR s.annee_fin IS DISTINCT FROM cs.annee_fin
+                ORDER BY ts.nom
+            """)
+            absents = [nom for (nom,) in cur.fetchall()]
+            if absents:
+                raise RuntimeError(f"Indicateurs sans colonne dans statistique_large ({', '.join(absents[:10])}) : "
+                                   f"relancer migrer_vers_large() avant de basculer")
+            cur.execute("SELECT type_id, colonne, annee, annee_fin FROM colonne_statistique ORDER BY type_id")
+            colonnes = cur.fetchall()
+            cur.execute("ALTER TABLE statistique RENAME TO statistique_eav")
+            creer_vue_compatibilite(cur, colonnes, nom_vue='statistique')
+        conn.commit()
+        print("Disposition large active : statistique est maintenant une vue")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Erreur bascule vers la disposition large: {str(e)}")
+        raise
+
+
+def revenir_a_eav(conn):
+    """Retour à la disposition EAV d'origine"""
+    with conn.cursor() as cur:
+        cur.execute("DROP VIEW IF EXISTS statistique")
+        cur.execute("ALTER TABLE statistique_eav RENAME TO statistique")
+    conn.commit()
+    print("Disposition EAV active")
+
+
+def _table_eav(cur):
+    """Nom de la table EAV réelle (statistique, ou statistique_eav après bascule)"""
+    cur.execute("SELECT to_regclass('statistique_eav') IS NOT NULL")
+    return 'statistique_eav' if cur.fetchone()[0] else 'statistique'
+
+
+def verifier_disposition_eav(conn):
+    """Lève une erreur si statistique est la vue de la disposition large (aucun chargement possible)"""
+    with conn.cursor() as cur:
+        table_eav = _table_eav(cur)
+    conn.commit()
+    if table_eav != 'statistique':
+        raise RuntimeError("Disposition large active (statistique est une vue) : revenir_a_eav() avant de charger")
+
+
+def _mesurer(cur, requete, repetitions):
+    """Médiane des temps d'exécution d'une requête (après un passage de chauffe)"""
+    cur.execute(requete)
+    lignes = cur.fetchall()
+    durees = []
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        cur.execute(requete)
+        cur.fetchall()
+        durees.append(time.perf_counter() - debut)
+    return statistics.median(durees), lignes
+
+
+def comparer_dispositions(conn, repetitions=5):
+    """Benchmark côte à côte du catalogue explorer_donnees : EAV vs large"""
+    resultats = []
+    with conn.cursor() as cur:
+        table_eav = _table_eav(cur)
+        for nom in RAPPORTS_EXPLORATION:
+            requete_eav = re.sub(r'\bstatistique\b', table_eav, CATALOGUE[nom]["requete"])
+            duree_eav, lignes_eav = _mesurer(cur, requete_eav, repetitions)
+            duree_large, lignes_large = _mesurer(cur, CATALOGUE_LARGE[nom], repetitions)
+            identiques = [tuple(l) for l in lignes_eav] == [tuple(l) for l in lignes_large]
+            resultats.append((
+                CATALOGUE[nom]["titre"],
+                f"{duree_eav * 1000:.1f}",
+                f"{duree_large * 1000:.1f}",
+                f"{duree_eav / max(duree_large, 1e-9):.1f}x",
+                'oui' if identiques else 'NON',
+            ))
+    conn.commit()
+
+    print(tabulate(resultats, headers=['Rapport', 'EAV (ms)', 'Large (ms)', 'Gain', 'Mêmes résultats'],
+                   tablefmt='pretty'))
+    return resultats
+
+
+if __name__ == "__main__":
+    avec_connexion(migrer_vers_large, comparer_dispositions)
@@ -0,0 +1,67 @@
+"""Base temporaire chargée pour les tests
+
+Chaque test travaille sur une base temporaire du serveur de config.DB_CONFIG ;
+ils sont ignorés si PostgreSQL est injoignable.
+"""
+import os
+import sys
+
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+pytest.importorskip('numpy')
+pytest.importorskip('pandas')
+
+REPERTOIRE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPERTOIRE)
+
+from benchmark import base_jetable, charger_module_import  # noqa: E402
+from config import DB_CONFIG  # noqa: E402
+
+# Communes de v_commune_2024.csv : deux dans l'Ain (01), Paris (75)
+STATISTIQUES = (
+    "CODGEO;P21_POP;P15_POP;SUPERF\n"
+    "01001;800;750;15.95\n"
+    "01002;250;240;9.15\n"
+    "75056;2100000;2200000;105.4\n"
+)
+
+
+@pytest.fixture(scope='module')
+def loader():
+    return charger_module_import()
+
+
+@pytest.fixture
+def config_base(monkeypatch):
+    """Configuration d'une base temporaire vide"""
+    try:
+        psycopg2.connect(**DB_CONFIG).close()
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"PostgreSQL injoignable: {e}")
+    monkeypatch.chdir(REPERTOIRE)  # les importeurs lisent les fichiers par leur nom
+    with base_jetable(DB_CONFIG) as config:
+        yield config
+
+
+@pytest.fixture
+def conn(loader, config_base):
+    """Connexion à la base temporaire, schéma créé et référentiel chargé"""
+    conn = psycopg2.connect(**config_base)
+    try:
+        loader.create_tables(conn)
+        loader.import_regions(conn)
+        loader.import_departements(conn)
+        loader.import_niveaux(conn)
+        loader.import_communes(conn)
+        loader.importer_types_statistiques(conn)
+        yield conn
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def fichier(tmp_path):
+    chemin = tmp_path / 'base-cc-test.csv'
+    chemin.write_text(STATISTIQUES, encoding='utf-8')
+    return str(chemin)
@@ -0,0 +1,23 @@
+"""Lectures du classement précalculé et repli sur les requêtes EAV quand il est périmé"""
+from classements import classements_a_jour, rafraichir_classements
+from service_requetes import ServiceRequetes
+
+
+def test_lecture_classement_perime(conn, loader, fichier, config_base):
+    loader.importer_statistiques_communes(conn, fichier)
+    with ServiceRequetes(config_base, taille_pool=1) as service:
+        # Jamais calculé : requête EAV
+        assert service.lecture("communes_au_dessus") == "communes_au_dessus"
+        attendu = service.communes_au_dessus('01', 500)
+
+        rafraichir_classements(conn)
+        assert service.lecture("communes_au_dessus") == "communes_au_dessus_classement"
+        assert service.communes_au_dessus('01', 500) == attendu
+
+        # Chargement lancé seul : nouvelle version, classements périmés
+        loader.importer_statistiques_communes(conn, fichier)
+        with conn.cursor() as cur:
+            assert not classements_a_jour(cur)
+        conn.commit()
+        assert service.lecture("communes_au_dessus") == "communes_au_dessus"
+        assert service.lecture("taux_croissance") == "taux_croissance"
@@ -0,0 +1,98 @@
+"""Chargement de statistiques avec les triggers de maintenance des agrégats installés (question5.sql)
+
+Fixtures (base temporaire, référentiel chargé) : conftest.py
+"""
+import os
+import shutil
+
+import pytest
+
+from conftest import REPERTOIRE, STATISTIQUES
+from rollups import maintenance_differee
+
+
+def populations(conn):
+    """{(dep_id, annee): (population, nb_communes)} de population_departement"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT dep_id, annee, population, nb_communes FROM population_departement")
+        lignes = {(dep_id, annee): (population, nb) for dep_id, annee, population, nb in cur.fetchall()}
+    conn.commit()
+    return lignes
+
+
+def verifier_agregats(conn, loader):
+    """Agrégats tenus par les triggers = recalcul complet"""
+    par_deltas = populations(conn)
+    assert par_deltas[('01', 2021)] == (1050, 2)
+    assert par_deltas[('01', 2015)] == (990, 2)
+    assert par_deltas[('75', 2021)] == (2100000, 1)
+    loader.rafraichir_populations(conn)
+    assert populations(conn) == par_deltas
+
+
+@pytest.mark.parametrize('format_copy', ['texte', 'binaire'])
+def test_chargement_avec_triggers(conn, loader, fichier, format_copy):
+    charges, rejetes = loader.importer_statistiques_communes(conn, fichier, format_copy=format_copy)
+    assert (charges, rejetes) == (9, 0)
+    verifier_agregats(conn, loader)
+    # NUMERIC identiques quel que soit le format du COPY
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT s.valeur FROM statistique s
+            JOIN commune c ON c.com_id = s.com_id
+            JOIN type_statistique ts ON ts.id = s.type_id
+            WHERE c.code_insee = '01001' AND ts.nom = 'SUPERF'
+        """)
+        assert str(cur.fetchone()[0]) == '15.95'
+    conn.commit()
+
+
+def test_chargement_maintenance_differee(conn, loader, fichier):
+    with maintenance_differee(conn):
+        charges, _ = loader.importer_statistiques_communes(conn, fichier)
+    assert charges == 9
+    verifier_agregats(conn, loader)
+
+
+def test_synchronisation_commune_disparue(conn, loader, fichier, tmp_path, monkeypatch):
+    """Une commune absente du nouveau fichier emporte statistiques et population_commune"""
+    loader.importer_statistiques_communes(conn, fichier)
+
+    # Référentiel courant sans la commune 01002, statistiques sans elle
+    source = tmp_path / 'source'
+    source.mkdir()
+    for nom in ('v_region_2024.csv', 'v_departement_2024.csv'):
+        shutil.copy(os.path.join(REPERTOIRE, nom), source / nom)
+    with open(os.path.join(REPERTOIRE, 'v_commune_2024.csv'), encoding='utf-8') as f:
+        communes = [ligne for ligne in f if not ligne.startswith('"COM","01002"')]
+    (source / 'v_commune_2024.csv').write_text(''.join(communes), encoding='utf-8')
+    statistiques = ''.join(l + '\n' for l in STATISTIQUES.splitlines() if not l.startswith('01002'))
+    (source / 'base-cc-test.csv').write_text(statistiques, encoding='utf-8')
+
+    monkeypatch.chdir(source)
+    with maintenance_differee(conn):
+        loader.synchroniser(conn, ['base-cc-test.csv'])
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM commune WHERE code_insee = '01002'")
+        assert cur.fetchone()[0] == 0
+    conn.commit()
+    assert populations(conn)[('01', 2021)] == (800, 1)
+
+
+def test_create_tables_sans_recalcul(conn, loader, fichier):
+    """Un second create_tables ne recalcule les agrégats que si les scripts ont changé"""
+    loader.importer_statistiques_communes(conn, fichier)
+    with conn.cursor() as cur:
+        cur.execute("UPDATE population_departement SET population = 0 WHERE dep_id = '01' AND annee = 2021")
+    conn.commit()
+
+    loader.create_tables(conn)
+    assert populations(conn)[('01', 2021)] == (0, 2)
+
+    # Empreinte effacée : réinstallation et recalcul complet
+    with conn.cursor() as cur:
+        cur.execute("COMMENT ON FUNCTION appliquer_deltas_population() IS NULL")
+    conn.commit()
+    loader.create_tables(conn)
+    assert populations(conn)[('01', 2021)] == (1050, 2)
@@ -0,0 +1,80 @@
+import psycopg2
+
+# Canal NOTIFY : la nouvelle version est envoyée au COMMIT de chaque import
+CANAL_VERSION = 'version_donnees'
+
+
+def installer_version(cur):
+    """Table à une ligne portant le compteur de version des données"""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS version_donnees (
+        id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+        version BIGINT NOT NULL DEFAULT 0,
+        source VARCHAR(100),
+        date_maj TIMESTAMP NOT NULL DEFAULT now()
+    );
+    INSERT INTO version_donnees (id) VALUES (TRUE) ON CONFLICT (id) DO NOTHING;
+    """)
+
+
+def incrementer_version(cur, source=None):
+    """Incrémente la version dans la transaction de l'import
+
+    La mise à jour et le NOTIFY ne sont visibles qu'au COMMIT : un lecteur ne voit jamais
+    la nouvelle version avant les données qui la justifient.
+    """
+    cur.execute("""
+        UPDATE version_donnees
+        SET version = version + 1, source = %s, date_maj = now()
+        RETURNING version
+    """, (source,))
+    version = cur.fetchone()[0]
+    cur.execute("SELECT pg_notify(%s, %s)", (CANAL_VERSION, str(version)))
+    return version
+
+
+def lire_version(conn):
+    """Version courante des données (None si la table n'existe pas encore)"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('version_donnees') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            version = None
+        else:
+            cur.execute("SELECT version FROM version_donnees")
+            ligne = cur.fetchone()
+            version = ligne[0] if ligne else None
+    if not conn.autocommit:
+        conn.commit()
+    return version
+
+
+class EcouteVersion:
+    """Suit la version des données par LISTEN, avec relecture périodique en secours
+
+    La connexion est dédiée (LISTEN est propre à la session) et jamais bloquante :
+    version() consomme les notifications reçues puis renvoie la dernière version connue.
+    """
+
+    def __init__(self, db_config, intervalle_relecture=30.0):
+        self._conn = psycopg2.connect(**db_config)
+        self._conn.autocommit = True
+        with self._conn.cursor() as cur:
+            cur.execute(f"LISTEN {CANAL_VERSION}")
+        self.intervalle_relecture = intervalle_relecture
+        self._version = lire_version(self._conn)
+        self._derniere_lecture = 0.0
+
+    def version(self, maintenant):
+        self._conn.poll()
+        if self._conn.notifies:
+            self._version = max(int(n.payload) for n in self._conn.notifies)
+            self._conn.notifies.clear()
+            self._derniere_lecture = maintenant
+        elif maintenant - self._derniere_lecture >= self.intervalle_relecture:
+            # Notification perdue (reconnexion, import sans NOTIFY...) : relecture
+            self._version = lire_version(self._conn)
+            self._derniere_lecture = maintenant
+        return self._version
+
+    def fermer(self):
+        self._conn.close()